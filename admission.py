@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Admission control for the bridge servers
+Keeps a misbehaving client from piling work onto a phone-class host: each
+client gets a request rate, and the bridge as a whole a budget of commands
+in flight. Requests over either limit are turned away at once with a
+Retry-After, instead of queueing up memory and latency for everyone
+"""
+
+import collections
+import math
+import threading
+import time
+
+import metrics
+
+DEFAULT_MAX_PENDING = 1024
+DEFAULT_CLIENT_RATE = 0.0
+DEFAULT_CLIENT_BURST = 50
+# Clients whose buckets are remembered; the least recently seen are forgotten
+MAX_TRACKED_CLIENTS = 1024
+# What a refused request is told when no better estimate is known
+RETRY_AFTER = 1
+
+ADMISSION_REJECTED = metrics.registry.counter(
+    'bridge_admission_rejected_total', 'Requests turned away by admission control', ('reason',))
+PENDING_COMMANDS = metrics.registry.gauge(
+    'bridge_pending_commands', 'Commands accepted and not yet answered')
+
+
+class AdmissionControl:
+    """Per-client request rate and a bridge-wide budget of pending commands
+
+    ``admit_client`` takes a token from the client's bucket (``client_rate``
+    requests per second, ``client_burst`` at once; a rate of 0 means
+    unlimited) and returns 0, or the seconds until the client may retry.
+    ``reserve`` counts commands against ``max_pending`` (0 for no limit)
+    until they are ``release``d, returning 0 or the seconds to retry after.
+    """
+
+    def __init__(self, max_pending=DEFAULT_MAX_PENDING, client_rate=DEFAULT_CLIENT_RATE,
+                 client_burst=DEFAULT_CLIENT_BURST):
+        self.max_pending = max_pending
+        self.client_rate = client_rate
+        self.client_burst = max(1, client_burst)
+        self.pending = 0
+        self.rejected = collections.Counter()
+        self._buckets = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def admit_client(self, client):
+        if self.client_rate <= 0:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            tokens, refilled = self._buckets.pop(client, (float(self.client_burst), now))
+            tokens = min(self.client_burst, tokens + (now - refilled) * self.client_rate)
+            admitted = tokens >= 1
+            if admitted:
+                tokens -= 1
+            self._buckets[client] = (tokens, now)
+            while len(self._buckets) > MAX_TRACKED_CLIENTS:
+                self._buckets.popitem(last=False)
+            if admitted:
+                return 0
+            self.rejected['client_rate'] += 1
+        ADMISSION_REJECTED.inc(reason='client_rate')
+        return max(1, math.ceil((1 - tokens) / self.client_rate))
+
+    def reserve(self, count):
+        with self._lock:
+            if self.max_pending <= 0 or self.pending + count <= self.max_pending:
+                self.pending += count
+                return 0
+            self.rejected['pending'] += 1
+        ADMISSION_REJECTED.inc(reason='pending')
+        return RETRY_AFTER
+
+    def release(self, count):
+        with self._lock:
+            self.pending -= count
+
+    def reject(self, reason):
+        """Count a request refused elsewhere, e.g. for its size"""
+        with self._lock:
+            self.rejected[reason] += 1
+        ADMISSION_REJECTED.inc(reason=reason)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': self.pending,
+                'max_pending': self.max_pending,
+                'client_rate': self.client_rate,
+                'client_burst': self.client_burst,
+                'clients': len(self._buckets),
+                'rejected': dict(self.rejected)
+            }
@@ -4,117 +4,107 @@ Advanced HTTP bridge server that automatically forwards messages to ESP32
 via Serial Terminal app using Android's accessibility service
 """
 
-from http.server import HTTPServer, BaseHTTPRequestHandler
-import json
-import time
-import subprocess
 import os
+import bridge_core
+import bridge_log
+import command_ring
+import esp32_link
+import transports
+from bridge_core import BaseBridgeHandler
 
-class AdvancedBridgeHandler(BaseHTTPRequestHandler):
-    def do_GET(self):
-        if self.path == '/get_status':
-            response = {
-                'status': 'connected',
-                'message': 'ESP32 Advanced Bridge Ready',
-                'timestamp': time.time()
-            }
-            
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.end_headers()
-            self.wfile.write(json.dumps(response).encode())
-        else:
-            self.send_response(404)
-            self.end_headers()
-    
-    def do_POST(self):
-        if self.path == '/send_command':
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            data = json.loads(post_data.decode('utf-8'))
-            
-            command = data.get('command', '')
-            print(f"🚀 Received command: {command}")
-            
-            # Forward to ESP32 via Serial Terminal
-            success = self.forward_to_esp32(command)
-            
-            response = {
-                'status': 'success' if success else 'error',
-                'message': f'Command "{command}" {"sent to ESP32" if success else "failed to send"}',
-                'timestamp': time.time()
-            }
-            
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.end_headers()
-            self.wfile.write(json.dumps(response).encode())
-        else:
-            self.send_response(404)
-            self.end_headers()
+log = bridge_log.get_logger('advanced_bridge')
+
+class AdvancedBridgeHandler(BaseBridgeHandler):
+    status_message = 'ESP32 Advanced Bridge Ready'
+    transport = None
+    link = None
+
+    def get_status(self):
+        status = super().get_status()
+        status['link'] = self.link.health()
+        if hasattr(self.transport, 'stats'):
+            # Which forwarding methods work, and how fast
+            status['forwarding'] = self.transport.stats()
+        return status
+
+    def collect_metrics(self):
+        super().collect_metrics()
+        esp32_link.record_health_metrics(self.link.health())
+
+    def handle_command(self, command):
+        log.info("🚀 Received command: %s", command, extra=bridge_log.fields(sampled=True, command=command))
+        
+        # Forward to ESP32 via Serial Terminal
+        success = self.forward_to_esp32(command)
+        
+        return {
+            'status': 'success' if success else 'error',
+            'message': f'Command "{command}" {"sent to ESP32" if success else "failed to send"}'
+        }
     
-    def do_OPTIONS(self):
-        self.send_response(200)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'POST, GET, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        self.end_headers()
+    def handle_commands(self, commands):
+        log.info("🚀 Received batch of %d commands", len(commands),
+                 extra=bridge_log.fields(sampled=True, commands=len(commands)))
+        
+        # Forward the whole batch as one newline-delimited stream
+        success = self.forward_to_esp32('\n'.join(commands))
+        
+        return [{
+            'command': command,
+            'status': 'success' if success else 'error',
+            'message': f'Command "{command}" {"sent to ESP32" if success else "failed to send"}'
+        } for command in commands]
     
     def forward_to_esp32(self, message):
         """Forward message to ESP32 via Serial Terminal app"""
         try:
-            print(f"📤 Forwarding to ESP32: {message}")
-            
-            # Method 1: Try using Android's input command (if available)
-            try:
-                # This would work if we have root access or proper permissions
-                subprocess.run([
-                    'am', 'broadcast', '-a', 'com.serialterminal.SEND_MESSAGE',
-                    '--es', 'message', message
-                ], check=True, timeout=5)
-                print("✅ Message sent via broadcast")
-                return True
-            except:
-                pass
-            
-            # Method 2: Write to a file that Serial Terminal can read
-            try:
-                with open('/sdcard/Download/esp32_message.txt', 'w') as f:
-                    f.write(message)
-                print("✅ Message written to file")
+            log.info("📤 Forwarding to ESP32: %s", message, extra=bridge_log.fields(sampled=True, message=message))
+            if self.link.send(message):
                 return True
-            except:
-                pass
             
-            # Method 3: Use Android's input text (simulates typing)
-            try:
-                # This simulates typing the message
-                subprocess.run([
-                    'input', 'text', message
-                ], check=True, timeout=5)
-                print("✅ Message typed via input")
-                return True
-            except:
-                pass
-            
-            print("❌ All forwarding methods failed")
+            log.error("❌ Error forwarding message: %s", self.link.last_error,
+                      extra=bridge_log.fields(error=self.link.last_error))
             return False
             
         except Exception as e:
-            print(f"❌ Error forwarding message: {e}")
+            log.error("❌ Error forwarding message: %s", e, extra=bridge_log.fields(error=str(e)))
             return False
 
-def run_server(port=8080):
-    server_address = ('', port)
-    httpd = HTTPServer(server_address, AdvancedBridgeHandler)
-    print("🚀 Advanced ESP32 Bridge Server Starting...")
-    print(f"📱 Server running on: http://localhost:{port}")
-    print("🔗 Connect your Flutter app now!")
-    print("📤 Messages will be automatically forwarded to ESP32")
-    print("⏹️  Press Ctrl+C to stop")
-    httpd.serve_forever()
+def make_transport():
+    """The forwarding methods, in the order they are first tried
+
+    ESP32_TRANSPORT overrides them (see transports.make_transport).
+    """
+    if os.environ.get('ESP32_TRANSPORT'):
+        return transports.make_transport(os.environ['ESP32_TRANSPORT'])
+    return transports.FallbackTransport([
+        # Method 1: Serial Terminal's broadcast receiver (needs root or permissions)
+        transports.broadcast_transport(),
+        # Method 2: queue it for the sender scripts to pick up
+        transports.RingTransport(),
+        # Method 3: simulate typing the message
+        transports.input_text_transport()
+    ])
+
+def run_server(port=8080, engine=bridge_core.DEFAULT_ENGINE, **options):
+    # One link serialises the handler threads' writes onto the transport
+    AdvancedBridgeHandler.transport = make_transport()
+    AdvancedBridgeHandler.link = esp32_link.ESP32Link(AdvancedBridgeHandler.transport.connect,
+                                                      send_timeout=transports.FALLBACK_SEND_TIMEOUT,
+                                                      on_event=bridge_core.events.publish).start()
+    # Commands forwarded through the ring report back from the sender scripts
+    try:
+        command_ring.follow_events('advanced_bridge', bridge_core.events.publish)
+    except OSError as e:
+        log.warning(f"⚠️  Not following sender events: {e}")
+    httpd = bridge_core.make_server(AdvancedBridgeHandler, port, engine, **options)
+    log.info("🚀 Advanced ESP32 Bridge Server Starting...")
+    log.info(f"📱 Server running on: http://localhost:{port}")
+    log.info(f"⚙️  Engine: {engine}")
+    log.info("🔗 Connect your Flutter app now!")
+    log.info("📤 Messages will be automatically forwarded to ESP32")
+    log.info("⏹️  Press Ctrl+C to stop")
+    bridge_core.serve(httpd)
 
 if __name__ == '__main__':
-    run_server()
+    run_server(**vars(bridge_core.parse_server_args(__doc__)))
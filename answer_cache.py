@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Cached answers to the ESP32's query commands (WEATHER?, TIME?, JOKE?, ...)
+Asks Gemini the same prompts as lib/gemini_service.dart, simplifies the
+answer for the OLED the same way, and keeps it for a while per query, so
+repeated queries are answered from memory instead of a model round trip
+
+Configured from the environment:
+    GEMINI_API_KEY   the API key (not needed for a local stub)
+    GEMINI_BASE_URL  where generateContent lives, e.g. gemini_stub.py's
+                     http://127.0.0.1:9760/v1beta (default: Google's API)
+    GEMINI_MODEL     the model asked (default: gemini-2.0-flash)
+"""
+
+import collections
+import json
+import os
+import re
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import bridge_log
+import metrics
+
+log = bridge_log.get_logger(__name__)
+
+DEFAULT_BASE_URL = 'https://generativelanguage.googleapis.com/v1beta'
+DEFAULT_MODEL = 'gemini-2.0-flash'
+UPSTREAM_TIMEOUT = 15.0
+MAX_ENTRIES = 128
+# How long past its TTL an answer is still served while a fresh one is fetched
+STALE_GRACE = 3600.0
+DEFAULT_TTL = 60.0
+
+# (keyword, prompt, seconds an answer stays fresh), matched in this order
+# like GeminiService._mapRequestToPrompt; a None prompt is answered statically
+QUERIES = (
+    ('WEATHER', 'What is the current weather? Give a brief summary.', 600.0),
+    ('TIME', 'What time is it now? Give just the time.', 30.0),
+    ('DATE', "What is today's date? Give just the date.", 600.0),
+    ('HELLO', 'Say hello in a friendly way.', 3600.0),
+    ('JOKE', 'Tell me a short joke.', 300.0),
+    ('QUOTE', 'Give me an inspirational quote.', 3600.0),
+    ('HELP', None, None),
+)
+STATIC_ANSWERS = {'HELP': 'WEATHER TIME DATE HELLO JOKE QUOTE'}
+MAX_QUERY_LENGTH = 200
+
+CACHE_REQUESTS = metrics.registry.counter(
+    'bridge_answer_cache_requests_total', 'Query answers served, by how the cache served them',
+    ('result',))
+UPSTREAM_DURATION = metrics.registry.histogram(
+    'bridge_answer_upstream_duration_seconds', 'Time for the model to answer a query')
+UPSTREAM_ERRORS = metrics.registry.counter(
+    'bridge_answer_upstream_errors_total', 'Model requests that failed')
+
+_FILLER_WORDS = re.compile(r'\b(the|and|or|but|in|on|at|to|for|of|with|by)\b', re.IGNORECASE)
+
+
+class UpstreamError(Exception):
+    """The model could not be asked, or gave no usable answer"""
+
+
+def resolve_query(query):
+    """Return (key, prompt, ttl) for a query as the robot sends it
+
+    Queries mentioning the same keyword share one cache entry; anything
+    else is asked as written, like the app does, and cached for DEFAULT_TTL.
+    """
+    query = query.strip().upper()
+    for keyword, prompt, ttl in QUERIES:
+        if keyword in query:
+            return keyword, prompt, ttl
+    return query, query.replace('?', ''), DEFAULT_TTL
+
+
+def simplify_for_oled(text):
+    """Squeeze an answer onto the OLED, as GeminiService._simplifyForOLED does"""
+    simplified = ' '.join(text.split())
+    simplified = ' '.join(_FILLER_WORDS.sub('', simplified).split())
+    if len(simplified) > 20:
+        simplified = f'{simplified[:17]}...'
+    return simplified.upper()
+
+
+class GeminiClient:
+    """Calls the generateContent API with the app's generation settings"""
+
+    def __init__(self, base_url=DEFAULT_BASE_URL, model=DEFAULT_MODEL, api_key=None,
+                 timeout=UPSTREAM_TIMEOUT):
+        self.base_url = base_url.rstrip('/')
+        self.model = model
+        self.api_key = api_key
+        self.timeout = timeout
+
+    @classmethod
+    def from_environment(cls):
+        return cls(os.environ.get('GEMINI_BASE_URL') or DEFAULT_BASE_URL,
+                   os.environ.get('GEMINI_MODEL') or DEFAULT_MODEL,
+                   os.environ.get('GEMINI_API_KEY'))
+
+    def generate(self, prompt):
+        """Ask the model and return its answer, simplified for the OLED"""
+        if not self.api_key and self.base_url == DEFAULT_BASE_URL:
+            raise UpstreamError('GEMINI_API_KEY is not set')
+        url = f'{self.base_url}/models/{self.model}:generateContent'
+        if self.api_key:
+            url += '?' + urllib.parse.urlencode({'key': self.api_key})
+        body = json.dumps({
+            'contents': [{'parts': [{'text': prompt}]}],
+            'generationConfig': {'temperature': 0.7, 'topK': 40, 'topP': 0.95,
+                                 'maxOutputTokens': 100}
+        }).encode()
+        request = urllib.request.Request(url, body, {'Content-Type': 'application/json'})
+
+        started = time.monotonic()
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                data = json.loads(response.read())
+            text = data['candidates'][0]['content']['parts'][0]['text']
+        except (OSError, ValueError, KeyError, IndexError, TypeError) as e:
+            UPSTREAM_ERRORS.inc()
+            raise UpstreamError(f'Model request failed: {e}') from e
+        finally:
+            UPSTREAM_DURATION.observe(time.monotonic() - started)
+        return simplify_for_oled(text)
+
+
+class _Answer:
+    __slots__ = ('text', 'fetched_at', 'ttl')
+
+    def __init__(self, text, fetched_at, ttl):
+        self.text = text
+        self.fetched_at = fetched_at
+        self.ttl = ttl
+
+
+class AnswerCache:
+    """Per-query answers, each fresh for its query's TTL
+
+    ``answer`` returns (text, how, age). ``how`` is 'static' for queries
+    answered without the model, 'hit' for a fresh cached answer and 'miss'
+    when the model had to be asked; concurrent misses for one query share
+    a single request, and raise UpstreamError (counted as 'error') if it
+    fails. An answer past its TTL but within ``stale_grace`` is
+    served as 'stale' while one background request refreshes it; when the
+    model fails, the stale answer keeps being served. At most
+    ``max_entries`` answers are kept, evicting the least recently used.
+    """
+
+    def __init__(self, fetch, max_entries=MAX_ENTRIES, stale_grace=STALE_GRACE):
+        self.fetch = fetch
+        self.max_entries = max_entries
+        self.stale_grace = stale_grace
+        self.results = collections.Counter()
+        self._answers = collections.OrderedDict()
+        self._fetching = {}
+        self._lock = threading.Lock()
+
+    def answer(self, query):
+        key, prompt, ttl = resolve_query(query)
+        if prompt is None:
+            self._count('static')
+            return STATIC_ANSWERS[key], 'static', 0.0
+
+        now = time.time()
+        served = None
+        with self._lock:
+            cached = self._answers.get(key)
+            if cached is not None:
+                self._answers.move_to_end(key)
+                age = now - cached.fetched_at
+                if age <= cached.ttl:
+                    served = cached.text, 'hit', age
+                elif age <= cached.ttl + self.stale_grace:
+                    self._refresh(key, prompt, ttl)
+                    served = cached.text, 'stale', age
+            if served is None:
+                done, leader = self._fetching.get(key), False
+                if done is None:
+                    done, leader = self._fetching.setdefault(key, threading.Event()), True
+
+        if served is not None:
+            self._count(served[1])
+            return served
+        if leader:
+            try:
+                self._fetch(key, prompt, ttl)
+            except Exception:
+                self._count('error')
+                raise
+            finally:
+                done.set()
+        else:
+            done.wait()
+        with self._lock:
+            cached = self._answers.get(key)
+        if cached is None:
+            self._count('error')
+            raise UpstreamError('The model did not answer')
+        self._count('miss')
+        return cached.text, 'miss', time.time() - cached.fetched_at
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._answers), 'max_entries': self.max_entries,
+                    'fetching': len(self._fetching), 'results': dict(self.results)}
+
+    def _count(self, result):
+        with self._lock:
+            self.results[result] += 1
+        CACHE_REQUESTS.inc(result=result)
+
+    def _refresh(self, key, prompt, ttl):
+        """Refetch a stale answer in the background, once (caller holds the lock)"""
+        if key in self._fetching:
+            return
+        done = self._fetching[key] = threading.Event()
+
+        def refresh():
+            try:
+                self._fetch(key, prompt, ttl)
+            except UpstreamError as e:
+                log.warning(f"⚠️  Could not refresh the answer to {key}: {e}")
+            finally:
+                done.set()
+
+        threading.Thread(target=refresh, name=f'answer-refresh-{key}', daemon=True).start()
+
+    def _fetch(self, key, prompt, ttl):
+        try:
+            text = self.fetch(prompt)
+            with self._lock:
+                self._answers[key] = _Answer(text, time.time(), ttl)
+                self._answers.move_to_end(key)
+                while len(self._answers) > self.max_entries:
+                    self._answers.popitem(last=False)
+        finally:
+            with self._lock:
+                self._fetching.pop(key, None)
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def default_cache():
+    """The process's cache, asking the model configured in the environment"""
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = AnswerCache(GeminiClient.from_environment().generate)
+        return _default_cache
@@ -4,120 +4,84 @@ Auto Serial Sender - Automatically sends messages to Serial Terminal app
 Uses Android's accessibility service to automate the process
 """
 
-import time
 import os
-import subprocess
-import json
+import bridge_log
+import command_ring
+import esp32_link
+import esp32_protocol
+import transports
 
-def send_to_serial_terminal(message):
-    """Automatically send message to Serial Terminal app"""
-    try:
-        print(f"🚀 Auto-sending to Serial Terminal: {message}")
-        
-        # Method 1: Try using Android's input command
-        try:
-            # This simulates typing the message
-            subprocess.run([
-                'input', 'text', message
-            ], check=True, timeout=5)
-            print("✅ Message sent via input command")
-            return True
-        except Exception as e:
-            print(f"❌ Input command failed: {e}")
-        
-        # Method 2: Try using Android's am broadcast
-        try:
-            subprocess.run([
-                'am', 'broadcast', '-a', 'com.serialterminal.SEND_MESSAGE',
-                '--es', 'message', message
-            ], check=True, timeout=5)
-            print("✅ Message sent via broadcast")
-            return True
-        except Exception as e:
-            print(f"❌ Broadcast failed: {e}")
-        
-        # Method 3: Try using Android's service call
-        try:
-            subprocess.run([
-                'service', 'call', 'input', '1', 's16', message
-            ], check=True, timeout=5)
-            print("✅ Message sent via service call")
-            return True
-        except Exception as e:
-            print(f"❌ Service call failed: {e}")
-        
-        print("❌ All automatic methods failed")
-        return False
-        
-    except Exception as e:
-        print(f"❌ Error sending message: {e}")
-        return False
+log = bridge_log.get_logger('auto_serial_sender')
 
-def read_message_file():
-    """Read the latest message from the file"""
-    possible_paths = [
-        '/sdcard/Download/esp32_message.txt',
-        '/sdcard/esp32_message.txt',
-        './esp32_message.txt',
-        'esp32_message.txt'
-    ]
-    
-    for path in possible_paths:
-        try:
-            if os.path.exists(path):
-                with open(path, 'r') as f:
-                    message = f.read().strip()
-                if message:
-                    print(f"📖 Read message from {path}: {message}")
-                    return message, path
-        except:
-            continue
-    
-    return None, None
+def serial_terminal_transport():
+    """The ways of reaching Serial Terminal, in the order they are first tried
 
-def delete_message_file(file_path):
-    """Delete the message file after reading"""
-    try:
-        os.remove(file_path)
-        print(f"🗑️  Deleted message file: {file_path}")
-    except:
-        pass
+    ESP32_TRANSPORT overrides them (see transports.make_transport).
+    """
+    if os.environ.get('ESP32_TRANSPORT'):
+        return transports.make_transport(os.environ['ESP32_TRANSPORT'])
+    return transports.FallbackTransport([
+        # Method 1: simulate typing the message
+        transports.input_text_transport(),
+        # Method 2: Serial Terminal's broadcast receiver
+        transports.broadcast_transport(),
+        # Method 3: the input service
+        transports.service_call_transport()
+    ])
+
+def send_to_serial_terminal(message, link):
+    """Automatically send message to Serial Terminal app"""
+    log.info("🚀 Auto-sending to Serial Terminal: %s", message,
+             extra=bridge_log.fields(sampled=True, message=message))
+    if link.send(message):
+        return True
+    
+    log.error("❌ Error sending message: %s", link.last_error, extra=bridge_log.fields(error=link.last_error))
+    return False
 
 def main():
-    print("🤖 Auto Serial Sender Started")
-    print("📁 Watching for messages to auto-send to Serial Terminal...")
-    print("⏹️  Press Ctrl+C to stop")
+    log.info("🤖 Auto Serial Sender Started")
+    log.info("📁 Watching for messages to auto-send to Serial Terminal...")
+    log.info("⏹️  Press Ctrl+C to stop")
     
-    last_message = ""
+    consumer = command_ring.open_default_ring().consumer('auto_serial_sender')
+    transport = serial_terminal_transport()
+    link = esp32_link.ESP32Link(transport.connect,
+                                send_timeout=transports.FALLBACK_SEND_TIMEOUT,
+                                on_event=command_ring.publish_event).start()
     
     try:
         while True:
-            message, file_path = read_message_file()
+            # Sleeps until the bridge queues something (or the heartbeat is due)
+            records = consumer.wait()
             
-            if message and message != last_message:
-                print(f"🚀 New message detected: {message}")
+            for sequence, message in records:
+                log.info("🚀 New message detected (#%d): %s", sequence, message,
+                         extra=bridge_log.fields(sampled=True, sequence=sequence))
                 
                 # Try to automatically send to Serial Terminal
-                success = send_to_serial_terminal(message)
+                success = send_to_serial_terminal(message, link)
                 
+                # Serial Terminal doesn't pass the robot's reply back, so the
+                # best acknowledgement is that the message was handed over
                 if success:
-                    print("✅ Message automatically sent to Serial Terminal!")
+                    log.info("✅ Message automatically sent to Serial Terminal!", extra=bridge_log.fields(sampled=True))
+                    command_ring.publish_event(esp32_protocol.ack_event(sequence, message, 'delivered'))
                 else:
-                    print("❌ Auto-send failed - manual copy-paste required")
-                    print(f"📤 Manual: Copy this message to Serial Terminal: {message}")
+                    log.error("❌ Auto-send failed - manual copy-paste required")
+                    log.info(f"📤 Manual: Copy this message to Serial Terminal: {message}")
+                    command_ring.publish_event(esp32_protocol.ack_event(sequence, message, 'lost'))
                 
-                print("=" * 50)
                 
-                # Delete the file so we don't repeat the same message
-                if file_path:
-                    delete_message_file(file_path)
-                
-                last_message = message
-            
-            time.sleep(1)  # Check every second
+                # Mark the message as handled so we don't repeat it
+                consumer.commit()
             
     except KeyboardInterrupt:
-        print("\n⏹️  Auto Serial Sender stopped")
+        log.info("⏹️  Auto Serial Sender stopped")
+        if hasattr(transport, 'stats'):
+            log.info(f"📊 Forwarding stats: {transport.stats()}")
+    finally:
+        link.close()
 
 if __name__ == '__main__':
     main()
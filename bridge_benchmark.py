@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Load generator and benchmark for the bridge servers
+Starts each bridge locally against an in-process simulated ESP32, drives
+/get_status and /send_command from concurrent keep-alive clients and reports
+throughput, p50/p95/p99 latency per route and end-to-end delivery latency
+"""
+
+import argparse
+import collections
+import http.client
+import itertools
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+import bridge_core
+import esp32_simulator
+from metrics import latency_summary
+
+BRIDGES = ('bridge_server', 'simple_bridge', 'simple_auto_bridge', 'advanced_bridge_server',
+           'bridge_daemon')
+# Bridges that forward to the robot, and the sender each needs alongside it
+FORWARDING = {'simple_auto_bridge': 'direct_esp32_sender.py', 'advanced_bridge_server': None,
+              'bridge_daemon': None}
+DEFAULT_MIX = 'get_status:1,send_command:3'
+DEFAULT_COMMANDS = 'A1,A2,A3,PING'
+PROBE_PREFIX = 'BENCH'
+STARTUP_TIMEOUT = 10.0
+DRAIN_TIMEOUT = 5.0
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class RecordingESP32(esp32_simulator.SimulatedESP32):
+    """Simulated robot that notes when each benchmark probe arrives"""
+
+    def __init__(self, command_delay=0.0):
+        super().__init__(command_delay)
+        self.arrivals = {}
+
+    def handle_command(self, command):
+        if command.startswith(PROBE_PREFIX):
+            self.arrivals[command] = time.perf_counter()
+        return super().handle_command(command)
+
+
+class LoadResult:
+    """Latencies and outcomes of one benchmark run, per route"""
+
+    def __init__(self):
+        self.latencies = collections.defaultdict(list)
+        self.errors = collections.Counter()
+        self.probes = {}
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, route, latency, ok):
+        with self._lock:
+            self.latencies[route].append(latency)
+            if not ok:
+                self.errors[route] += 1
+
+    def summary(self, arrivals):
+        routes = {}
+        for route, latencies in sorted(self.latencies.items()):
+            routes[route] = {
+                'requests': len(latencies),
+                'errors': self.errors[route],
+                'throughput': round(len(latencies) / self.elapsed, 1) if self.elapsed else None,
+                **latency_summary(latencies)
+            }
+
+        delivered = [arrivals[probe] - sent for probe, sent in self.probes.items() if probe in arrivals]
+        end_to_end = None
+        if self.probes:
+            end_to_end = {
+                'probes': len(self.probes),
+                'delivered': len(delivered),
+                **latency_summary(delivered)
+            }
+        total = sum(len(latencies) for latencies in self.latencies.values())
+        return {
+            'requests': total,
+            'throughput': round(total / self.elapsed, 1) if self.elapsed else None,
+            'routes': routes,
+            'end_to_end': end_to_end
+        }
+
+
+def parse_mix(spec):
+    """Parse 'route:weight,...' into a repeating schedule of routes"""
+    schedule = []
+    for part in spec.split(','):
+        route, _, weight = part.strip().partition(':')
+        if route not in ('get_status', 'send_command'):
+            raise ValueError(f'Unknown route in mix: {route}')
+        schedule.extend([route] * int(weight or 1))
+    if not schedule:
+        raise ValueError('The mix has no routes')
+    return schedule
+
+
+def serve_robot(robot, server):
+    """Serve the simulated robot to one client at a time, quietly"""
+    while True:
+        client, _ = server.accept()
+        with client:
+            try:
+                robot.serve_stream(client.recv, client.sendall)
+            except ConnectionError:
+                pass
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_ready(port, process):
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'bridge exited with status {process.returncode}')
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/get_status', timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'bridge did not answer on port {port} within {STARTUP_TIMEOUT}s')
+
+
+def run_load(port, args, result):
+    """Drive the bridge from args.concurrency clients until args.requests are sent"""
+    schedule = parse_mix(args.mix)
+    commands = itertools.cycle([command.strip() for command in args.commands.split(',')])
+    counter = itertools.count()
+    lock = threading.Lock()
+
+    def next_request():
+        with lock:
+            index = next(counter)
+            if index >= args.requests:
+                return None
+            route = schedule[index % len(schedule)]
+            if route == 'get_status':
+                return route, None
+            if args.probe_every and index % args.probe_every == 0:
+                return route, f'{PROBE_PREFIX}{index}'
+            return route, next(commands)
+
+    def client():
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        try:
+            while True:
+                request = next_request()
+                if request is None:
+                    return
+                route, command = request
+                started = time.perf_counter()
+                if command is not None and command.startswith(PROBE_PREFIX):
+                    result.probes[command] = started
+                try:
+                    if route == 'get_status':
+                        connection.request('GET', '/get_status')
+                    else:
+                        connection.request('POST', '/send_command', json.dumps({'command': command}),
+                                           {'Content-Type': 'application/json'})
+                    response = connection.getresponse()
+                    body = response.read()
+                    ok = response.status == 200 and json.loads(body).get('status') != 'error'
+                    if not args.keep_alive or response.getheader('Connection') == 'close':
+                        connection.close()
+                except (OSError, http.client.HTTPException, ValueError):
+                    connection.close()
+                    ok = False
+                result.record(route, time.perf_counter() - started, ok)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=client, name=f'bench-client-{index}')
+               for index in range(args.concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    result.elapsed = time.perf_counter() - started
+
+
+def benchmark_bridge(bridge, robot, robot_port, args):
+    """Start one bridge (and its sender), load it and return the summary"""
+    port = free_port()
+    with tempfile.TemporaryDirectory(prefix='bridge-bench-') as workdir:
+        env = dict(os.environ,
+                   ESP32_RING_PATH=os.path.join(workdir, 'esp32_commands.ring'),
+                   ESP32_TRANSPORT=f'tcp://127.0.0.1:{robot_port}',
+                   ESP32_LOG_LEVEL=args.log_level)
+        log = open(os.path.join(workdir, 'bench.log'), 'w')
+        processes = []
+        try:
+            sender = FORWARDING.get(bridge)
+            if sender:
+                processes.append(subprocess.Popen([sys.executable, os.path.join(SCRIPT_DIR, sender)],
+                                                  env=env, cwd=workdir, stdout=log,
+                                                  stderr=subprocess.STDOUT))
+            bridge_process = subprocess.Popen(
+                [sys.executable, os.path.join(SCRIPT_DIR, f'{bridge}.py'), '--port', str(port),
+                 '--engine', args.engine, '--workers', str(args.workers),
+                 '--rate-limit', str(args.rate_limit)],
+                env=env, cwd=workdir, stdout=log, stderr=subprocess.STDOUT)
+            processes.append(bridge_process)
+            wait_until_ready(port, bridge_process)
+
+            result = LoadResult()
+            if bridge not in FORWARDING:
+                args = argparse.Namespace(**{**vars(args), 'probe_every': 0})
+            run_load(port, args, result)
+
+            # Let the last probes reach the robot before reading their arrival times
+            deadline = time.monotonic() + DRAIN_TIMEOUT
+            while time.monotonic() < deadline and \
+                    any(probe not in robot.arrivals for probe in result.probes):
+                time.sleep(0.05)
+            return result.summary(dict(robot.arrivals))
+        finally:
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                try:
+                    process.wait(5)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+            log.close()
+
+
+def format_report(bridge, summary):
+    lines = [f"{bridge}: {summary['requests']} requests, {summary['throughput']} req/s"]
+    for route, stats in summary['routes'].items():
+        lines.append(f"  {route:<13} {stats['requests']:>7} req  {stats['errors']:>5} err  "
+                     f"{stats['throughput']:>8} req/s  p50 {stats['p50_ms']} ms  "
+                     f"p95 {stats['p95_ms']} ms  p99 {stats['p99_ms']} ms")
+    end_to_end = summary['end_to_end']
+    if end_to_end:
+        lines.append(f"  {'to robot':<13} {end_to_end['delivered']:>7}/{end_to_end['probes']} delivered  "
+                     f"p50 {end_to_end['p50_ms']} ms  p95 {end_to_end['p95_ms']} ms  "
+                     f"p99 {end_to_end['p99_ms']} ms")
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bridges', default=','.join(BRIDGES),
+                        help='comma-separated bridges to benchmark (default: all)')
+    parser.add_argument('--requests', type=int, default=2000,
+                        help='requests per bridge (default: %(default)s)')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='concurrent clients (default: %(default)s)')
+    parser.add_argument('--mix', default=DEFAULT_MIX,
+                        help='weighted routes, e.g. get_status:1,send_command:3 (default: %(default)s)')
+    parser.add_argument('--commands', default=DEFAULT_COMMANDS,
+                        help='commands /send_command cycles through (default: %(default)s)')
+    parser.add_argument('--probe-every', type=int, default=10,
+                        help='make every Nth request a uniquely named probe command whose '
+                             'arrival at the robot is timed, 0 for none (default: %(default)s)')
+    parser.add_argument('--engine', choices=bridge_core.ENGINES, default=bridge_core.DEFAULT_ENGINE,
+                        help='bridge engine (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='bridge worker threads (default: %(default)s)')
+    parser.add_argument('--rate-limit', type=float, default=0,
+                        help='bridge command rate limit, 0 for none (default: %(default)s)')
+    parser.add_argument('--no-keep-alive', dest='keep_alive', action='store_false',
+                        help='open a new connection for every request')
+    parser.add_argument('--command-delay', type=float, default=0.0,
+                        help='seconds the simulated robot spends per command (default: %(default)s)')
+    parser.add_argument('--log-level', default='WARNING',
+                        help='log level of the bridges under test (default: %(default)s)')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    bridges = [bridge.strip() for bridge in args.bridges.split(',')]
+    for bridge in bridges:
+        if bridge not in BRIDGES:
+            parser.error(f'unknown bridge: {bridge}')
+    parse_mix(args.mix)
+
+    robot = RecordingESP32(args.command_delay)
+    server = socket.create_server(('127.0.0.1', 0))
+    robot_port = server.getsockname()[1]
+    threading.Thread(target=serve_robot, args=(robot, server), name='simulated-esp32',
+                     daemon=True).start()
+
+    results = {}
+    for bridge in bridges:
+        try:
+            results[bridge] = benchmark_bridge(bridge, robot, robot_port, args)
+        except RuntimeError as e:
+            results[bridge] = {'error': str(e)}
+        if not args.json:
+            print(format_report(bridge, results[bridge]) if 'error' not in results[bridge]
+                  else f"{bridge}: failed: {results[bridge]['error']}")
+
+    if args.json:
+        print(json.dumps({'config': vars(args), 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
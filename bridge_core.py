@@ -0,0 +1,1451 @@
+#!/usr/bin/env python3
+"""
+Shared core for the ESP32 HTTP bridge servers
+Holds the common request handler plumbing and the serving engines, so every
+bridge script only has to describe what it does with a command
+"""
+
+import argparse
+import asyncio
+import collections
+import email.utils
+import io
+import json
+import os
+import queue
+import re
+import select
+import selectors
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+import admission
+import answer_cache
+import bridge_log
+import command_scheduler
+import command_trace
+import latency_trace
+import metrics
+
+log = bridge_log.get_logger(__name__)
+
+DEFAULT_PORT = 8080
+DEFAULT_ENGINE = 'threaded'
+DEFAULT_WORKERS = 8
+KEEP_ALIVE_TIMEOUT = 10
+MAX_KEEP_ALIVE_REQUESTS = 100
+MAX_BATCH_COMMANDS = 256
+MAX_BODY_BYTES = 64 * 1024
+# Ready connections the threaded engine lets wait for a worker before refusing more
+MAX_QUEUED_CONNECTIONS = 256
+# Kept-alive connections the threaded engine watches between requests
+MAX_IDLE_CONNECTIONS = 256
+# How long a worker waits for a kept-alive client's next request before parking it
+KEEP_ALIVE_LINGER = 0.002
+# The device that sends a request's commands to every robot the bridge drives
+BROADCAST_DEVICE = 'all'
+MAX_BROADCAST_WORKERS = 32
+EVENT_HEARTBEAT_INTERVAL = 15
+EVENT_CLOSE_CHECK_INTERVAL = 1.0
+MAX_PENDING_EVENTS = 256
+# Open /events streams per server; each costs a thread (threaded) or a task
+# (asyncio) and up to MAX_PENDING_EVENTS queued events, but no pool worker
+MAX_EVENT_STREAMS = 32
+DEFAULT_ACK_TIMEOUT = 10.0
+MAX_ACK_TIMEOUT = 60.0
+MAX_RECENT_ACKS = 4096
+ENGINES = ('single', 'threaded', 'asyncio')
+# Requests to anything else are counted together, to keep the label set small
+ROUTES = ('/get_status', '/send_command', '/send_commands', '/answer', '/events', '/metrics',
+          '/debug/traces')
+
+HTTP_REQUESTS = metrics.registry.counter(
+    'bridge_http_requests_total', 'HTTP requests served', ('method', 'route', 'status'))
+HTTP_DURATION = metrics.registry.histogram(
+    'bridge_http_request_duration_seconds', 'Time to serve an HTTP request', ('method', 'route'))
+ACK_LATENCY = metrics.registry.histogram(
+    'bridge_ack_latency_seconds', 'Time from request to the robot acknowledging a command',
+    ('status',))
+LOG_DROPPED = metrics.registry.counter(
+    'bridge_log_dropped_total', 'Log records dropped because the log writer fell behind')
+SCHEDULER_QUEUED = metrics.registry.gauge(
+    'bridge_scheduler_queued_commands', 'Commands waiting for the rate limiter', ('priority',))
+EVENT_SUBSCRIBERS = metrics.registry.gauge(
+    'bridge_event_subscribers', 'Listeners on bridge events, including /events streams')
+
+# Trace IDs accepted from clients in X-Trace-Id; others get a new one
+_TRACE_ID = re.compile(r'[0-9A-Za-z._-]{1,64}')
+# The body nearly every /send_command carries: one plain command and nothing else
+_SIMPLE_COMMAND_BODY = re.compile(rb'\s*\{\s*"command"\s*:\s*"([\x20\x21\x23-\x5b\x5d-\x7e]*)"\s*\}\s*')
+
+
+class EventHub:
+    """Fans bridge events (link state, robot replies) out to /events subscribers
+
+    Subscribers are callables run on the publishing thread, so they must
+    only hand the event off. A subscriber that raises is dropped, and
+    publishing None tells every subscriber to end its stream.
+    """
+
+    def __init__(self):
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self.last_link_event = None
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def subscribe(self, callback):
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def close(self):
+        """End every open event stream, e.g. when the server stops"""
+        self.publish(None)
+
+    def publish(self, event):
+        if event is not None and event.get('type') == 'link':
+            self.last_link_event = event
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            try:
+                callback(event)
+            except Exception:
+                self.unsubscribe(callback)
+
+
+# Events of this process's bridge; see BaseBridgeHandler.stream_events
+events = EventHub()
+latency_trace.tracer.attach(events)
+
+
+class AckTable:
+    """Pending-request table pairing queued commands with their ``ack`` events
+
+    Acks are keyed by the command's queue sequence number. Recent acks are
+    kept (up to MAX_RECENT_ACKS), so a request that starts waiting after
+    its ack arrived still finds it.
+    """
+
+    def __init__(self, hub):
+        self._acks = collections.OrderedDict()
+        self._changed = threading.Condition()
+        hub.subscribe(self._on_event)
+
+    def wait(self, sequences, timeout):
+        """Wait until every sequence is acked or timeout expires; return {sequence: ack}"""
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            while True:
+                found = {sequence: self._acks[sequence] for sequence in sequences
+                         if sequence in self._acks}
+                remaining = deadline - time.monotonic()
+                if len(found) == len(sequences) or remaining <= 0:
+                    return found
+                self._changed.wait(remaining)
+
+    def _on_event(self, event):
+        if event is None or event.get('type') != 'ack':
+            return
+        with self._changed:
+            self._acks[event['sequence']] = event
+            self._acks.move_to_end(event['sequence'])
+            while len(self._acks) > MAX_RECENT_ACKS:
+                self._acks.popitem(last=False)
+            self._changed.notify_all()
+
+
+# Runs the per-device submits of broadcasts, which each wait on their robot
+_broadcast_pool = ThreadPoolExecutor(max_workers=MAX_BROADCAST_WORKERS,
+                                     thread_name_prefix='broadcast')
+
+# Acknowledgements of queued commands, fed from events; see wait_for_acks
+acks = AckTable(events)
+
+
+def format_event(event):
+    """Encode one event as a server-sent event"""
+    return f"event: {event.get('type', 'message')}\ndata: {json.dumps(event)}\n\n".encode()
+
+
+class BaseBridgeHandler(BaseHTTPRequestHandler):
+    """Request handler shared by all bridge servers
+
+    Subclasses set ``status_message`` and implement ``handle_command``,
+    which returns the ``status``/``message`` fields of the JSON reply.
+    ``/send_commands`` hands a whole batch to ``handle_commands``; override it
+    to deliver the batch as one coalesced write instead of one at a time.
+    ``/events`` streams what is published on ``bridge_core.events`` as
+    server-sent events, so clients need not poll ``/get_status``.
+    ``/metrics`` serves the process's metrics for Prometheus; subclasses
+    override ``collect_metrics`` to refresh their gauges before a scrape.
+    A server with a ``trace`` (a command_trace.TraceWriter) records every
+    accepted command request in it, for replaying later.
+    ``/debug/traces`` shows where recent and slow commands spent their
+    time (see latency_trace); a request's ``X-Trace-Id`` header names its
+    traces, and each command's result carries its ``trace_id``.
+    ``/answer`` answers the robot's queries (``{"query": "WEATHER?"}``)
+    from answer_cache, asking the model only when the cache has no answer.
+
+    Commands from both endpoints go through the server's ``scheduler``
+    (a command_scheduler.CommandScheduler), which paces them toward the
+    robot, sends control commands ahead of animations and drops animations
+    overtaken by newer ones. Requests may set ``priority`` to send their
+    commands as another class, and ``flush`` to drop waiting animations.
+    Bridges driving several robots list them in ``device_ids`` and give
+    each its own scheduler through ``scheduler_for``; requests then pick
+    one with ``device``, or all of them at once with ``"device": "all"``.
+
+    Requests may carry ``wait_for_ack`` (and ``ack_timeout``) to be answered
+    only once the robot acknowledged the queued commands, and an ``id``
+    that is echoed back, so clients can pipeline commands and still tell
+    the replies apart.
+
+    Connections are HTTP/1.1 persistent: every response carries a
+    Content-Length, idle connections are dropped after ``timeout`` seconds
+    and a connection is closed after ``max_keep_alive_requests`` requests.
+    The server object may override both via ``keep_alive_timeout`` and
+    ``max_keep_alive_requests`` attributes. Bodies over the server's
+    ``max_body_bytes`` (MAX_BODY_BYTES by default) are answered 413 without
+    being read, and the connection is closed.
+
+    A server with ``admission`` (an admission.AdmissionControl) answers 429
+    with a Retry-After to clients over their request rate, and to command
+    requests that would take the bridge over its budget of pending commands
+    or whose commands all found their scheduler queue full. A request with
+    more commands than the whole budget is answered 413 instead.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out as separate writes; with Nagle on, a kept-alive
+    # connection waits out the client's delayed ACK (~40 ms) on every response
+    disable_nagle_algorithm = True
+    timeout = KEEP_ALIVE_TIMEOUT
+    max_keep_alive_requests = MAX_KEEP_ALIVE_REQUESTS
+    status_message = 'ESP32 Bridge Ready'
+
+    def setup(self):
+        self.timeout = getattr(self.server, 'keep_alive_timeout', self.timeout)
+        self.max_keep_alive_requests = getattr(self.server, 'max_keep_alive_requests',
+                                               self.max_keep_alive_requests)
+        self.requests_handled = 0
+        super().setup()
+
+    def handle_one_request(self):
+        self.requests_handled += 1
+        self.request_started = time.time()
+        # Left unset when the connection closes before a request arrives
+        self.command = None
+        self.response_status = None
+        try:
+            super().handle_one_request()
+        finally:
+            if self.command is not None:
+                self.record_request()
+
+    def log_message(self, format, *args):
+        # The default writes a line per request to stderr, on the request path
+        log.debug(format, *args, extra=bridge_log.fields(sampled=True, client=self.client_address[0]))
+
+    def log_error(self, format, *args):
+        log.warning(format, *args, extra=bridge_log.fields(client=self.client_address[0]))
+
+    def send_response(self, code, message=None):
+        self.response_status = code
+        super().send_response(code, message)
+
+    def record_request(self):
+        path = self.path.split('?', 1)[0]
+        route = path if path in ROUTES else 'other'
+        HTTP_REQUESTS.inc(method=self.command, route=route, status=self.response_status or 0)
+        if route != '/events':  # Streams last as long as the client stays
+            HTTP_DURATION.observe(time.time() - self.request_started,
+                                  method=self.command, route=route)
+
+    def end_headers(self):
+        for keyword, value in self.keep_alive_headers():
+            self.send_header(keyword, value)
+        super().end_headers()
+
+    def keep_alive_headers(self):
+        """The Connection headers for this response, closing after the last allowed request"""
+        remaining = self.max_keep_alive_requests - self.requests_handled
+        if self.close_connection or remaining <= 0:
+            self.close_connection = True
+            return [('Connection', 'close')]
+        return [('Connection', 'keep-alive'),
+                ('Keep-Alive', f'timeout={int(self.timeout)}, max={remaining}')]
+
+    def do_GET(self):
+        if self.path != '/metrics' and not self.admit_client():
+            return
+        if self.path == '/get_status':
+            self.send_json(self.get_status())
+        elif self.path == '/events':
+            self.stream_events()
+        elif self.path == '/metrics':
+            self.send_metrics()
+        elif self.path == '/debug/traces':
+            self.send_json(latency_trace.tracer.snapshot())
+        else:
+            self.send_not_found()
+
+    def do_POST(self):
+        if not self.admit_client():
+            return
+        if self.path == '/send_command':
+            data = self.read_json_body()
+            if data is None:
+                return
+
+            try:
+                commands = [parse_command(data.get('command'))]
+                ack_timeout = parse_ack_timeout(data)
+                scheduling = parse_scheduling(data)
+                self.check_device(scheduling['device'])
+            except ValueError as e:
+                self.send_bad_request(e)
+                return
+
+            pending = self.reserve_commands(commands, scheduling['device'])
+            if pending is None:
+                return
+            try:
+                self.trace_request(commands, scheduling, ack_timeout)
+                response = self.submit_commands(commands, **scheduling,
+                                                traces=self.start_latency_traces(commands))[0]
+                if 'id' in data:
+                    response['id'] = data['id']
+                if response.get('rejected'):
+                    self.send_too_many_requests(response)
+                    return
+                if ack_timeout is not None:
+                    self.wait_for_acks([response], ack_timeout)
+                response['timestamp'] = time.time()
+                self.send_json(response)
+            finally:
+                self.release_commands(pending)
+        elif self.path == '/send_commands':
+            batch = self.read_command_batch()
+            if batch is None:
+                return
+
+            commands, ack_timeout, scheduling = batch
+            pending = self.reserve_commands(commands, scheduling['device'])
+            if pending is None:
+                return
+            try:
+                self.trace_request(commands, scheduling, ack_timeout)
+                results = self.submit_commands(commands, **scheduling,
+                                               traces=self.start_latency_traces(commands))
+                if all(result.get('rejected') for result in results):
+                    self.send_too_many_requests({'status': 'error',
+                                                 'message': f'{len(commands)} commands rejected',
+                                                 'results': results})
+                    return
+                if ack_timeout is not None:
+                    self.wait_for_acks(results, ack_timeout)
+                self.send_json({
+                    'status': 'success' if all(r['status'] == 'success' for r in results) else 'error',
+                    'message': f'{len(commands)} commands processed',
+                    'results': results,
+                    'timestamp': time.time()
+                })
+            finally:
+                self.release_commands(pending)
+        elif self.path == '/answer':
+            self.send_answer()
+        elif self.path == '/get_status':
+            self.send_json(self.get_status())
+        else:
+            self.send_not_found()
+
+    def do_OPTIONS(self):
+        # Handle CORS preflight requests
+        self.send_response(200)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'POST, GET, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def stream_events(self):
+        """Hold the connection open and write each published event to it
+
+        A bounded queue decouples the client from the publisher; a client
+        too slow to keep up is disconnected rather than buffered without
+        limit. Comment lines keep idle connections from timing out.
+
+        At most the server's ``max_event_streams`` streams are open at once;
+        others are answered 503. A server that can ``detach`` a connection
+        (the pooled one) streams on a thread of its own rather than holding
+        a worker for as long as the client stays.
+        """
+        slots = getattr(self.server, 'event_stream_slots', None)
+        if slots is not None and not slots.acquire(blocking=False):
+            self.send_json({'status': 'error', 'message': 'Too many event streams',
+                            'timestamp': time.time()}, 503,
+                           [('Retry-After', str(EVENT_HEARTBEAT_INTERVAL))])
+            return
+
+        def stream():
+            try:
+                self.write_event_stream()
+            finally:
+                if slots is not None:
+                    slots.release()
+
+        self.close_connection = True
+        detach = getattr(self.server, 'detach', None)
+        if detach is not None:
+            detach(self, stream)
+        else:
+            stream()
+
+    def write_event_stream(self):
+        pending = queue.Queue()
+
+        def deliver(event):
+            if pending.qsize() >= MAX_PENDING_EVENTS:
+                pending.put(None)
+                raise OverflowError('event stream client is too slow')
+            pending.put(event)
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+
+        events.subscribe(deliver)
+        try:
+            self.wfile.write(format_event({'type': 'status', **self.get_status()}))
+            heartbeat = time.monotonic() + EVENT_HEARTBEAT_INTERVAL
+            while True:
+                try:
+                    event = pending.get(timeout=EVENT_CLOSE_CHECK_INTERVAL)
+                except queue.Empty:
+                    # Frees the stream's slot without waiting for a write to fail
+                    if self.client_gone():
+                        break
+                    if time.monotonic() >= heartbeat:
+                        self.wfile.write(b': keep-alive\n\n')
+                        heartbeat = time.monotonic() + EVENT_HEARTBEAT_INTERVAL
+                    continue
+                if event is None:
+                    break
+                self.wfile.write(format_event(event))
+        except OSError:
+            pass
+        finally:
+            events.unsubscribe(deliver)
+
+    def client_gone(self):
+        """Whether the client has closed its end of the connection"""
+        try:
+            readable, _, _ = select.select([self.connection], [], [], 0)
+            return bool(readable) and not self.connection.recv(1, socket.MSG_PEEK)
+        except OSError:
+            return True
+
+    def get_status(self):
+        """Build the /get_status payload"""
+        status = {
+            'status': 'connected',
+            'message': self.status_message,
+            'timestamp': time.time()
+        }
+        scheduler = getattr(self.server, 'scheduler', None)
+        if scheduler is not None:
+            status['scheduler'] = scheduler.stats()
+        control = getattr(self.server, 'admission', None)
+        if control is not None:
+            status['admission'] = control.stats()
+        return status
+
+    def collect_metrics(self):
+        """Refresh gauges that are read from elsewhere rather than recorded"""
+        scheduler = getattr(self.server, 'scheduler', None)
+        if scheduler is not None:
+            for priority, queued in scheduler.stats()['queued_by_priority'].items():
+                SCHEDULER_QUEUED.set(queued, priority=priority)
+        control = getattr(self.server, 'admission', None)
+        if control is not None:
+            admission.PENDING_COMMANDS.set(control.pending)
+        EVENT_SUBSCRIBERS.set(events.subscriber_count())
+        LOG_DROPPED.set(bridge_log.dropped())
+
+    def handle_command(self, command):
+        """Deliver one command and describe the outcome"""
+        raise NotImplementedError
+
+    def wait_for_acks(self, results, timeout):
+        """Hold the reply until the robot has acknowledged each queued command
+
+        Results carrying a queue ``sequence`` get an ``ack`` (the sender's
+        acknowledgement, with its latency) or are marked as timed out;
+        results that were never queued cannot be acknowledged.
+        """
+        started = getattr(self, 'request_started', time.time())
+        # A broadcast result holds one result per device; wait for them all together
+        broadcasts = [result for result in results if 'devices' in result]
+        if broadcasts:
+            self.wait_for_acks([device_result for result in broadcasts
+                                for device_result in result['devices'].values()], timeout)
+            for result in broadcasts:
+                if any(device_result['status'] != 'success'
+                       for device_result in result['devices'].values()):
+                    result['status'] = 'error'
+            results = [result for result in results if 'devices' not in result]
+
+        queued = [result for result in results
+                  if result.get('status') == 'success' and 'sequence' in result]
+        found = acks.wait([result['sequence'] for result in queued], timeout)
+
+        for result in results:
+            if result.get('coalesced'):
+                result['ack'] = {'status': 'superseded'}
+                continue
+            if result.get('flushed'):
+                result['ack'] = {'status': 'flushed'}
+                continue
+            if result not in queued:
+                result['ack'] = {'status': 'unsupported' if result.get('status') == 'success'
+                                 else 'not_sent'}
+                continue
+            ack = found.get(result['sequence'])
+            if ack is None:
+                result['ack'] = {'status': 'timeout'}
+                result['status'] = 'error'
+                result['message'] = f'No acknowledgement from ESP32 within {timeout}s'
+                continue
+            result['ack'] = {
+                'status': ack['status'],
+                'response': ack['response'],
+                'latency_ms': round((ack['timestamp'] - started) * 1000, 1)
+            }
+            ACK_LATENCY.observe(max(0.0, ack['timestamp'] - started), status=ack['status'])
+            if ack['status'] == 'lost':
+                result['status'] = 'error'
+                result['message'] = 'Command was lost before the ESP32 acknowledged it'
+            elif ack['status'] == 'rejected':
+                result['status'] = 'error'
+                result['message'] = f"The sender could not send the command: {ack['response']}"
+
+    def admit_client(self):
+        """Check the client's request rate, answering 429 if it is over it"""
+        control = getattr(self.server, 'admission', None)
+        if control is None:
+            return True
+        retry_after = control.admit_client(self.client_address[0])
+        if not retry_after:
+            return True
+        self.discard_body()
+        self.send_too_many_requests({'status': 'error', 'message': 'Too many requests'},
+                                    retry_after)
+        return False
+
+    def reserve_commands(self, commands, device):
+        """Count commands against the pending budget, answering 429 if it is spent
+
+        A request larger than the whole budget could never be admitted, so
+        it is answered 413 rather than told to retry. Returns the number
+        reserved, for release_commands, or None.
+        """
+        control = getattr(self.server, 'admission', None)
+        if control is None:
+            return 0
+        count = len(commands) * (len(self.device_ids()) if device == BROADCAST_DEVICE else 1)
+        if 0 < control.max_pending < count:
+            control.reject('batch_size')
+            self.send_json({'status': 'error',
+                            'message': f'Too many commands in one request '
+                                       f'({count}, limit {control.max_pending})',
+                            'timestamp': time.time()}, 413)
+            return None
+        retry_after = control.reserve(count)
+        if not retry_after:
+            return count
+        self.send_too_many_requests({'status': 'error',
+                                     'message': f'Too many commands pending '
+                                                f'(limit {control.max_pending})'},
+                                    retry_after)
+        return None
+
+    def release_commands(self, count):
+        if count:
+            self.server.admission.release(count)
+
+    def discard_body(self):
+        """Read and drop a refused request's body, or close if it is too large to"""
+        try:
+            self.read_body()
+        except ValueError:
+            pass
+
+    def trace_request(self, commands, scheduling, ack_timeout):
+        """Record an accepted command request, if the server is tracing"""
+        trace = getattr(self.server, 'trace', None)
+        if trace is not None:
+            trace.record(self.path, commands, scheduling, ack_timeout)
+
+    def start_latency_traces(self, commands):
+        """Latency traces for a request's commands, None when it is not sampled"""
+        trace_id = self.headers.get('X-Trace-Id')
+        if trace_id is not None and not _TRACE_ID.fullmatch(trace_id):
+            trace_id = None
+        return latency_trace.tracer.start(commands, trace_id,
+                                          getattr(self, 'request_started', None))
+
+    def submit_commands(self, commands, priority=None, flush=False, device=None, traces=None):
+        """Deliver commands through the device's scheduler, if it has one"""
+        if device == BROADCAST_DEVICE:
+            return self.broadcast_commands(commands, priority, flush, traces)
+        scheduler = self.scheduler_for(device)
+        if scheduler is None:
+            return self.handle_commands(commands)
+        if traces is not None:
+            for trace in traces:
+                trace.device = device
+        results = scheduler.submit(self, commands, priority, flush, traces)
+        if traces is not None:
+            for result, trace in zip(results, traces):
+                result['trace_id'] = trace.trace_id
+        return results
+
+    def broadcast_commands(self, commands, priority=None, flush=False, traces=None):
+        """Submit commands to every device in parallel, one result per command
+
+        Each result holds every device's own result under ``devices``, so a
+        slow or disconnected robot holds up nothing but its own answer.
+        """
+        devices = self.device_ids()
+        futures = {device: _broadcast_pool.submit(
+                       self.submit_commands, commands, priority, flush, device,
+                       traces and [trace.fork(device) for trace in traces])
+                   for device in devices}
+        per_device = {device: future.result() for device, future in futures.items()}
+
+        results = []
+        for index, command in enumerate(commands):
+            device_results = {device: {**per_device[device][index], 'device': device}
+                              for device in devices}
+            sent = sum(1 for result in device_results.values() if result['status'] == 'success')
+            results.append({
+                'command': command,
+                'status': 'success' if sent == len(devices) else 'error',
+                'message': f'Sent to {sent} of {len(devices)} devices',
+                'devices': device_results
+            })
+            if traces is not None:
+                results[-1]['trace_id'] = traces[index].trace_id
+        return results
+
+    def device_ids(self):
+        """The robots this bridge drives by name, empty for a single-robot bridge"""
+        return ()
+
+    def scheduler_for(self, device):
+        """The scheduler queueing commands for a device, None meaning the default robot"""
+        return getattr(self.server, 'scheduler', None)
+
+    def check_device(self, device):
+        """Raise ValueError unless device names a robot of this bridge (or is None)"""
+        if device is None:
+            return
+        devices = self.device_ids()
+        if not devices:
+            raise ValueError('this bridge drives a single robot, so takes no device')
+        if device != BROADCAST_DEVICE and device not in devices:
+            raise ValueError(f'unknown device {device}, expected one of '
+                             f'{", ".join(devices)} or {BROADCAST_DEVICE}')
+
+    def handle_commands(self, commands):
+        """Deliver a batch of commands in order, returning one result per command"""
+        results = []
+        for command in commands:
+            result = self.handle_command(command)
+            result['command'] = command
+            results.append(result)
+        return results
+
+    def read_body(self):
+        """Read the request body, refusing an oversized one before reading any of it"""
+        try:
+            content_length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            content_length = -1
+        max_body_bytes = getattr(self.server, 'max_body_bytes', MAX_BODY_BYTES)
+        if not 0 <= content_length <= max_body_bytes:
+            # The body is left unread, so the connection cannot carry another request
+            self.close_connection = True
+            if content_length < 0:
+                raise ValueError('invalid Content-Length')
+            raise BodyTooLarge(f'body is larger than {max_body_bytes} bytes')
+        return self.rfile.read(content_length)
+
+    def read_json_body(self):
+        """Read and decode the JSON request body, answering 400 if it is invalid"""
+        try:
+            body = self.read_body()
+            command = parse_simple_command(body)
+            if command is not None:
+                return {'command': command}
+            data = json.loads(body)
+            if not isinstance(data, dict):
+                raise ValueError('body must be a JSON object')
+            return data
+        except ValueError as e:
+            self.send_bad_request(e)
+            return None
+
+    def read_command_batch(self):
+        """Read a /send_commands body, answering 400 if any entry is invalid
+
+        Accepts a JSON array, an object with a ``commands`` array (and
+        optionally ``wait_for_ack``/``ack_timeout``, ``priority``/``flush``),
+        or NDJSON (one JSON string or ``{"command": ...}`` object per line).
+        Returns the commands, the ack timeout (None if not waiting for
+        acks) and the scheduling options for submit_commands.
+        """
+        try:
+            body = self.read_body().decode('utf-8')
+            ack_timeout = None
+            scheduling = parse_scheduling({})
+            if 'ndjson' in self.headers.get('Content-Type', ''):
+                entries = [json.loads(line) for line in body.splitlines() if line.strip()]
+            else:
+                entries = json.loads(body)
+                if isinstance(entries, dict):
+                    ack_timeout = parse_ack_timeout(entries)
+                    scheduling = parse_scheduling(entries)
+                    self.check_device(scheduling['device'])
+                    entries = entries.get('commands')
+            if not isinstance(entries, list):
+                raise ValueError('expected a list of commands')
+            return parse_command_batch(entries), ack_timeout, scheduling
+        except ValueError as e:
+            self.send_bad_request(e)
+            return None
+
+    def send_bad_request(self, error):
+        too_large = isinstance(error, BodyTooLarge)
+        if too_large and getattr(self.server, 'admission', None) is not None:
+            self.server.admission.reject('body_size')
+        self.send_json({'status': 'error', 'message': f'Invalid request: {error}',
+                        'timestamp': time.time()}, 413 if too_large else 400)
+
+    def send_too_many_requests(self, response, retry_after=admission.RETRY_AFTER):
+        response['timestamp'] = time.time()
+        self.send_json(response, 429, [('Retry-After', str(retry_after))])
+
+    def send_json(self, response, status=200, headers=()):
+        """Send a JSON response with the CORS header the app expects
+
+        Headers and body go out in one write, starting from a header block
+        encoded once per status instead of header by header.
+        """
+        body = json.dumps(response).encode()
+        self.response_status = status
+        self.log_request(status)
+        if self.request_version == 'HTTP/0.9':
+            self.wfile.write(body)
+            return
+
+        head = [json_header_block(self.protocol_version, status, self.version_string()),
+                http_date_header(), b'Content-Length: %d\r\n' % len(body)]
+        for keyword, value in (*headers, *self.keep_alive_headers()):
+            head.append(f'{keyword}: {value}\r\n'.encode('latin-1'))
+        head.append(b'\r\n')
+        head.append(body)
+        self.wfile.write(b''.join(head))
+
+    def send_answer(self):
+        """Answer a /answer query from the answer cache"""
+        data = self.read_json_body()
+        if data is None:
+            return
+        query = data.get('query')
+        if not isinstance(query, str) or not query.strip() \
+                or len(query) > answer_cache.MAX_QUERY_LENGTH:
+            self.send_bad_request(f'query must be a non-empty string of at most '
+                                  f'{answer_cache.MAX_QUERY_LENGTH} characters')
+            return
+
+        try:
+            answer, how, age = answer_cache.default_cache().answer(query)
+        except answer_cache.UpstreamError as e:
+            log.warning(f"⚠️  No answer to {query}: {e}")
+            self.send_json({'status': 'error', 'query': query, 'message': str(e),
+                            'timestamp': time.time()}, 502)
+            return
+        self.send_json({
+            'status': 'success',
+            'query': query,
+            'answer': answer,
+            'cache': how,
+            'age': round(age, 1),
+            'timestamp': time.time()
+        })
+
+    def send_metrics(self):
+        try:
+            self.collect_metrics()
+        except Exception as e:
+            log.warning(f"⚠️  Could not collect metrics: {e}")
+        body = metrics.registry.render()
+        self.send_response(200)
+        self.send_header('Content-Type', metrics.CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_not_found(self):
+        self.send_response(404)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+class BodyTooLarge(ValueError):
+    """The request body is over MAX_BODY_BYTES and was not read"""
+
+
+def parse_simple_command(body):
+    """The command of a ``{"command": "..."}`` body, straight from its bytes
+
+    Only bodies with nothing else in them and no escapes or non-ASCII in the
+    command match; anything else returns None and goes through json.loads.
+    """
+    match = _SIMPLE_COMMAND_BODY.fullmatch(body)
+    return match.group(1).decode('ascii') if match else None
+
+
+_json_header_blocks = {}
+_http_date = (None, b'')
+
+
+def json_header_block(protocol_version, status, server):
+    """The status line and fixed headers of a JSON response, encoded once"""
+    key = (protocol_version, status, server)
+    block = _json_header_blocks.get(key)
+    if block is None:
+        reason = BaseHTTPRequestHandler.responses.get(status, ('',))[0]
+        block = _json_header_blocks[key] = (
+            f'{protocol_version} {status} {reason}\r\n'
+            f'Server: {server}\r\n'
+            'Content-Type: application/json\r\n'
+            'Access-Control-Allow-Origin: *\r\n').encode('latin-1')
+    return block
+
+
+def http_date_header():
+    """The Date header, formatted at most once a second"""
+    global _http_date
+    now = int(time.time())
+    second, header = _http_date
+    if second != now:
+        header = f'Date: {email.utils.formatdate(now, usegmt=True)}\r\n'.encode('latin-1')
+        _http_date = (now, header)
+    return header
+
+
+def parse_ack_timeout(data):
+    """Return how long to wait for acks if the request asks to, else None"""
+    if not data.get('wait_for_ack'):
+        return None
+    timeout = data.get('ack_timeout', DEFAULT_ACK_TIMEOUT)
+    if isinstance(timeout, bool) or not isinstance(timeout, (int, float)) \
+            or not 0 < timeout <= MAX_ACK_TIMEOUT:
+        raise ValueError(f'ack_timeout must be a number of seconds up to {MAX_ACK_TIMEOUT}')
+    return float(timeout)
+
+
+def parse_scheduling(data):
+    """Return the ``priority``, ``flush`` and ``device`` a request asks its commands to be sent with"""
+    device = data.get('device')
+    if device is not None and not isinstance(device, str):
+        raise ValueError('device must be a string')
+    priority = data.get('priority')
+    if priority is not None and priority not in command_scheduler.PRIORITIES:
+        raise ValueError(f'priority must be one of {", ".join(command_scheduler.PRIORITIES)}')
+    flush = data.get('flush', False)
+    if not isinstance(flush, bool):
+        raise ValueError('flush must be true or false')
+    return {'priority': priority, 'flush': flush, 'device': device}
+
+
+def parse_command_batch(entries):
+    """Validate a decoded batch and return its commands in order
+
+    Commands are newline-delimited on the way to the robot, so entries must
+    be non-empty single-line strings (or objects with such a ``command``).
+    """
+    if not entries:
+        raise ValueError('no commands given')
+    if len(entries) > MAX_BATCH_COMMANDS:
+        raise ValueError(f'at most {MAX_BATCH_COMMANDS} commands per batch')
+
+    commands = []
+    for index, entry in enumerate(entries):
+        if isinstance(entry, dict):
+            entry = entry.get('command')
+        commands.append(parse_command(entry, f'command {index}'))
+    return commands
+
+
+def parse_command(value, name='command'):
+    """Validate one command and return it stripped"""
+    if not isinstance(value, str) or not value.strip() or '\n' in value or '\r' in value:
+        raise ValueError(f'{name} must be a non-empty single-line string')
+    return value.strip()
+
+
+class PooledHTTPServer(HTTPServer):
+    """HTTPServer that serves connections' requests on a bounded worker pool
+
+    Like ThreadingHTTPServer, but the number of handler threads is capped so
+    a burst of clients queues up instead of spawning unbounded threads. A
+    worker only holds a connection while serving a request: between
+    requests, kept-alive connections are watched by one selector thread
+    (see _IdleConnections) and handed back to the pool once readable, so
+    idle app clients cannot starve busy ones. Once
+    ``max_queued_connections`` ready connections are waiting for a worker,
+    new connections are answered 503 with a Retry-After and closed.
+    """
+
+    request_queue_size = 64
+    max_queued_connections = MAX_QUEUED_CONNECTIONS
+
+    def __init__(self, server_address, handler_class, workers=DEFAULT_WORKERS):
+        super().__init__(server_address, handler_class)
+        self.executor = ThreadPoolExecutor(max_workers=workers,
+                                           thread_name_prefix='bridge-worker')
+        self._queued = 0
+        self._queued_lock = threading.Lock()
+        self._idle = _IdleConnections(self)
+
+    def process_request(self, request, client_address):
+        with self._queued_lock:
+            admitted = self._queued < self.max_queued_connections
+        if not admitted:
+            self._refuse(request)
+            return
+        handler = self.RequestHandlerClass.__new__(self.RequestHandlerClass)
+        handler.request = request
+        handler.client_address = client_address
+        handler.server = self
+        try:
+            handler.setup()
+        except OSError:
+            self.shutdown_request(request)
+            return
+        # A connection that never sends a request must not hold a worker either
+        self._idle.park(handler)
+
+    def serve_ready(self, handler):
+        """Hand a connection with a request waiting to the pool"""
+        with self._queued_lock:
+            self._queued += 1
+        try:
+            self.executor.submit(self._serve_connection, handler)
+        except RuntimeError:  # The server is closing
+            with self._queued_lock:
+                self._queued -= 1
+            self.close_client(handler)
+
+    def detach(self, handler, serve):
+        """Serve the rest of handler's connection on a thread of its own, e.g. a stream
+
+        The worker returns at once; the connection is closed when serve returns.
+        """
+        handler.detached = True
+
+        def run():
+            try:
+                serve()
+            except Exception:
+                self.handle_error(handler.request, handler.client_address)
+            finally:
+                self.close_client(handler)
+
+        threading.Thread(target=run, name='bridge-event-stream', daemon=True).start()
+
+    def close_client(self, handler):
+        try:
+            handler.finish()
+        except OSError:
+            pass
+        self.shutdown_request(handler.request)
+
+    def _serve_connection(self, handler):
+        with self._queued_lock:
+            self._queued -= 1
+        try:
+            handler.close_connection = True
+            handler.handle_one_request()
+            # Buffered pipelined requests would never wake the selector, and a
+            # client answering at once saves the round trip through it
+            while not handler.close_connection and _has_buffered_input(handler, KEEP_ALIVE_LINGER):
+                handler.handle_one_request()
+        except Exception:
+            self.handle_error(handler.request, handler.client_address)
+            handler.close_connection = True
+        if getattr(handler, 'detached', False):
+            return
+        if handler.close_connection:
+            self.close_client(handler)
+        else:
+            self._idle.park(handler)
+
+    def _refuse(self, request):
+        admission.ADMISSION_REJECTED.inc(reason='connections')
+        try:
+            request.setblocking(False)
+            request.send(_BUSY_RESPONSE)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self._idle.close()
+        self.executor.shutdown(wait=False)
+
+
+def _has_buffered_input(handler, linger=0.0):
+    """Whether the handler's connection has request bytes ready within linger seconds"""
+    connection = handler.connection
+    try:
+        connection.setblocking(False)
+        if handler.rfile.peek(1):
+            return True
+        return bool(linger and select.select([connection], [], [], linger)[0]
+                    and handler.rfile.peek(1))
+    except OSError:
+        return False
+    finally:
+        try:
+            connection.settimeout(handler.timeout)
+        except OSError:
+            pass
+
+
+class _IdleConnections:
+    """Kept-alive connections between requests, watched by one selector thread
+
+    A connection parked here costs no worker: once it turns readable it is
+    handed to the server's pool. Connections idle for longer than the
+    server's ``keep_alive_timeout`` are closed, and so are the oldest ones
+    beyond MAX_IDLE_CONNECTIONS.
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_reader, self._wakeup_writer = socket.socketpair()
+        self._wakeup_reader.setblocking(False)
+        self._wakeup_writer.setblocking(False)
+        self._selector.register(self._wakeup_reader, selectors.EVENT_READ)
+        self._arrivals = collections.deque()
+        # Owned by the watcher thread; deadlines come in arrival order
+        self._deadlines = collections.OrderedDict()
+        self._closed = False
+        threading.Thread(target=self._run, name='bridge-idle-connections', daemon=True).start()
+
+    def park(self, handler):
+        self._arrivals.append(handler)
+        self._wake()
+
+    def close(self):
+        self._closed = True
+        self._wake()
+
+    def _wake(self):
+        try:
+            self._wakeup_writer.send(b'\0')
+        except OSError:
+            pass  # Already awake, or closed
+
+    def _run(self):
+        while True:
+            timeout = None
+            if self._deadlines:
+                timeout = max(0.0, next(iter(self._deadlines.values())) - time.monotonic())
+            for key, _ in self._selector.select(timeout):
+                if key.fileobj is self._wakeup_reader:
+                    try:
+                        self._wakeup_reader.recv(4096)
+                    except OSError:
+                        pass
+                    continue
+                self._selector.unregister(key.fileobj)
+                del self._deadlines[key.data]
+                self.server.serve_ready(key.data)
+
+            if self._closed:
+                break
+            keep_alive_timeout = getattr(self.server, 'keep_alive_timeout', KEEP_ALIVE_TIMEOUT)
+            while self._arrivals:
+                handler = self._arrivals.popleft()
+                try:
+                    self._selector.register(handler.connection, selectors.EVENT_READ, handler)
+                except (OSError, ValueError):
+                    self.server.close_client(handler)
+                    continue
+                self._deadlines[handler] = time.monotonic() + keep_alive_timeout
+            now = time.monotonic()
+            while self._deadlines and (len(self._deadlines) > MAX_IDLE_CONNECTIONS
+                                       or next(iter(self._deadlines.values())) <= now):
+                self._drop(next(iter(self._deadlines)))
+
+        for handler in list(self._deadlines):
+            self._drop(handler)
+        while self._arrivals:
+            self.server.close_client(self._arrivals.popleft())
+        self._selector.close()
+        self._wakeup_reader.close()
+        self._wakeup_writer.close()
+
+    def _drop(self, handler):
+        del self._deadlines[handler]
+        self._selector.unregister(handler.connection)
+        self.server.close_client(handler)
+
+
+# Sent without reading the request, by a server with no worker free for it
+_BUSY_BODY = b'{"status": "error", "message": "Server busy"}'
+_BUSY_RESPONSE = (b'HTTP/1.1 503 Service Unavailable\r\n'
+                  b'Content-Type: application/json\r\n'
+                  b'Access-Control-Allow-Origin: *\r\n'
+                  b'Retry-After: %d\r\n'
+                  b'Connection: close\r\n'
+                  b'Content-Length: %d\r\n\r\n' % (admission.RETRY_AFTER, len(_BUSY_BODY))
+                  + _BUSY_BODY)
+
+
+class _BufferedConnection:
+    """In-memory stand-in for a client socket, used to run a handler off the event loop"""
+
+    def __init__(self, request_bytes):
+        self._request = request_bytes
+        self._response = bytearray()
+
+    def makefile(self, mode, buffering=None):
+        return io.BytesIO(self._request)
+
+    def sendall(self, data):
+        self._response += data
+
+    def settimeout(self, timeout):
+        pass
+
+    def setsockopt(self, *args):
+        pass
+
+    def getvalue(self):
+        return bytes(self._response)
+
+
+class AsyncioHTTPServer:
+    """Bridge server whose connections are driven by an asyncio event loop
+
+    Sockets are read and written on the event loop, so slow or idle clients
+    cost no thread. Each complete request is then handed to the handler class
+    on a bounded executor, because forwarding a command may block. This makes
+    it the engine of choice when many app clients hold keep-alive connections.
+    """
+
+    keep_alive_timeout = KEEP_ALIVE_TIMEOUT
+    max_body_bytes = MAX_BODY_BYTES
+
+    def __init__(self, server_address, handler_class, workers=DEFAULT_WORKERS):
+        self.RequestHandlerClass = handler_class
+        self.socket = socket.create_server(server_address)
+        self.server_address = self.socket.getsockname()[:2]
+        self.executor = ThreadPoolExecutor(max_workers=workers,
+                                           thread_name_prefix='bridge-worker')
+        self._loop = None
+        self._stop = None
+        self._stop_requested = False
+        self._is_shut_down = threading.Event()
+        self._is_shut_down.set()
+
+    def serve_forever(self):
+        self._is_shut_down.clear()
+        try:
+            asyncio.run(self._serve())
+        finally:
+            self._loop = None
+            self._is_shut_down.set()
+
+    def shutdown(self):
+        """Stop serve_forever and wait for it to return, like HTTPServer.shutdown"""
+        self._stop_requested = True
+        loop = self._loop
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(self._stop.set)
+            except RuntimeError:
+                pass
+        self._is_shut_down.wait()
+
+    def server_close(self):
+        self.socket.close()
+        self.executor.shutdown(wait=False)
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        if self._stop_requested:
+            self._stop.set()
+
+        server = await asyncio.start_server(self._handle_connection, sock=self.socket)
+        async with server:
+            await self._stop.wait()
+
+    async def _handle_connection(self, reader, writer):
+        client_address = writer.get_extra_info('peername')
+        requests_handled = 0
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader),
+                                                     self.keep_alive_timeout)
+                except asyncio.TimeoutError:
+                    break
+                if request is None:
+                    break
+                if request.startswith(b'GET /events '):
+                    await self._stream_events(reader, writer, client_address)
+                    break
+
+                response, keep_alive = await self._loop.run_in_executor(
+                    self.executor, self._run_handler, request, client_address,
+                    requests_handled)
+                requests_handled += 1
+                writer.write(response)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+            pass
+        except Exception:
+            log.exception("❌ Error serving %s", client_address[0],
+                          extra=bridge_log.fields(client=client_address[0]))
+        finally:
+            writer.close()
+
+    async def _stream_events(self, reader, writer, client_address):
+        """Serve /events on the event loop, so a subscriber costs no worker thread"""
+        control = getattr(self, 'admission', None)
+        retry_after = control.admit_client(client_address[0]) if control is not None else 0
+        if retry_after:
+            self._refuse_event_stream(writer, b'429 Too Many Requests', 'Too many requests',
+                                      retry_after)
+            return
+        slots = getattr(self, 'event_stream_slots', None)
+        if slots is not None and not slots.acquire(blocking=False):
+            self._refuse_event_stream(writer, b'503 Service Unavailable',
+                                      'Too many event streams', EVENT_HEARTBEAT_INTERVAL)
+            return
+        try:
+            await self._write_event_stream(reader, writer, client_address)
+        finally:
+            if slots is not None:
+                slots.release()
+
+    def _refuse_event_stream(self, writer, status, message, retry_after):
+        body = json.dumps({'status': 'error', 'message': message,
+                           'timestamp': time.time()}).encode()
+        writer.write(b'HTTP/1.1 %s\r\n'
+                     b'Content-Type: application/json\r\n'
+                     b'Access-Control-Allow-Origin: *\r\n'
+                     b'Retry-After: %d\r\n'
+                     b'Connection: close\r\n'
+                     b'Content-Length: %d\r\n\r\n' % (status, retry_after, len(body))
+                     + body)
+        HTTP_REQUESTS.inc(method='GET', route='/events', status=int(status[:3]))
+
+    async def _write_event_stream(self, reader, writer, client_address):
+        pending = asyncio.Queue()
+
+        def deliver(event):
+            if pending.qsize() >= MAX_PENDING_EVENTS:
+                self._loop.call_soon_threadsafe(pending.put_nowait, None)
+                raise OverflowError('event stream client is too slow')
+            self._loop.call_soon_threadsafe(pending.put_nowait, event)
+
+        handler = self.RequestHandlerClass.__new__(self.RequestHandlerClass)
+        handler.server = self
+        handler.client_address = client_address
+        status = await self._loop.run_in_executor(self.executor, handler.get_status)
+
+        writer.write(b'HTTP/1.1 200 OK\r\n'
+                     b'Content-Type: text/event-stream\r\n'
+                     b'Cache-Control: no-cache\r\n'
+                     b'Access-Control-Allow-Origin: *\r\n'
+                     b'Connection: close\r\n\r\n')
+        writer.write(format_event({'type': 'status', **status}))
+        HTTP_REQUESTS.inc(method='GET', route='/events', status=200)
+        events.subscribe(deliver)
+        try:
+            heartbeat = time.monotonic() + EVENT_HEARTBEAT_INTERVAL
+            while True:
+                await writer.drain()
+                try:
+                    event = await asyncio.wait_for(pending.get(), EVENT_CLOSE_CHECK_INTERVAL)
+                except asyncio.TimeoutError:
+                    if reader.at_eof():
+                        break
+                    if time.monotonic() >= heartbeat:
+                        writer.write(b': keep-alive\n\n')
+                        heartbeat = time.monotonic() + EVENT_HEARTBEAT_INTERVAL
+                    continue
+                if event is None:
+                    break
+                writer.write(format_event(event))
+        finally:
+            events.unsubscribe(deliver)
+
+    async def _read_request(self, reader):
+        """Read one request head plus its body, or None once the client is gone"""
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+        except asyncio.IncompleteReadError:
+            return None
+
+        content_length = 0
+        for line in head.split(b'\r\n')[1:]:
+            name, _, value = line.partition(b':')
+            if name.strip().lower() == b'content-length':
+                content_length = int(value.strip()) if value.strip().isdigit() else -1
+        if not 0 <= content_length <= self.max_body_bytes:
+            # Not read at all: the handler refuses it and closes the connection
+            return head
+
+        try:
+            body = await reader.readexactly(content_length)
+        except asyncio.IncompleteReadError:
+            return None
+        return head + body
+
+    def _run_handler(self, request, client_address, requests_handled):
+        """Run one request through the handler class and return (response, keep_alive)"""
+        connection = _BufferedConnection(request)
+        handler = self.RequestHandlerClass.__new__(self.RequestHandlerClass)
+        handler.request = connection
+        handler.client_address = client_address
+        handler.server = self
+        handler.setup()
+        # The handler only sees this one request; carry the connection's count over
+        handler.requests_handled = requests_handled
+        try:
+            handler.close_connection = True
+            handler.handle_one_request()
+        finally:
+            handler.finish()
+        return connection.getvalue(), not handler.close_connection
+
+
+def make_server(handler_class, port=DEFAULT_PORT, engine=DEFAULT_ENGINE,
+                workers=DEFAULT_WORKERS, host='', keep_alive_timeout=KEEP_ALIVE_TIMEOUT,
+                max_requests=MAX_KEEP_ALIVE_REQUESTS, rate_limit=command_scheduler.DEFAULT_RATE,
+                burst=command_scheduler.DEFAULT_BURST, trace=None, max_body_bytes=MAX_BODY_BYTES,
+                max_pending=admission.DEFAULT_MAX_PENDING,
+                client_rate=admission.DEFAULT_CLIENT_RATE,
+                client_burst=admission.DEFAULT_CLIENT_BURST,
+                max_event_streams=MAX_EVENT_STREAMS):
+    """Create a bridge server for handler_class using the chosen engine"""
+    server_address = (host, port)
+    if engine == 'single':
+        server = HTTPServer(server_address, handler_class)
+    elif engine == 'threaded':
+        server = PooledHTTPServer(server_address, handler_class, workers)
+    elif engine == 'asyncio':
+        server = AsyncioHTTPServer(server_address, handler_class, workers)
+    else:
+        raise ValueError(f'Unknown engine: {engine}')
+
+    server.keep_alive_timeout = keep_alive_timeout
+    # One thread serves every client, so a kept-alive one would shut out the rest
+    server.max_keep_alive_requests = 1 if engine == 'single' else max_requests
+    server.max_body_bytes = max_body_bytes
+    # A stream would hold the single engine's only thread, so it serves none
+    if engine == 'single':
+        max_event_streams = 0
+    server.event_stream_slots = threading.Semaphore(max_event_streams)
+    server.admission = admission.AdmissionControl(max_pending, client_rate, client_burst)
+    server.scheduler = command_scheduler.CommandScheduler(rate_limit, burst)
+    server.trace = command_trace.TraceWriter(trace) if trace else None
+    if server.trace is not None:
+        log.info(f"🎞️  Recording commands to: {trace}")
+    return server
+
+
+def serve(server):
+    """Serve until Ctrl+C, then release the socket and workers"""
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        log.info("⏹️  Bridge server stopped")
+    finally:
+        events.close()
+        if getattr(server, 'trace', None) is not None:
+            server.trace.close()
+        server.server_close()
+
+
+def parse_server_args(description=None):
+    """Parse the command line options shared by every bridge script"""
+    return server_arg_parser(description).parse_args()
+
+
+def server_arg_parser(description=None):
+    """The parser behind parse_server_args, for scripts that add options of their own"""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+                        help='port to listen on (default: %(default)s)')
+    parser.add_argument('--engine', choices=ENGINES, default=DEFAULT_ENGINE,
+                        help='concurrency engine (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help='maximum concurrent handler threads (default: %(default)s)')
+    parser.add_argument('--keep-alive-timeout', type=float, default=KEEP_ALIVE_TIMEOUT,
+                        help='seconds an idle connection is kept open (default: %(default)s)')
+    parser.add_argument('--max-requests', type=int, default=MAX_KEEP_ALIVE_REQUESTS,
+                        help='requests served per connection before closing it; the single engine '
+                             'serves one (default: %(default)s)')
+    parser.add_argument('--rate-limit', type=float, default=command_scheduler.DEFAULT_RATE,
+                        help='commands per second sent toward the robot, e.g. 10 to keep '
+                             'animation bursts from flooding a Bluetooth link; 0 for no limit '
+                             '(default: %(default)s)')
+    parser.add_argument('--burst', type=int, default=command_scheduler.DEFAULT_BURST,
+                        help='commands that may be sent at once before the rate limit '
+                             'applies (default: %(default)s)')
+    parser.add_argument('--trace', default=os.environ.get('ESP32_TRACE'), metavar='PATH',
+                        help='append every command request to PATH for command_trace.py '
+                             'replay (default: $ESP32_TRACE, or no trace)')
+    parser.add_argument('--max-body-bytes', type=int, default=MAX_BODY_BYTES,
+                        help='largest request body accepted (default: %(default)s)')
+    parser.add_argument('--max-event-streams', type=int, default=MAX_EVENT_STREAMS,
+                        help='/events streams open at once before more are refused with 503; '
+                             'the single engine serves none (default: %(default)s)')
+    parser.add_argument('--max-pending', type=int, default=admission.DEFAULT_MAX_PENDING,
+                        help='commands accepted but not yet answered before requests are '
+                             'refused with 429, 0 for no limit (default: %(default)s)')
+    parser.add_argument('--client-rate', type=float, default=admission.DEFAULT_CLIENT_RATE,
+                        help='requests per second allowed per client address, 0 for no '
+                             'limit (default: %(default)s)')
+    parser.add_argument('--client-burst', type=int, default=admission.DEFAULT_CLIENT_BURST,
+                        help='requests a client may send at once before its rate applies '
+                             '(default: %(default)s)')
+    return parser
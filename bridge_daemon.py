@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+ESP32 bridge daemon - the HTTP API, the command queue and the link to ESP32
+in one process, replacing a bridge script plus a *_sender.py script
+Commands wait in memory instead of the shared command ring and go straight
+to the chosen transport, so nothing else needs to be running
+Drives several robots with --device NAME=TRANSPORT per robot; requests pick
+one with "device": NAME, or send to all of them with "device": "all"
+"""
+
+import itertools
+import os
+import threading
+import bridge_core
+import bridge_log
+import command_scheduler
+import esp32_discovery
+import esp32_link
+import esp32_protocol
+import transports
+from bridge_core import BaseBridgeHandler
+
+log = bridge_log.get_logger('bridge_daemon')
+
+TRANSPORTS = ('rfcomm', 'serial-terminal')
+DEFAULT_DEVICE = 'ESP32'
+# Shared by every device, so an ack's sequence number names one command
+_sequences = itertools.count(1)
+
+class Forwarder:
+    """Writes commands to one robot over its own link and acknowledges them
+
+    Each command gets a sequence number like the ones the command ring hands
+    out, so /send_command can wait for its ``ack``. Replies are matched when
+    the transport is readable; otherwise a command is acknowledged as
+    delivered once written. Events it publishes carry the robot's ``device``
+    name.
+    """
+
+    def __init__(self, transport, framing='text', name=DEFAULT_DEVICE):
+        self.name = name
+        self.transport = transport
+        self.matcher = esp32_protocol.ReplyMatcher(self._publish)
+        self.sent = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+        self.link = esp32_link.ESP32Link(transport.connect, name=name,
+                                         send_timeout=transports.FALLBACK_SEND_TIMEOUT,
+                                         on_event=self._on_link_event,
+                                         framing=framing,
+                                         on_tick=self.matcher.expire)
+
+    def start(self):
+        self.link.start()
+        return self
+
+    def close(self):
+        self.link.close()
+
+    def send(self, commands):
+        """Write commands as one batch, returning one result per command
+
+        Commands the link's framing cannot carry get an error result and
+        are left out of the batch, instead of failing the others.
+        """
+        errors = [esp32_protocol.encoding_error(command, self.link.framing) for command in commands]
+        sendable = [command for command, error in zip(commands, errors) if error is None]
+        sent = iter(self._send(sendable) if sendable else ())
+        return [next(sent) if error is None else {
+            'command': command,
+            'status': 'error',
+            'message': f'Cannot send to ESP32: {error}'
+        } for command, error in zip(commands, errors)]
+
+    def _send(self, commands):
+        # One batch at a time keeps sequence numbers in the order they are written
+        with self._lock:
+            records = [(next(_sequences), command) for command in commands]
+            if self.transport.readable:
+                self.matcher.expect(records)
+            success = self.link.send('\n'.join(commands))
+
+        if not success:
+            self.matcher.forget(records)
+            self.failed += len(commands)
+            log.error("❌ Error sending to %s: %s", self.name, self.link.last_error,
+                      extra=bridge_log.fields(device=self.name, error=self.link.last_error))
+            return [{
+                'command': command,
+                'status': 'error',
+                'message': f'Failed to send to ESP32: {self.link.last_error}'
+            } for command in commands]
+
+        self.sent += len(commands)
+        if self.transport.readable:
+            self.matcher.delivered(records)
+        else:
+            for sequence, command in records:
+                self._publish(esp32_protocol.ack_event(sequence, command, 'delivered'))
+        log.info("✅ Sent %d command(s) to %s", len(commands), self.name,
+                 extra=bridge_log.fields(sampled=True, device=self.name, first_sequence=records[0][0],
+                                         count=len(commands)))
+        return [{
+            'command': command,
+            'status': 'success',
+            'message': 'Sent to ESP32',
+            'sequence': sequence
+        } for sequence, command in records]
+
+    def stats(self):
+        return {'transport': self.transport.name, 'sent': self.sent, 'failed': self.failed}
+
+    def _on_link_event(self, event):
+        # Match robot replies to commands on the way to /events
+        if event['type'] == 'response':
+            self.matcher.reply(event['response'])
+        elif event['type'] == 'link' and event['state'] != 'connected':
+            self.matcher.reset()
+        self._publish(event)
+
+    def _publish(self, event):
+        bridge_core.events.publish({**event, 'device': self.name})
+
+class DaemonHandler(BaseBridgeHandler):
+    status_message = 'ESP32 Bridge Daemon Ready'
+    # The first robot is the default, delivered through the server's scheduler;
+    # every other one has a scheduler of its own, so none waits on another
+    forwarders = {}
+    schedulers = {}
+
+    @property
+    def forwarder(self):
+        return next(iter(self.forwarders.values()))
+
+    def get_status(self):
+        status = super().get_status()
+        status['link'] = self.forwarder.link.health()
+        status['forwarding'] = forwarding_status(self.forwarder)
+        status['devices'] = {name: {
+            'link': forwarder.link.health(),
+            'forwarding': forwarding_status(forwarder),
+            'scheduler': self.scheduler_for(name).stats()
+        } for name, forwarder in self.forwarders.items()}
+        return status
+
+    def collect_metrics(self):
+        super().collect_metrics()
+        for forwarder in self.forwarders.values():
+            esp32_link.record_health_metrics(forwarder.link.health())
+
+    def device_ids(self):
+        return tuple(self.forwarders)
+
+    def scheduler_for(self, device):
+        return self.schedulers.get(device) or super().scheduler_for(device)
+
+    def handle_command(self, command):
+        return self.handle_commands([command])[0]
+
+    def handle_commands(self, commands):
+        log.info("🚀 Received %d command(s): %s", len(commands), ', '.join(commands),
+                 extra=bridge_log.fields(sampled=True, commands=len(commands)))
+        return self.forwarder.send(commands)
+
+def forwarding_status(forwarder):
+    status = forwarder.stats()
+    if hasattr(forwarder.transport, 'stats'):
+        status['methods'] = forwarder.transport.stats()
+    return status
+
+def make_transport(spec, device_cache=None):
+    """The transport named on the command line
+
+    ``rfcomm`` is Bluetooth to the ESP32 found through the device cache,
+    ``serial-terminal`` goes through the Serial Terminal app; anything else
+    is a transports.make_transport spec such as serial:///dev/rfcomm0.
+    """
+    if spec == 'rfcomm':
+        # Imported here so the other transports don't need its Bluetooth setup
+        from direct_esp32_sender import CachedRfcommTransport
+        locator = esp32_discovery.DeviceLocator(device_cache or esp32_discovery.CACHE_FILE)
+        if not locator.address():
+            log.info("🔍 ESP32 not cached yet, scanning in the background...")
+        return CachedRfcommTransport(locator)
+    if spec == 'serial-terminal':
+        from auto_serial_sender import serial_terminal_transport
+        return serial_terminal_transport()
+    return transports.make_transport(spec)
+
+def parse_device(value):
+    """Parse a --device NAME=TRANSPORT option"""
+    name, _, spec = value.partition('=')
+    if not name or not spec or name == bridge_core.BROADCAST_DEVICE:
+        raise ValueError(f'expected NAME=TRANSPORT, with a NAME other than '
+                         f'{bridge_core.BROADCAST_DEVICE}, not {value}')
+    return name, spec
+
+def check_devices(devices):
+    """Raise ValueError unless the (name, transport) devices can be driven together"""
+    if len({name for name, _ in devices}) < len(devices):
+        raise ValueError('device names must be unique')
+    # The device cache remembers one ESP32, so every such device would drive it
+    cached = [name for name, spec in devices if spec == 'rfcomm']
+    if len(cached) > 1:
+        raise ValueError(f'only one device can use the cached rfcomm address; give the others '
+                         f'their own, e.g. {cached[1]}=rfcomm://AA:BB:CC:DD:EE:FF')
+
+def make_daemon_server(forwarders, port=8080, engine=bridge_core.DEFAULT_ENGINE, **options):
+    """The bridge server driving forwarders by name, the first being the default"""
+    DaemonHandler.forwarders = forwarders
+    httpd = bridge_core.make_server(DaemonHandler, port, engine, **options)
+    DaemonHandler.schedulers = {
+        name: command_scheduler.CommandScheduler(httpd.scheduler.rate, httpd.scheduler.burst,
+                                                 deliver=forwarder.send,
+                                                 name=f'{name}-scheduler')
+        for name, forwarder in list(forwarders.items())[1:]
+    }
+    return httpd
+
+def run_server(port=8080, engine=bridge_core.DEFAULT_ENGINE, transport='rfcomm', framing='text',
+               device_cache=None, devices=None, **options):
+    devices = devices or [(DEFAULT_DEVICE, transport)]
+    check_devices(devices)
+    forwarders = {name: Forwarder(make_transport(spec, device_cache), framing, name).start()
+                  for name, spec in devices}
+    httpd = make_daemon_server(forwarders, port, engine, **options)
+    log.info("🚀 ESP32 Bridge Daemon Starting...")
+    log.info(f"📱 Server running on: http://localhost:{port}")
+    log.info(f"⚙️  Engine: {engine}")
+    for name, forwarder in forwarders.items():
+        log.info(f"🔌 {name}: {forwarder.transport.name} ({framing} framing)")
+    log.info("🔗 Connect your Flutter app now!")
+    log.info(f"📡 Live link state and ESP32 replies: http://localhost:{port}/events")
+    log.info("⏹️  Press Ctrl+C to stop")
+    try:
+        bridge_core.serve(httpd)
+    finally:
+        for forwarder in forwarders.values():
+            forwarder.close()
+
+def parse_args():
+    parser = bridge_core.server_arg_parser(__doc__)
+    parser.add_argument('--transport', default=os.environ.get('ESP32_TRANSPORT', 'rfcomm'),
+                        help=f'{" or ".join(TRANSPORTS)}, or a transport spec such as '
+                             'serial:///dev/rfcomm0, tcp://127.0.0.1:9750 or file:///path '
+                             '(default: $ESP32_TRANSPORT or %(default)s)')
+    parser.add_argument('--framing', choices=esp32_protocol.FRAMINGS,
+                        default=os.environ.get('ESP32_FRAMING', 'text'),
+                        help='how commands are written to the robot (default: %(default)s)')
+    parser.add_argument('--device-cache',
+                        help=f'where the rfcomm transport caches the ESP32 address '
+                             f'(default: ./{esp32_discovery.CACHE_FILE})')
+    parser.add_argument('--device', dest='devices', action='append', metavar='NAME=TRANSPORT',
+                        help='drive a robot called NAME through TRANSPORT (as for --transport, '
+                             'e.g. left=rfcomm://AA:BB:CC:DD:EE:FF); repeat for each robot, '
+                             'the first being the default; only one may use the cached '
+                             'rfcomm address; replaces --transport')
+    args = parser.parse_args()
+    try:
+        args.devices = [parse_device(value) for value in args.devices or []]
+        check_devices(args.devices)
+    except ValueError as e:
+        parser.error(str(e))
+    return args
+
+if __name__ == '__main__':
+    run_server(**vars(parse_args()))
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Structured, non-blocking logging for the bridges and the sender scripts
+Logging a message only queues the record; one background thread formats
+and writes it, so a slow or backgrounded Termux terminal never stalls a
+request or a forwarding attempt
+
+Configured from the environment:
+    ESP32_LOG_LEVEL   DEBUG, INFO (default), WARNING or ERROR
+    ESP32_LOG_FORMAT  text (default) or json, one object per line
+    ESP32_LOG_SAMPLE  fraction of per-request messages kept (default 1)
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+
+ROOT_LOGGER = 'esp32'
+LOG_FORMATS = ('text', 'json')
+LOG_QUEUE_SIZE = 10000
+
+
+def get_logger(name):
+    """The logger for a module or script, e.g. get_logger(__name__)"""
+    return logging.getLogger(f'{ROOT_LOGGER}.{name}')
+
+
+def fields(sampled=False, **values):
+    """``extra`` for a log call: structured fields, and whether it may be sampled
+
+    Per-request messages pass ``sampled=True`` so ESP32_LOG_SAMPLE can thin
+    them out; warnings and errors are always kept.
+    """
+    return {'fields': values, 'sampled': sampled}
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Queues records without blocking, dropping them when the writer falls behind"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Formatting happens on the writer thread, not the caller's
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _Sampler(logging.Filter):
+    """Keeps a fraction of the records marked as sampled, evenly spread"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+        self._credit = 0.0
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if not getattr(record, 'sampled', False) or record.levelno >= logging.WARNING:
+            return True
+        with self._lock:
+            self._credit += self.rate
+            if self._credit >= 1:
+                self._credit -= 1
+                return True
+        return False
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 6),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'msg': record.getMessage()
+        }
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    """The messages as the scripts always printed them; fields are JSON-only"""
+
+    def format(self, record):
+        message = record.getMessage()
+        if record.exc_info:
+            message += '\n' + self.formatException(record.exc_info)
+        return message
+
+
+_handler = None
+_listener = None
+
+
+def configure(level=None, log_format=None, sample_rate=None, stream=None):
+    """Set up (or change) where and how the esp32 loggers write
+
+    Arguments left as None come from the environment. Called on import, so
+    scripts only need it to override the environment.
+    """
+    global _handler, _listener
+    level = (level or os.environ.get('ESP32_LOG_LEVEL') or 'INFO').upper()
+    log_format = log_format or os.environ.get('ESP32_LOG_FORMAT') or 'text'
+    if log_format not in LOG_FORMATS:
+        raise ValueError(f'Unknown log format: {log_format}')
+    if sample_rate is None:
+        sample_rate = float(os.environ.get('ESP32_LOG_SAMPLE') or 1.0)
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter() if log_format == 'json' else TextFormatter())
+
+    if _listener is not None:
+        _listener.stop()
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    _handler = _QueueHandler(log_queue)
+    _handler.addFilter(_Sampler(sample_rate))
+    _listener = logging.handlers.QueueListener(log_queue, output)
+    _listener.start()
+
+    root = logging.getLogger(ROOT_LOGGER)
+    root.handlers = [_handler]
+    root.setLevel(level)
+    root.propagate = False
+
+
+def dropped():
+    """How many records were dropped because the writer fell behind"""
+    return _handler.dropped if _handler is not None else 0
+
+
+def _flush():
+    # Write out whatever is still queued before the process exits
+    if _listener is not None:
+        _listener.stop()
+
+
+configure()
+atexit.register(_flush)
@@ -0,0 +1,468 @@
+#!/usr/bin/env python3
+"""
+Append-only command queue shared by the bridges and the ESP32 senders
+A memory-mapped ring buffer with sequence numbers and per-consumer offsets,
+replacing the single esp32_message.txt mailbox that lost commands between polls
+"""
+
+import ctypes
+import ctypes.util
+import json
+import mmap
+import os
+import select
+import struct
+import threading
+import time
+
+import bridge_log
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; cross-process locking is skipped
+    fcntl = None
+
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    _libc.inotify_init1
+except (OSError, AttributeError):  # No inotify (Windows, macOS); watchers poll instead
+    _libc = None
+
+log = bridge_log.get_logger(__name__)
+
+MAGIC = b'ESPRING1'
+DEFAULT_CAPACITY = 1024 * 1024
+MAX_CONSUMERS = 16
+MAX_COMMAND_BYTES = 4096
+CONSUMER_STALE_AFTER = 30.0
+POLL_INTERVAL = 0.02
+HEARTBEAT_INTERVAL = 10.0
+WATCH_MODES = ('auto', 'inotify', 'poll')
+
+_IN_MODIFY = 0x00000002
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = 0o2000000
+
+# Header: magic, data capacity, next sequence number, total bytes written
+_HEADER = struct.Struct('<8sQQQ')
+# Consumer slot: name, next sequence to read, byte position, last heartbeat
+_SLOT = struct.Struct('<40sQQd')
+_SLOTS_OFFSET = 64
+# Record: payload length, sequence number
+_RECORD = struct.Struct('<IQ')
+DATA_OFFSET = 4096
+
+EVENTS_RING_FILE = 'esp32_events.ring'
+EVENTS_RING_CAPACITY = 256 * 1024
+
+DEFAULT_RING_PATHS = [
+    '/sdcard/Download/esp32_commands.ring',
+    '/sdcard/esp32_commands.ring',
+    './esp32_commands.ring'
+]
+
+
+class RingFull(Exception):
+    """Raised when an append would overwrite commands a live consumer has not read"""
+
+
+class CommandRing:
+    """Single-producer/multi-consumer command ring backed by an mmap'd file
+
+    The producer appends length-prefixed records and then publishes the new
+    write position and sequence number in the header, so a consumer never
+    sees a half-written record. Each consumer keeps its own offset in a
+    header slot, which makes progress durable across restarts. Appends that
+    would overrun a live consumer raise RingFull instead of dropping commands;
+    consumers that stopped heartbeating are overrun and skip ahead when they
+    come back, reporting how many commands they missed.
+    """
+
+    def __init__(self, path, capacity=DEFAULT_CAPACITY):
+        self.path = path
+        self._mm = None
+        self._lock = threading.Lock()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            with self._file_lock():
+                if os.fstat(self._fd).st_size == 0:
+                    os.ftruncate(self._fd, DATA_OFFSET + capacity)
+                    os.pwrite(self._fd, _HEADER.pack(MAGIC, capacity, 0, 0), 0)
+            self._mm = mmap.mmap(self._fd, 0)
+        except Exception:
+            os.close(self._fd)
+            raise
+
+        magic, self.capacity, _, _ = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f'{path} is not a command ring')
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        os.close(self._fd)
+
+    def append(self, command):
+        """Append one command and return its sequence number"""
+        return self.append_many([command])[0]
+
+    def append_many(self, commands):
+        """Append commands in order as one publish and return their sequence numbers"""
+        records = []
+        for command in commands:
+            payload = command.encode('utf-8')
+            if len(payload) > MAX_COMMAND_BYTES:
+                raise ValueError(f'command longer than {MAX_COMMAND_BYTES} bytes')
+            records.append(payload)
+
+        with self._lock, self._file_lock():
+            _, _, write_seq, write_pos = _HEADER.unpack_from(self._mm, 0)
+            needed = sum(_RECORD.size + len(payload) for payload in records)
+            if write_pos + needed - self._oldest_live_position(write_pos) > self.capacity:
+                raise RingFull('command queue is full')
+
+            sequences = []
+            for payload in records:
+                self._write_data(write_pos, _RECORD.pack(len(payload), write_seq) + payload)
+                sequences.append(write_seq)
+                write_pos += _RECORD.size + len(payload)
+                write_seq += 1
+
+            # Publish position before sequence: readers gate on the sequence.
+            # The sequence goes through the file descriptor rather than the
+            # map so the write raises an inotify event for RingWatcher
+            struct.pack_into('<Q', self._mm, 24, write_pos)
+            os.pwrite(self._fd, struct.pack('<Q', write_seq), 16)
+        return sequences
+
+    def consumer(self, name, watch_mode=None):
+        """Attach to the named consumer slot, creating it at the current head"""
+        return RingConsumer(self, name, watch_mode)
+
+    def head(self):
+        """Return (next sequence number, total bytes written)"""
+        _, _, write_seq, write_pos = _HEADER.unpack_from(self._mm, 0)
+        return write_seq, write_pos
+
+    def consumer_lag(self):
+        """Return {consumer name: commands it has not committed} for live consumers"""
+        write_seq, _ = self.head()
+        now = time.time()
+        lag = {}
+        for index in range(MAX_CONSUMERS):
+            name, read_seq, _, heartbeat = self._read_slot(index)
+            if name and now - heartbeat < CONSUMER_STALE_AFTER:
+                lag[name] = write_seq - read_seq
+        return lag
+
+    def _oldest_live_position(self, write_pos):
+        oldest = write_pos
+        now = time.time()
+        for index in range(MAX_CONSUMERS):
+            name, _, read_pos, heartbeat = self._read_slot(index)
+            if name and now - heartbeat < CONSUMER_STALE_AFTER:
+                oldest = min(oldest, read_pos)
+        return oldest
+
+    def _slot_offset(self, index):
+        return _SLOTS_OFFSET + index * _SLOT.size
+
+    def _read_slot(self, index):
+        name, read_seq, read_pos, heartbeat = _SLOT.unpack_from(self._mm, self._slot_offset(index))
+        return name.rstrip(b'\0').decode('utf-8'), read_seq, read_pos, heartbeat
+
+    def _write_slot(self, index, name, read_seq, read_pos):
+        _SLOT.pack_into(self._mm, self._slot_offset(index), name.encode('utf-8'),
+                        read_seq, read_pos, time.time())
+
+    def _touch_slot(self, index):
+        struct.pack_into('<d', self._mm, self._slot_offset(index) + 56, time.time())
+
+    def _register(self, name):
+        """Return (slot index, read_seq, read_pos) for name, registering it if new"""
+        if not name or len(name.encode('utf-8')) > 40:
+            raise ValueError('consumer name must be 1-40 bytes')
+
+        with self._lock, self._file_lock():
+            free = None
+            for index in range(MAX_CONSUMERS):
+                slot_name, read_seq, read_pos, _ = self._read_slot(index)
+                if slot_name == name:
+                    return index, read_seq, read_pos
+                if not slot_name and free is None:
+                    free = index
+            if free is None:
+                raise RuntimeError(f'no free consumer slots in {self.path}')
+
+            write_seq, write_pos = self.head()
+            self._write_slot(free, name, write_seq, write_pos)
+            return free, write_seq, write_pos
+
+    def _write_data(self, pos, data):
+        start = pos % self.capacity
+        first = min(len(data), self.capacity - start)
+        self._mm[DATA_OFFSET + start:DATA_OFFSET + start + first] = data[:first]
+        if first < len(data):
+            self._mm[DATA_OFFSET:DATA_OFFSET + len(data) - first] = data[first:]
+
+    def _read_data(self, pos, size):
+        start = pos % self.capacity
+        first = min(size, self.capacity - start)
+        data = self._mm[DATA_OFFSET + start:DATA_OFFSET + start + first]
+        if first < size:
+            data += self._mm[DATA_OFFSET:DATA_OFFSET + size - first]
+        return data
+
+    def _file_lock(self):
+        return _FileLock(self._fd)
+
+
+class RingConsumer:
+    """Reads commands from a CommandRing on behalf of one named consumer
+
+    ``read`` returns new records without persisting progress; call
+    ``commit`` once they have been delivered, so a crash in between replays
+    them (at-least-once) instead of losing them.
+    """
+
+    def __init__(self, ring, name, watch_mode=None):
+        self.ring = ring
+        self.name = name
+        self.dropped = 0
+        self._slot, self._read_seq, self._read_pos = ring._register(name)
+        self._watch_mode = watch_mode
+        self._watcher = None
+
+    def wait(self, timeout=HEARTBEAT_INTERVAL, max_records=None):
+        """Block until new records arrive or timeout expires, then read them
+
+        Returns an empty list on timeout. Callers should loop on this rather
+        than sleeping between reads; the timeout keeps the slot's heartbeat
+        fresh while the queue is idle.
+        """
+        if self._watcher is None:
+            self._watcher = RingWatcher(self.ring, self._watch_mode)
+
+        deadline = time.monotonic() + timeout
+        records = self.read(max_records)
+        while not records:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self._watcher.wait(remaining):
+                break
+            records = self.read(max_records)
+        return records
+
+    def close(self):
+        """Release the consumer's watcher; its slot and offset stay in the ring"""
+        if self._watcher is not None:
+            self._watcher.close()
+            self._watcher = None
+
+    def read(self, max_records=None):
+        """Return a list of (sequence, command) records not yet read"""
+        ring = self.ring
+        write_seq, write_pos = ring.head()
+        records = []
+        while self._read_seq < write_seq:
+            if max_records is not None and len(records) >= max_records:
+                break
+            if write_pos - self._read_pos > ring.capacity:
+                self._skip_to(write_seq, write_pos)
+                break
+
+            length, seq = _RECORD.unpack(ring._read_data(self._read_pos, _RECORD.size))
+            if seq != self._read_seq or length > MAX_COMMAND_BYTES:
+                self._skip_to(write_seq, write_pos)
+                break
+            payload = ring._read_data(self._read_pos + _RECORD.size, length)
+
+            # The producer may have lapped us while we copied; discard if so
+            if ring.head()[1] - self._read_pos > ring.capacity:
+                self._skip_to(*ring.head())
+                break
+
+            records.append((seq, payload.decode('utf-8', errors='replace')))
+            self._read_seq += 1
+            self._read_pos += _RECORD.size + length
+
+        ring._touch_slot(self._slot)
+        return records
+
+    def commit(self):
+        """Persist the current read position in the consumer's slot"""
+        self.ring._write_slot(self._slot, self.name, self._read_seq, self._read_pos)
+
+    def rewind(self):
+        """Forget uncommitted reads so the next read returns them again"""
+        _, self._read_seq, self._read_pos, _ = self.ring._read_slot(self._slot)
+
+    def seek_head(self):
+        """Skip everything not yet read, e.g. stale records from a previous run"""
+        self._read_seq, self._read_pos = self.ring.head()
+        self.commit()
+
+    def pending(self):
+        """Number of commands appended but not yet read"""
+        return self.ring.head()[0] - self._read_seq
+
+    def _skip_to(self, write_seq, write_pos):
+        lost = write_seq - self._read_seq
+        self.dropped += lost
+        log.warning(f"⚠️  Consumer {self.name} fell behind, skipped {lost} commands")
+        self._read_seq = write_seq
+        self._read_pos = write_pos
+        self.commit()
+
+
+class RingWatcher:
+    """Wakes a consumer when the producer publishes new commands
+
+    Uses inotify on the ring file where the platform has it, so an idle
+    sender sleeps in the kernel until an append happens. Elsewhere, or when
+    the watch cannot be set up (some FUSE mounts), it falls back to polling
+    every POLL_INTERVAL. ``mode`` is 'auto', 'inotify' (fail instead of
+    falling back) or 'poll'; it defaults to $ESP32_RING_WATCH, else 'auto'.
+    """
+
+    def __init__(self, ring, mode=None):
+        mode = mode or os.environ.get('ESP32_RING_WATCH') or 'auto'
+        if mode not in WATCH_MODES:
+            raise ValueError(f'Unknown watch mode: {mode}')
+
+        self._fd = None
+        if mode != 'poll':
+            try:
+                self._fd = _inotify_watch(ring.path)
+            except OSError as e:
+                if mode == 'inotify':
+                    raise
+                log.warning(f"⚠️  inotify unavailable for {ring.path} ({e}), polling instead")
+        self.mode = 'poll' if self._fd is None else 'inotify'
+
+    def wait(self, timeout):
+        """Wait up to timeout seconds for an append; return False if none was seen
+
+        In poll mode this just sleeps one poll interval and returns True, so
+        the caller re-reads the ring.
+        """
+        if self._fd is None:
+            time.sleep(min(timeout, POLL_INTERVAL))
+            return True
+
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return False
+        try:
+            while os.read(self._fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+def _inotify_watch(path):
+    """Return a non-blocking inotify descriptor reporting modifications of path"""
+    if _libc is None:
+        raise OSError('inotify is not supported on this platform')
+
+    fd = _libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+    if fd < 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+    if _libc.inotify_add_watch(fd, os.fsencode(path), _IN_MODIFY) < 0:
+        errno = ctypes.get_errno()
+        os.close(fd)
+        raise OSError(errno, os.strerror(errno))
+    return fd
+
+
+class _FileLock:
+    """Exclusive flock on the ring file, guarding appends and slot registration across processes"""
+
+    def __init__(self, fd):
+        self._fd = fd
+
+    def __enter__(self):
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+
+    def __exit__(self, *exc_info):
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+_default_ring = None
+_default_ring_lock = threading.Lock()
+
+
+def open_default_ring():
+    """Open the shared command ring at the first usable default path"""
+    global _default_ring
+    with _default_ring_lock:
+        if _default_ring is not None:
+            return _default_ring
+
+        paths = DEFAULT_RING_PATHS
+        if os.environ.get('ESP32_RING_PATH'):
+            paths = [os.environ['ESP32_RING_PATH']]
+
+        errors = []
+        for path in paths:
+            try:
+                _default_ring = CommandRing(path)
+                return _default_ring
+            except (OSError, ValueError) as e:
+                errors.append(f'{path}: {e}')
+        raise OSError('Could not open a command ring: ' + '; '.join(errors))
+
+
+_events_ring = None
+
+
+def open_events_ring():
+    """Open the ring the senders publish link events and robot replies on
+
+    It lives next to the default command ring and carries one JSON object
+    per record, flowing the other way: from the senders to the bridge.
+    """
+    global _events_ring
+    commands = open_default_ring()
+    with _default_ring_lock:
+        if _events_ring is None:
+            path = os.path.join(os.path.dirname(os.path.abspath(commands.path)), EVENTS_RING_FILE)
+            _events_ring = CommandRing(path, EVENTS_RING_CAPACITY)
+        return _events_ring
+
+
+def publish_event(event):
+    """Append event to the events ring; events are dropped if it is full or missing"""
+    try:
+        open_events_ring().append(json.dumps(event))
+    except (OSError, ValueError, RingFull) as e:
+        log.warning(f"⚠️  Could not publish {event.get('type')} event: {e}")
+
+
+def follow_events(name, callback):
+    """Pass every event published from now on to callback, on a daemon thread"""
+    consumer = open_events_ring().consumer(name)
+    consumer.seek_head()
+
+    def follow():
+        while True:
+            for _, record in consumer.wait():
+                try:
+                    callback(json.loads(record))
+                except ValueError:
+                    pass
+            consumer.commit()
+
+    thread = threading.Thread(target=follow, name=f'{name}-events', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Coalescing, rate-limited, prioritised scheduling of commands toward the robot
+Sits between the bridge handlers and their delivery path, so a burst of
+animation updates from the app cannot flood the Bluetooth link or hold up
+the commands that keep it alive
+"""
+
+import collections
+import threading
+import time
+
+import esp32_protocol
+import metrics
+import latency_trace
+
+# Off unless asked for: echo bridges and fast links need no limit
+DEFAULT_RATE = 0.0
+DEFAULT_BURST = 10
+PRIORITIES = esp32_protocol.PRIORITIES
+# Commands each priority may have waiting before new ones are refused
+DEFAULT_QUEUE_LIMITS = {'control': 32, 'normal': 256, 'bulk': 256}
+# How long a submit waits for a command's result before answering it itself
+RESULT_TIMEOUT = 60.0
+
+DELIVERED = metrics.registry.counter(
+    'bridge_scheduler_delivered_total', 'Commands handed on for delivery by the scheduler')
+COALESCED = metrics.registry.counter(
+    'bridge_scheduler_coalesced_total', 'Commands dropped for a newer one with the same key')
+FLUSHED = metrics.registry.counter(
+    'bridge_scheduler_flushed_total', 'Bulk commands dropped by a request asking to flush them')
+REJECTED = metrics.registry.counter(
+    'bridge_scheduler_rejected_total', 'Commands refused because their priority queue was full',
+    ('priority',))
+TIMED_OUT = metrics.registry.counter(
+    'bridge_scheduler_timed_out_total', 'Commands answered with an error after RESULT_TIMEOUT')
+
+
+class _Entry:
+    """One submitted command and the result its request is waiting for"""
+
+    __slots__ = ('command', 'key', 'priority', 'handler', 'result', 'done', 'trace', 'submitted')
+
+    def __init__(self, command, handler, priority=None, trace=None):
+        self.command = command
+        self.key = esp32_protocol.coalesce_key(command)
+        self.priority = priority or esp32_protocol.priority_of(command)
+        self.handler = handler
+        self.result = None
+        self.done = threading.Event()
+        self.trace = trace
+        self.submitted = time.time() if trace is not None else None
+
+    def finish(self, result):
+        self.result = result
+        self.done.set()
+
+
+class CommandScheduler:
+    """Delivers commands in order at no more than ``rate`` per second
+
+    A token bucket holding up to ``burst`` commands sets the pace (a rate
+    of 0, the default, means unlimited). While commands wait their turn, a newer submit
+    with a command of the same coalescing key (see
+    esp32_protocol.coalesce_key) replaces the pending ones: only the latest
+    animation is sent, and the replaced requests are answered as
+    superseded. Commands of one submit never replace each other, so a
+    batch can carry an animation sequence. Control commands such as
+    CONNECT and PING have no key and are never dropped.
+
+    Each command has a priority (see esp32_protocol.priority_of) and waits
+    in that priority's queue. Higher priorities are always sent first, and
+    ``control`` commands skip the rate limit altogether, so CONNECT and
+    PING never sit behind a backlog of animations. Order is kept within a
+    priority, not across them. A queue holding ``queue_limits[priority]``
+    commands refuses more with an error result. A submit with ``flush``
+    drops every bulk command still waiting, answered as flushed.
+
+    Delivery runs on one worker thread through ``deliver`` (by default a
+    submitting handler's ``handle_commands``), so commands that fall due
+    together, even from different requests, go out as one batch. A command
+    with no result after ``result_timeout`` seconds, because it is still
+    waiting or its delivery is stuck, is answered with an error instead of
+    holding its request forever; if still waiting, it is not sent.
+
+    Commands submitted with a latency_trace.Trace get its ``queue`` and
+    ``deliver`` spans here, and are handed to latency_trace.tracer once answered.
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST, queue_limits=None, deliver=None,
+                 name='command-scheduler', result_timeout=RESULT_TIMEOUT):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.queue_limits = {**DEFAULT_QUEUE_LIMITS, **(queue_limits or {})}
+        self.result_timeout = result_timeout
+        self.delivered = 0
+        self.coalesced = 0
+        self.flushed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._queues = {priority: collections.deque() for priority in PRIORITIES}
+        self._depths = dict.fromkeys(PRIORITIES, 0)
+        self._pending_keys = {}
+        self._tokens = float(self.burst)
+        self._refilled = time.monotonic()
+        self._changed = threading.Condition()
+        self.deliver = deliver
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, handler, commands, priority=None, flush=False, traces=None):
+        """Queue commands and wait for their results, in order
+
+        ``priority`` overrides the commands' own priority, and ``flush``
+        first drops the bulk commands still waiting. ``traces``, when
+        given, holds each command's latency_trace.Trace.
+        """
+        if priority is not None and priority not in PRIORITIES:
+            raise ValueError(f'Unknown priority: {priority}')
+        entries = [_Entry(command, handler, priority, trace)
+                   for command, trace in zip(commands, traces or [None] * len(commands))]
+        with self._changed:
+            if flush and entries:
+                self._flush(entries[0])
+            # Keys whose earlier commands this submit has replaced already
+            replaced = set()
+            for entry in entries:
+                previous = []
+                if entry.key is not None and entry.key not in replaced:
+                    previous = list(self._pending_keys.get(entry.key, ()))
+                # Replacing waiting commands of the same priority frees their slots
+                depth = self._depths[entry.priority] - sum(
+                    1 for waiting in previous if waiting.priority == entry.priority)
+                if depth >= self.queue_limits[entry.priority]:
+                    self._reject(entry)
+                    continue
+                for waiting in previous:
+                    self._supersede(waiting, entry)
+                if entry.key is not None:
+                    replaced.add(entry.key)
+                    self._pending_keys.setdefault(entry.key, []).append(entry)
+                self._queues[entry.priority].append(entry)
+                self._depths[entry.priority] += 1
+            self._changed.notify()
+
+        deadline = time.monotonic() + self.result_timeout
+        for entry in entries:
+            if not entry.done.wait(max(0.0, deadline - time.monotonic())):
+                self._time_out(entry)
+        return [entry.result for entry in entries]
+
+    def stats(self):
+        with self._changed:
+            return {
+                'rate': self.rate,
+                'burst': self.burst,
+                'queued': sum(self._depths.values()),
+                'queued_by_priority': dict(self._depths),
+                'queue_limits': dict(self.queue_limits),
+                'delivered': self.delivered,
+                'coalesced': self.coalesced,
+                'flushed': self.flushed,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out
+            }
+
+    def _supersede(self, previous, entry):
+        # The replaced entry stays in the queue and is skipped when reached
+        self.coalesced += 1
+        COALESCED.inc()
+        self._drop(previous, {
+            'command': previous.command,
+            'status': 'success',
+            'message': f'Superseded by "{entry.command}" before it was sent',
+            'coalesced': True
+        }, 'superseded')
+
+    def _flush(self, entry):
+        for previous in self._queues['bulk']:
+            if previous.done.is_set():
+                continue
+            self.flushed += 1
+            FLUSHED.inc()
+            self._drop(previous, {
+                'command': previous.command,
+                'status': 'success',
+                'message': f'Flushed by "{entry.command}" before it was sent',
+                'flushed': True
+            }, 'flushed')
+        self._queues['bulk'].clear()
+
+    def _drop(self, entry, result, outcome):
+        """Answer a queued entry without sending it (caller holds the lock)"""
+        self._forget_key(entry)
+        self._depths[entry.priority] -= 1
+        entry.finish(result)
+        if entry.trace is not None:
+            entry.trace.span('queue', entry.submitted, time.time())
+            latency_trace.tracer.finish(entry.trace, outcome)
+
+    def _forget_key(self, entry):
+        waiting = self._pending_keys.get(entry.key)
+        if waiting is not None and entry in waiting:
+            waiting.remove(entry)
+            if not waiting:
+                del self._pending_keys[entry.key]
+
+    def _reject(self, entry):
+        self.rejected += 1
+        REJECTED.inc(priority=entry.priority)
+        entry.finish({
+            'command': entry.command,
+            'status': 'error',
+            'message': f'Too many {entry.priority} commands waiting '
+                       f'(limit {self.queue_limits[entry.priority]})',
+            'rejected': True
+        })
+        if entry.trace is not None:
+            latency_trace.tracer.finish(entry.trace, 'rejected')
+
+    def _time_out(self, entry):
+        with self._changed:
+            if entry.done.is_set():
+                return
+            self.timed_out += 1
+            TIMED_OUT.inc()
+            result = {
+                'command': entry.command,
+                'status': 'error',
+                'message': f'No result within {self.result_timeout:g}s',
+                'timed_out': True
+            }
+            if entry in self._queues[entry.priority]:
+                self._drop(entry, result, 'timeout')
+            else:
+                # Already handed to deliver; its late result is ignored
+                entry.finish(result)
+
+    def _run(self):
+        while True:
+            with self._changed:
+                chunk = self._take()
+                while not chunk:
+                    self._changed.wait(self._wait_time())
+                    chunk = self._take()
+            self._deliver(chunk)
+
+    def _take(self):
+        """Pop the commands due now, highest priority first (caller holds the lock)"""
+        if not any(self._depths.values()):
+            for waiting in self._queues.values():
+                waiting.clear()  # Only answered entries are left
+            return []
+
+        if self.rate > 0:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+            self._refilled = now
+
+        chunk = []
+        for priority, waiting in self._queues.items():
+            unlimited = self.rate <= 0 or priority == 'control'
+            while waiting and (unlimited or self._tokens >= 1):
+                entry = waiting.popleft()
+                if entry.done.is_set():
+                    continue
+                self._forget_key(entry)
+                self._depths[priority] -= 1
+                if entry.trace is not None:
+                    entry.trace.span('queue', entry.submitted, time.time())
+                chunk.append(entry)
+                if self.rate > 0 and priority != 'control':
+                    self._tokens -= 1
+        return chunk
+
+    def _wait_time(self):
+        if not any(self._depths.values()) or self.rate <= 0:
+            return None
+        return max(0.001, (1 - self._tokens) / self.rate)
+
+    def _deliver(self, chunk):
+        # Handlers only differ by connection, so any of them can deliver the lot
+        deliver = self.deliver or chunk[0].handler.handle_commands
+        started = time.time()
+        try:
+            results = deliver([entry.command for entry in chunk])
+        except Exception as e:
+            results = [{'command': entry.command, 'status': 'error',
+                        'message': f'Delivery failed: {e}'} for entry in chunk]
+        ended = time.time()
+        results = list(results)
+        results += [{'command': entry.command, 'status': 'error',
+                     'message': 'Delivery returned no result'} for entry in chunk[len(results):]]
+        for entry, result in zip(chunk, results):
+            if entry.trace is not None:
+                entry.trace.span('deliver', started, ended)
+                latency_trace.tracer.delivered(entry.trace, result)
+            entry.finish(result)
+        self.delivered += len(chunk)
+        DELIVERED.inc(len(chunk))
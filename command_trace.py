@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Capture and timed replay of the commands sent to a bridge
+A bridge started with --trace PATH (or ESP32_TRACE=PATH) appends every
+/send_command and /send_commands request it accepts to PATH, one compact
+JSON line each with a nanosecond timestamp. ``replay`` feeds such a trace
+back into any bridge at its recorded pace, N times faster or as fast as
+possible, and reports latency, acknowledgements and drops; ``summary``
+describes a trace without sending it
+"""
+
+import argparse
+import collections
+import http.client
+import json
+import queue
+import threading
+import time
+import urllib.parse
+
+from metrics import latency_summary
+
+FLUSH_INTERVAL = 1.0
+WRITE_BUFFER = 64 * 1024
+DEFAULT_URL = 'http://127.0.0.1:8080'
+
+
+class TraceWriter:
+    """Appends accepted requests to a trace file
+
+    Lines are buffered and flushed every FLUSH_INTERVAL seconds by a
+    background thread (and on ``close``), so recording costs a request one
+    short locked write rather than a disk write.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.records = 0
+        self._file = open(path, 'ab', buffering=WRITE_BUFFER)
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        threading.Thread(target=self._flush_periodically, name='trace-flush', daemon=True).start()
+
+    def record(self, route, commands, scheduling=None, ack_timeout=None):
+        entry = {'ns': time.time_ns(), 'route': route, 'commands': commands}
+        entry.update((key, value) for key, value in (scheduling or {}).items() if value)
+        if ack_timeout is not None:
+            entry['ack_timeout'] = ack_timeout
+        line = (json.dumps(entry, separators=(',', ':')) + '\n').encode()
+        with self._lock:
+            if not self._closed.is_set():
+                self._file.write(line)
+                self.records += 1
+
+    def close(self):
+        with self._lock:
+            self._closed.set()
+            self._file.close()
+
+    def _flush_periodically(self):
+        while not self._closed.wait(FLUSH_INTERVAL):
+            with self._lock:
+                if not self._closed.is_set():
+                    self._file.flush()
+
+
+def read_trace(path):
+    """Yield the records of a trace, skipping a line cut short by a crash"""
+    with open(path, 'rb') as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+def request_body(record):
+    """The request body that reproduces a recorded request"""
+    body = {key: value for key, value in record.items()
+            if key in ('priority', 'flush', 'device')}
+    if 'ack_timeout' in record:
+        body.update(wait_for_ack=True, ack_timeout=record['ack_timeout'])
+    if record['route'] == '/send_command':
+        body['command'] = record['commands'][0]
+    else:
+        body['commands'] = record['commands']
+    return json.dumps(body)
+
+
+class ReplayResult:
+    """What happened to each replayed request and its commands"""
+
+    def __init__(self):
+        self.latencies = collections.defaultdict(list)
+        self.lags = []
+        self.ack_latencies = []
+        self.acks = collections.Counter()
+        self.errors = collections.Counter()
+        self.commands = 0
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, route, latency, lag, response):
+        with self._lock:
+            self.latencies[route].append(latency)
+            self.lags.append(lag)
+            if response is None:
+                self.errors['http'] += 1
+                return
+            results = response.get('results', [response])
+            for result in results:
+                self.commands += 1
+                if result.get('status') != 'success':
+                    self.errors['command'] += 1
+                ack = result.get('ack')
+                if ack:
+                    self.acks[ack['status']] += 1
+                    if ack.get('latency_ms') is not None:
+                        self.ack_latencies.append(ack['latency_ms'] / 1000)
+
+    def summary(self):
+        total = sum(len(latencies) for latencies in self.latencies.values())
+        dropped = self.errors['http'] + self.errors['command']
+        return {
+            'requests': total,
+            'commands': self.commands,
+            'elapsed_s': round(self.elapsed, 3),
+            'throughput': round(total / self.elapsed, 1) if self.elapsed else None,
+            'dropped': dropped,
+            'errors': dict(self.errors),
+            'acks': dict(self.acks),
+            'routes': {route: {'requests': len(latencies), **latency_summary(latencies)}
+                       for route, latencies in sorted(self.latencies.items())},
+            'schedule_lag': latency_summary(self.lags),
+            'ack_latency': latency_summary(self.ack_latencies)
+        }
+
+
+def replay(records, url, speed=1.0, concurrency=8, result=None):
+    """Send records to the bridge at url, spaced as recorded divided by speed
+
+    A speed of 0 sends every request as soon as a client is free. Returns
+    the ReplayResult.
+    """
+    result = result or ReplayResult()
+    target = urllib.parse.urlsplit(url)
+    due = queue.Queue(concurrency * 4)
+
+    def client():
+        connection = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=90)
+        try:
+            while True:
+                item = due.get()
+                if item is None:
+                    return
+                record, scheduled = item
+                started = time.perf_counter()
+                response = None
+                try:
+                    connection.request('POST', record['route'], request_body(record),
+                                       {'Content-Type': 'application/json'})
+                    reply = connection.getresponse()
+                    body = reply.read()
+                    if reply.status == 200:
+                        response = json.loads(body)
+                    if reply.getheader('Connection') == 'close':
+                        connection.close()
+                except (OSError, http.client.HTTPException, ValueError):
+                    connection.close()
+                result.record(record['route'], time.perf_counter() - started,
+                              max(0.0, started - scheduled), response)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=client, name=f'replay-client-{index}')
+               for index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+
+    started = time.perf_counter()
+    first_ns = None
+    for record in records:
+        if first_ns is None:
+            first_ns = record['ns']
+        if speed > 0:
+            scheduled = started + (record['ns'] - first_ns) / 1e9 / speed
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        else:
+            scheduled = time.perf_counter()
+        due.put((record, scheduled))
+    for _ in threads:
+        due.put(None)
+    for thread in threads:
+        thread.join()
+    result.elapsed = time.perf_counter() - started
+    return result
+
+
+def summarize_trace(records):
+    routes = collections.Counter()
+    commands = collections.Counter()
+    timestamps = []
+    for record in records:
+        routes[record['route']] += 1
+        commands.update(record['commands'])
+        timestamps.append(record['ns'])
+    duration = (timestamps[-1] - timestamps[0]) / 1e9 if timestamps else 0.0
+    return {
+        'requests': len(timestamps),
+        'commands': sum(commands.values()),
+        'duration_s': round(duration, 3),
+        'rate': round(len(timestamps) / duration, 1) if duration else None,
+        'routes': dict(routes),
+        'top_commands': dict(commands.most_common(10))
+    }
+
+
+def format_replay(summary):
+    lines = [f"{summary['requests']} requests ({summary['commands']} commands) in "
+             f"{summary['elapsed_s']}s, {summary['throughput']} req/s, "
+             f"{summary['dropped']} dropped"]
+    for route, stats in summary['routes'].items():
+        lines.append(f"  {route:<15} {stats['requests']:>7} req  p50 {stats['p50_ms']} ms  "
+                     f"p95 {stats['p95_ms']} ms  p99 {stats['p99_ms']} ms  max {stats['max_ms']} ms")
+    lag = summary['schedule_lag']
+    lines.append(f"  {'behind schedule':<15} p50 {lag['p50_ms']} ms  p99 {lag['p99_ms']} ms  "
+                 f"max {lag['max_ms']} ms")
+    if summary['acks']:
+        ack = summary['ack_latency']
+        acks = ', '.join(f'{status} {count}' for status, count in sorted(summary['acks'].items()))
+        lines.append(f"  {'acks':<15} {acks}  p50 {ack['p50_ms']} ms  p99 {ack['p99_ms']} ms")
+    return '\n'.join(lines)
+
+
+def parse_speed(value):
+    """'max' (as fast as possible), or a multiple of the recorded pace such as 1, 10 or 10x"""
+    if value == 'max':
+        return 0.0
+    speed = float(value.rstrip('x'))
+    if speed <= 0:
+        raise argparse.ArgumentTypeError('speed must be positive, or max')
+    return speed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='action', required=True)
+    replay_parser = commands.add_parser('replay', help='send a trace to a bridge')
+    replay_parser.add_argument('trace', help='trace file recorded with --trace')
+    replay_parser.add_argument('--url', default=DEFAULT_URL,
+                               help='bridge to send to (default: %(default)s)')
+    replay_parser.add_argument('--speed', type=parse_speed, default=1.0,
+                               help='1 for the recorded pace, N (or Nx) for N times faster, '
+                                    'max for no pauses (default: 1)')
+    replay_parser.add_argument('--concurrency', type=int, default=8,
+                               help='requests in flight at most (default: %(default)s)')
+    replay_parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    summary_parser = commands.add_parser('summary', help='describe a trace')
+    summary_parser.add_argument('trace', help='trace file recorded with --trace')
+    args = parser.parse_args()
+
+    if args.action == 'summary':
+        print(json.dumps(summarize_trace(read_trace(args.trace)), indent=2))
+        return
+
+    # Read it all first: replaying into the bridge that recorded it must not feed itself
+    records = list(read_trace(args.trace))
+    summary = replay(records, args.url, args.speed, args.concurrency).summary()
+    print(json.dumps(summary, indent=2) if args.json else format_replay(summary))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,122 +2,163 @@
 """
 Direct ESP32 Sender - Sends messages directly to ESP32 via Bluetooth
 Bypasses Serial Terminal app completely
+Set ESP32_TRANSPORT (see transports.make_transport) to send somewhere else,
+e.g. tcp://127.0.0.1:9750 for esp32_simulator.py, and ESP32_FRAMING=binary
+to send checksummed binary frames (see esp32_protocol) instead of text lines
 """
 
 import time
 import os
-import subprocess
-import bluetooth
+import bridge_log
+import command_ring
+import esp32_discovery
+import esp32_link
+import esp32_protocol
+import transports
 
-def find_esp32_device():
-    """Find ESP32 device by name"""
-    try:
-        print("🔍 Scanning for ESP32 device...")
-        nearby_devices = bluetooth.discover_devices(lookup_names=True)
-        
-        for addr, name in nearby_devices:
-            if "ESP32_Eye_Robot" in name:
-                print(f"✅ Found ESP32: {name} ({addr})")
-                return addr
-        
-        print("❌ ESP32 device not found")
-        return None
-    except Exception as e:
-        print(f"❌ Error scanning for devices: {e}")
-        return None
+log = bridge_log.get_logger('direct_esp32_sender')
 
-def send_to_esp32(message, device_addr):
-    """Send message directly to ESP32 via Bluetooth"""
-    try:
-        print(f"📤 Sending to ESP32: {message}")
-        
-        # Create Bluetooth socket
-        sock = bluetooth.BluetoothSocket(bluetooth.RFCOMM)
-        sock.connect((device_addr, 1))  # Channel 1 for SPP
-        
-        # Send message
-        sock.send(message.encode())
-        
-        # Close socket
-        sock.close()
-        
-        print("✅ Message sent successfully!")
-        return True
-        
-    except Exception as e:
-        print(f"❌ Error sending to ESP32: {e}")
-        return False
+def find_esp32_device(locator):
+    """Return the ESP32's address from the device cache, or None while scanning"""
+    addr = locator.address()
+    if addr:
+        log.info(f"✅ Using cached ESP32 address: {addr}")
+    else:
+        log.info("🔍 ESP32 not cached yet, scanning in the background...")
+    return addr
 
-def read_message_file():
-    """Read the latest message from the file"""
-    possible_paths = [
-        '/sdcard/Download/esp32_message.txt',
-        '/sdcard/esp32_message.txt',
-        './esp32_message.txt',
-        'esp32_message.txt'
-    ]
-    
-    for path in possible_paths:
+class CachedRfcommTransport(transports.RfcommTransport):
+    """RFCOMM to the cached ESP32 address, refreshing the cache when it fails"""
+
+    def __init__(self, locator):
+        super().__init__(None)
+        self.name = 'rfcomm'
+        self.locator = locator
+
+    def _open(self):
+        self.address = self.locator.address()
+        if not self.address:
+            raise OSError('ESP32 device not found yet')
         try:
-            if os.path.exists(path):
-                with open(path, 'r') as f:
-                    message = f.read().strip()
-                if message:
-                    print(f"📖 Read message from {path}: {message}")
-                    return message, path
-        except:
-            continue
+            sock = super()._open()
+        except Exception:
+            self.locator.connect_failed(self.address)
+            raise
+        self.locator.connect_succeeded(self.address)
+        return sock
+
+def send_to_esp32(message, link):
+    """Send message directly to ESP32 over the persistent Bluetooth link"""
+    log.info("📤 Sending to ESP32: %s", message, extra=bridge_log.fields(sampled=True, message=message))
     
-    return None, None
+    # A batch is several lines sent in this one write
+    if link.send(message):
+        log.info("✅ Message sent successfully!", extra=bridge_log.fields(sampled=True))
+        return True
+    
+    log.error("❌ Error sending to ESP32: %s", link.last_error, extra=bridge_log.fields(error=link.last_error))
+    return False
 
-def delete_message_file(file_path):
-    """Delete the message file after reading"""
-    try:
-        os.remove(file_path)
-        print(f"🗑️  Deleted message file: {file_path}")
-    except:
-        pass
+def reject_unencodable(record, framing, rejected):
+    """Acknowledge a queued command the framing cannot carry as rejected; True if it was
+
+    ``rejected`` holds the sequences acknowledged so far, which a rewind
+    reads again; each is acknowledged once.
+    """
+    sequence, message = record
+    if sequence in rejected:
+        return True
+    error = esp32_protocol.encoding_error(message, framing)
+    if error is None:
+        return False
+    log.error("❌ Cannot send %s to ESP32: %s", message, error,
+              extra=bridge_log.fields(sequence=sequence, error=error))
+    command_ring.publish_event(esp32_protocol.ack_event(sequence, message, 'rejected', error))
+    rejected.add(sequence)
+    return True
+
+def link_event_handler(matcher):
+    """Pass link events on to the bridge, matching robot replies to commands on the way"""
+    def on_event(event):
+        if event['type'] == 'response':
+            matcher.reply(event['response'])
+        elif event['type'] == 'link' and event['state'] != 'connected':
+            matcher.reset()
+        command_ring.publish_event(event)
+    return on_event
 
 def main():
-    print("🤖 Direct ESP32 Sender Started")
-    print("📁 Watching for messages to send directly to ESP32...")
-    print("⏹️  Press Ctrl+C to stop")
+    log.info("🤖 Direct ESP32 Sender Started")
+    log.info("📁 Watching for messages to send directly to ESP32...")
+    log.info("⏹️  Press Ctrl+C to stop")
+    
+    ring = command_ring.open_default_ring()
+    consumer = ring.consumer('direct_esp32_sender')
+    
+    if os.environ.get('ESP32_TRANSPORT'):
+        transport = transports.make_transport(os.environ['ESP32_TRANSPORT'])
+        log.info(f"🔌 Using transport: {transport.name}")
+    else:
+        # Find ESP32 device; a cache miss is scanned for while the link retries
+        locator = esp32_discovery.DeviceLocator(esp32_discovery.cache_path_for(ring.path))
+        if not find_esp32_device(locator):
+            log.info("💡 Make sure the ESP32 is discoverable.")
+        transport = CachedRfcommTransport(locator)
     
-    # Find ESP32 device
-    esp32_addr = find_esp32_device()
-    if not esp32_addr:
-        print("❌ Cannot find ESP32 device. Make sure it's discoverable.")
-        return
+    # Replies are matched to the queued commands and acknowledged to the bridge
+    matcher = esp32_protocol.ReplyMatcher(command_ring.publish_event)
     
-    last_message = ""
+    # Keep one connection open for every command instead of connecting per send
+    # Link state and robot replies are passed on to the bridge's /events
+    framing = os.environ.get('ESP32_FRAMING', 'text')
+    log.info(f"📦 Framing: {framing}")
+    link = esp32_link.ESP32Link(transport.connect,
+                                health_path=esp32_link.health_path_for(ring.path),
+                                on_event=link_event_handler(matcher),
+                                framing=framing,
+                                on_tick=matcher.expire).start()
+    
+    # Rejected since the last commit: a rewind after a failed send reads them again
+    rejected = set()
     
     try:
         while True:
-            message, file_path = read_message_file()
+            # Sleeps until the bridge queues something (or the heartbeat is due)
+            records = consumer.wait()
+            
+            # A command the framing cannot carry would fail every retry
+            sendable = [record for record in records
+                        if not reject_unencodable(record, framing, rejected)]
+            if records and not sendable:
+                consumer.commit()
+                rejected.clear()
             
-            if message and message != last_message:
-                print(f"🚀 New message detected: {message}")
+            if sendable:
+                messages = [message for _, message in sendable]
+                log.info("🚀 New messages detected: %s", ', '.join(messages),
+                         extra=bridge_log.fields(sampled=True, first_sequence=sendable[0][0], count=len(sendable)))
                 
-                # Send directly to ESP32
-                success = send_to_esp32(message, esp32_addr)
+                # Send everything queued since the last read in one write
+                matcher.expect(sendable)
+                success = send_to_esp32('\n'.join(messages), link)
                 
                 if success:
-                    print("✅ Message sent directly to ESP32!")
+                    log.info("✅ Message sent directly to ESP32!", extra=bridge_log.fields(sampled=True))
+                    matcher.delivered(sendable)
+                    # Only mark as handled once delivered, so failures are retried
+                    consumer.commit()
+                    rejected.clear()
                 else:
-                    print("❌ Failed to send to ESP32")
-                
-                print("=" * 50)
+                    log.error("❌ Failed to send to ESP32")
+                    matcher.forget(sendable)
+                    consumer.rewind()
+                    time.sleep(1)
                 
-                # Delete the file so we don't repeat the same message
-                if file_path:
-                    delete_message_file(file_path)
-                
-                last_message = message
-            
-            time.sleep(1)  # Check every second
             
     except KeyboardInterrupt:
-        print("\n⏹️  Direct ESP32 Sender stopped")
+        log.info("⏹️  Direct ESP32 Sender stopped")
+    finally:
+        link.close()
 
 if __name__ == '__main__':
     main()
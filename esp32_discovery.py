@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Cached Bluetooth discovery of the ESP32 robot
+Remembers the addresses of devices seen before so senders start without a
+~10 s inquiry, and rescans in the background only when the cache misses
+"""
+
+import json
+import os
+import threading
+import time
+
+import bridge_log
+
+log = bridge_log.get_logger(__name__)
+
+DEVICE_NAME = 'ESP32_Eye_Robot'
+DEFAULT_TTL = 7 * 24 * 3600
+REFRESH_INTERVAL = 60.0
+CACHE_FILE = 'esp32_devices.json'
+
+
+def discover_devices(device_name=DEVICE_NAME):
+    """Run a Bluetooth inquiry and return [(address, name)] of matching devices"""
+    import bluetooth  # Only needed when the cache misses
+
+    return [(addr, name) for addr, name in bluetooth.discover_devices(lookup_names=True)
+            if name and device_name in name]
+
+
+class DeviceLocator:
+    """Finds the robot's address, preferring the on-disk cache over an inquiry
+
+    ``address`` never blocks: it returns the most recently seen cached
+    address that is younger than ``ttl`` and, on a miss, starts a discovery
+    thread whose result lands in the cache. ``connect_failed`` refreshes
+    the cache in the background (at most every REFRESH_INTERVAL) in case
+    the robot came back under another address; the current address is kept
+    until a scan finds a better one.
+    """
+
+    def __init__(self, cache_path, device_name=DEVICE_NAME, ttl=DEFAULT_TTL, discover=None):
+        self.cache_path = cache_path
+        self.device_name = device_name
+        self.ttl = ttl
+        self._discover = discover or discover_devices
+        self._lock = threading.Lock()
+        self._scanning = False
+        self._last_scan = 0.0
+        self._devices = self._load()
+
+    def address(self):
+        """Return the best cached address, or None while a discovery runs"""
+        with self._lock:
+            address = self._best_address()
+            if address is None:
+                self._start_scan()
+            return address
+
+    def connect_succeeded(self, address):
+        """Refresh address's timestamp so it stays first in the cache"""
+        with self._lock:
+            entry = self._devices.setdefault(address, {'name': self.device_name})
+            entry['seen'] = time.time()
+            self._save()
+
+    def connect_failed(self, address):
+        """Rescan in the background, since the robot may no longer be at address"""
+        with self._lock:
+            if time.monotonic() - self._last_scan >= REFRESH_INTERVAL:
+                self._start_scan()
+
+    def _best_address(self):
+        now = time.time()
+        fresh = [(entry['seen'], address) for address, entry in self._devices.items()
+                 if now - entry.get('seen', 0) < self.ttl]
+        return max(fresh)[1] if fresh else None
+
+    def _start_scan(self):
+        if self._scanning:
+            return
+        self._scanning = True
+        self._last_scan = time.monotonic()
+        threading.Thread(target=self._scan, name='esp32-discovery', daemon=True).start()
+
+    def _scan(self):
+        log.info(f"🔍 Scanning for {self.device_name} in the background...")
+        try:
+            found = self._discover(self.device_name)
+        except Exception as e:
+            log.error(f"❌ Error scanning for devices: {e}")
+            found = []
+
+        with self._lock:
+            now = time.time()
+            for address, name in found:
+                log.info(f"✅ Found ESP32: {name} ({address})")
+                self._devices[address] = {'name': name, 'seen': now}
+            if found:
+                self._save()
+            else:
+                log.warning(f"❌ {self.device_name} not found, will rescan")
+            self._scanning = False
+
+    def _load(self):
+        try:
+            with open(self.cache_path) as f:
+                devices = json.load(f)
+            return devices if isinstance(devices, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        temp_path = f'{self.cache_path}.{os.getpid()}.tmp'
+        try:
+            with open(temp_path, 'w') as f:
+                json.dump(self._devices, f, indent=2)
+            os.replace(temp_path, self.cache_path)
+        except OSError as e:
+            log.warning(f"⚠️  Could not save device cache to {self.cache_path}: {e}")
+
+
+def cache_path_for(ring_path):
+    """Where senders consuming ring_path keep their device cache"""
+    return os.path.join(os.path.dirname(os.path.abspath(ring_path)), CACHE_FILE)
@@ -47,6 +47,26 @@ bool bluetooth_connected = false;
 unsigned long last_bluetooth_check = 0;
 const unsigned long BLUETOOTH_CHECK_INTERVAL = 1000; // Check every second
 
+// Commands arrive as text lines or as binary frames (see esp32_protocol.py):
+// header 0xA0 | type, a length byte for TEXT frames, the payload and a CRC-8
+// (polynomial 0x07) of everything before it. Frames are delimited by their
+// length, so neither kind of command waits for a read timeout.
+#define FRAME_HEADER 0xA0
+#define FRAME_TEXT 0x0
+#define FRAME_ANIMATION 0x1
+#define FRAME_CONNECT 0x2
+#define FRAME_PING 0x3
+#define MAX_COMMAND_LENGTH 255
+
+uint8_t rx_buffer[MAX_COMMAND_LENGTH + 3];
+int rx_length = 0;
+int rx_frame_size = 0; // bytes of the frame being read, CRC included; 0 for a text line, -1 until a TEXT frame's length is known
+bool rx_skipping = false; // after a bad frame, drop bytes until the next header or line end
+unsigned long rx_last_byte = 0;
+// Senders that end text commands without a newline still get them handled
+// after this long; a frame cut short is dropped after it
+const unsigned long RX_IDLE_TIMEOUT = 1000;
+
 void draw_eyes(bool update = true) {
     display.clearDisplay();
     //draw from center
@@ -399,6 +419,96 @@ void handle_bluetooth_command(String command) {
     }
 }
 
+uint8_t crc8(const uint8_t *data, int length) {
+    uint8_t crc = 0;
+    for (int i = 0; i < length; i++) {
+        crc ^= data[i];
+        for (int bit = 0; bit < 8; bit++) {
+            crc = (crc & 0x80) ? (crc << 1) ^ 0x07 : crc << 1;
+        }
+    }
+    return crc;
+}
+
+void handle_received_frame() {
+    int size = rx_frame_size - 1;
+    uint8_t type = rx_buffer[0] & 0x0F;
+    if (crc8(rx_buffer, size) != rx_buffer[size]) {
+        Serial.println("Dropped BT frame with bad checksum");
+        rx_skipping = true;
+        return;
+    }
+
+    if (type == FRAME_ANIMATION) {
+        handle_bluetooth_command("A" + String(rx_buffer[1]));
+    } else if (type == FRAME_CONNECT) {
+        handle_bluetooth_command("CONNECT");
+    } else if (type == FRAME_PING) {
+        handle_bluetooth_command("PING");
+    } else {
+        rx_buffer[size] = 0;
+        handle_bluetooth_command(String((char *)rx_buffer + 2));
+    }
+}
+
+// Feed one received byte to the command parser
+void receive_bluetooth_byte(uint8_t c) {
+    if (rx_skipping) {
+        if (c == '\n') {
+            rx_skipping = false;
+            return;
+        }
+        if ((c & 0xF0) != FRAME_HEADER) {
+            return;
+        }
+        rx_skipping = false;
+    }
+
+    if (rx_length == 0 && (c & 0xF0) == FRAME_HEADER) {
+        uint8_t type = c & 0x0F;
+        if (type == FRAME_ANIMATION) {
+            rx_frame_size = 3;
+        } else if (type == FRAME_CONNECT || type == FRAME_PING) {
+            rx_frame_size = 2;
+        } else if (type == FRAME_TEXT) {
+            rx_frame_size = -1;
+        } else {
+            Serial.println("Dropped BT frame of unknown type");
+            rx_skipping = true;
+            return;
+        }
+        rx_buffer[rx_length++] = c;
+        return;
+    }
+
+    if (rx_frame_size == 0) {
+        // Text line
+        if (c == '\n') {
+            rx_buffer[rx_length] = 0;
+            String command = String((char *)rx_buffer);
+            rx_length = 0;
+            command.trim();
+            if (command.length() > 0) {
+                handle_bluetooth_command(command);
+            }
+        } else if (rx_length < MAX_COMMAND_LENGTH) {
+            rx_buffer[rx_length++] = c;
+        }
+        return;
+    }
+
+    rx_buffer[rx_length++] = c;
+    if (rx_frame_size < 0) {
+        // The TEXT frame's length byte: header, length, payload and CRC
+        rx_frame_size = 2 + c + 1;
+    }
+    if (rx_length == rx_frame_size) {
+        handle_received_frame();
+        rx_length = 0;
+        rx_frame_size = 0;
+    }
+}
+
 void launch_animation_with_index(int animation_index) {
     if (animation_index > max_animation_index) {
         animation_index = 8;
@@ -515,10 +625,20 @@ void loop() {
     }
 
     // Check for incoming Bluetooth messages
-    if (SerialBT.available()) {
-        String receivedMessage = SerialBT.readString();
-        receivedMessage.trim();
-        handle_bluetooth_command(receivedMessage);
+    // Text commands end at a newline and binary frames at their length, so
+    // a batch sent in one write is split into its commands without waiting
+    while (SerialBT.available()) {
+        receive_bluetooth_byte(SerialBT.read());
+        rx_last_byte = millis();
+    }
+    if (rx_length > 0 && millis() - rx_last_byte >= RX_IDLE_TIMEOUT) {
+        if (rx_frame_size == 0) {
+            receive_bluetooth_byte('\n');
+        } else {
+            Serial.println("Dropped incomplete BT frame");
+            rx_length = 0;
+            rx_frame_size = 0;
+        }
     }
 
     // Check for touch sensor trigger
@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""
+Persistent connection to the ESP32 for the sender scripts
+Keeps one socket open across commands, reconnects with backoff when it drops
+and publishes the link's health for the bridge's /get_status
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+
+import bridge_log
+import esp32_protocol
+import metrics
+
+log = bridge_log.get_logger(__name__)
+
+DEFAULT_MAX_QUEUE = 64
+MAX_WRITE_BYTES = 4096
+SEND_TIMEOUT = 5.0
+MIN_BACKOFF = 0.5
+MAX_BACKOFF = 30.0
+HEALTH_INTERVAL = 5.0
+READ_INTERVAL = 0.5
+HEALTH_FILE = 'esp32_link.json'
+
+LINK_UP = metrics.registry.gauge(
+    'esp32_link_up', 'Whether the link to the robot is connected', ('link',))
+LINK_QUEUED = metrics.registry.gauge(
+    'esp32_link_queued_messages', 'Messages waiting for the link to write them', ('link',))
+LINK_MESSAGES = metrics.registry.counter(
+    'esp32_link_messages_sent_total', 'Messages written to the robot', ('link',))
+LINK_BYTES = metrics.registry.counter(
+    'esp32_link_bytes_sent_total', 'Bytes written to the robot', ('link',))
+LINK_RECONNECTS = metrics.registry.counter(
+    'esp32_link_reconnects_total', 'Times the link (e.g. RFCOMM) was re-established', ('link',))
+LINK_WRITE_DURATION = metrics.registry.histogram(
+    'esp32_link_write_duration_seconds', 'Time to write one coalesced batch', ('link',))
+
+
+class _Write:
+    """One queued message and the outcome the sending thread waits on"""
+
+    __slots__ = ('data', 'done', 'error', 'cancelled')
+
+    def __init__(self, data):
+        self.data = data
+        self.done = threading.Event()
+        self.error = None
+        self.cancelled = False
+
+
+class ESP32Link:
+    """Long-lived, self-healing connection to the robot
+
+    ``connect`` is a callable returning a connected socket-like object with
+    ``send`` and ``close`` (an RFCOMM socket for the direct sender). A single
+    writer thread owns the socket: ``send`` queues a message and waits for
+    the write, and messages queued meanwhile go out together in one write.
+    The queue is bounded, so callers block instead of piling up commands
+    while the link is slow.
+
+    When a connect or write fails the socket is dropped, pending writes fail
+    and reconnects back off exponentially from MIN_BACKOFF to MAX_BACKOFF;
+    writes during the backoff fail immediately so the caller can retry later.
+
+    If the connected object is ``readable`` (see transports.Transport), a
+    reader thread collects the robot's replies. ``on_event`` is then called
+    with a ``response`` event for every reply line, and with a ``link``
+    event whenever the link's state changes. ``on_tick`` is called from the
+    reader thread about every READ_INTERVAL, e.g. to expire overdue replies
+    while the robot is silent.
+
+    ``framing`` selects how commands are written (see esp32_protocol):
+    ``text`` lines, or ``binary`` frames for firmware that parses them,
+    which only byte-stream transports (RFCOMM, TCP, serial) can carry.
+    """
+
+    def __init__(self, connect, name='ESP32', max_queue=DEFAULT_MAX_QUEUE, health_path=None,
+                 send_timeout=SEND_TIMEOUT, on_event=None, framing='text', on_tick=None):
+        if framing not in esp32_protocol.FRAMINGS:
+            raise ValueError(f'Unknown framing: {framing}')
+        self.name = name
+        self.framing = framing
+        self.on_event = on_event
+        self.on_tick = on_tick
+        self.send_timeout = send_timeout
+        self.health_path = health_path
+        self.state = 'disconnected'
+        self.last_error = None
+        self.connected_since = None
+        self.reconnects = 0
+        self.messages_sent = 0
+        self.bytes_sent = 0
+        self._connect = connect
+        self._queue = queue.Queue(max_queue)
+        self._sock = None
+        self._backoff = MIN_BACKOFF
+        self._retry_at = 0.0
+        self._health_published = 0.0
+        self._sock_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'{name}-link', daemon=True)
+        self._reader = threading.Thread(target=self._read_loop, name=f'{name}-link-reader',
+                                        daemon=True)
+
+    def start(self):
+        """Start the writer thread, which connects straight away, and the reader"""
+        self._thread.start()
+        self._reader.start()
+        return self
+
+    def close(self):
+        """Stop the link's threads and close the socket"""
+        self._stop.set()
+        try:
+            # Wake the writer rather than waiting out its queue poll
+            self._queue.put_nowait(None)
+        except queue.Full:
+            pass
+        for thread in (self._thread, self._reader):
+            if thread.is_alive():
+                thread.join()
+        self._disconnect(None)
+        self._set_state('closed')
+
+    def send(self, message, timeout=None):
+        """Write message (one or more lines) to the robot, returning True once sent"""
+        if timeout is None:
+            timeout = self.send_timeout
+        try:
+            write = _Write(esp32_protocol.encode_commands(message, self.framing))
+        except ValueError as e:
+            self.last_error = f'cannot encode: {e}'
+            return False
+        try:
+            self._queue.put(write, timeout=timeout)
+        except queue.Full:
+            self.last_error = 'write queue full'
+            return False
+
+        if not write.done.wait(timeout):
+            # Don't let it go out late: the caller is going to retry it
+            write.cancelled = True
+            self.last_error = 'write timed out'
+            return False
+        return write.error is None
+
+    def health(self):
+        """Describe the link for status reporting"""
+        return {
+            'name': self.name,
+            'state': self.state,
+            'framing': self.framing,
+            'connected_since': self.connected_since,
+            'last_error': self.last_error,
+            'reconnects': self.reconnects,
+            'queued': self._queue.qsize(),
+            'messages_sent': self.messages_sent,
+            'bytes_sent': self.bytes_sent,
+            'pid': os.getpid(),
+            'updated': time.time()
+        }
+
+    def _run(self):
+        self._try_connect()
+        while not self._stop.is_set():
+            try:
+                first = self._queue.get(timeout=HEALTH_INTERVAL / 2)
+            except queue.Empty:
+                if self._sock is None:
+                    self._try_connect()
+                elif time.monotonic() - self._health_published >= HEALTH_INTERVAL:
+                    self._publish_health()
+                continue
+
+            if first is None:
+                continue
+            batch = self._collect(first)
+            if not batch:
+                continue
+            if self._sock is None and not self._try_connect():
+                self._finish(batch, self.last_error)
+                continue
+
+            sock = self._sock
+            started = time.monotonic()
+            try:
+                if sock is None:
+                    raise ConnectionError('connection lost')
+                _sendall(sock, b''.join(write.data for write in batch))
+            except Exception as e:
+                log.error("❌ %s link write failed: %s", self.name, e,
+                          extra=bridge_log.fields(link=self.name, error=str(e), messages=len(batch)))
+                self._disconnect(e, sock)
+                self._finish(batch, str(e))
+                continue
+
+            LINK_WRITE_DURATION.observe(time.monotonic() - started, link=self.name)
+            self.messages_sent += len(batch)
+            self.bytes_sent += sum(len(write.data) for write in batch)
+            self._finish(batch, None)
+
+    def _collect(self, first):
+        """Coalesce whatever else is queued behind first into one write"""
+        batch = [first]
+        size = len(first.data)
+        while size < MAX_WRITE_BYTES:
+            try:
+                write = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if write is None:
+                break
+            batch.append(write)
+            size += len(write.data)
+        return [write for write in batch if not write.cancelled]
+
+    def _finish(self, batch, error):
+        for write in batch:
+            write.error = error
+            write.done.set()
+
+    def _try_connect(self):
+        """Connect unless still backing off; return whether the link is up"""
+        if time.monotonic() < self._retry_at:
+            return False
+
+        try:
+            sock = self._connect()
+        except Exception as e:
+            self.last_error = str(e)
+            self._retry_at = time.monotonic() + self._backoff
+            log.error(f"❌ {self.name} connect failed: {e} (retrying in {self._backoff:.1f}s)")
+            self._backoff = min(self._backoff * 2, MAX_BACKOFF)
+            self._set_state('disconnected')
+            return False
+
+        with self._sock_lock:
+            self._sock = sock
+        if self.connected_since is not None:
+            self.reconnects += 1
+        self.connected_since = time.time()
+        self._backoff = MIN_BACKOFF
+        log.info(f"✅ {self.name} link connected")
+        self._set_state('connected')
+        return True
+
+    def _disconnect(self, error, sock=None):
+        """Close the socket (only if it is still sock, when given) and record error"""
+        with self._sock_lock:
+            if sock is not None and sock is not self._sock:
+                return
+            sock, self._sock = self._sock, None
+        if sock is not None:
+            try:
+                sock.close()
+            except Exception:
+                pass
+        if error is not None:
+            self.last_error = str(error)
+            self._set_state('disconnected')
+
+    def _read_loop(self):
+        while not self._stop.is_set():
+            self._tick()
+            sock = self._sock
+            if sock is None or not getattr(sock, 'readable', False):
+                self._stop.wait(READ_INTERVAL)
+                continue
+
+            try:
+                responses = sock.read_responses(READ_INTERVAL)
+            except Exception as e:
+                if sock is self._sock:
+                    log.error(f"❌ {self.name} link read failed: {e}")
+                    self._disconnect(e, sock)
+                continue
+            for response in responses:
+                self._emit({'type': 'response', 'response': response})
+
+    def _tick(self):
+        if self.on_tick is None:
+            return
+        try:
+            self.on_tick()
+        except Exception as e:
+            log.warning(f"⚠️  {self.name} tick handler failed: {e}")
+
+    def _set_state(self, state):
+        changed = state != self.state
+        self.state = state
+        self._publish_health()
+        if changed:
+            self._emit({'type': 'link', 'state': state, 'error': self.last_error})
+
+    def _emit(self, event):
+        if self.on_event is None:
+            return
+        event['link'] = self.name
+        event['timestamp'] = time.time()
+        try:
+            self.on_event(event)
+        except Exception as e:
+            log.warning(f"⚠️  {self.name} event handler failed: {e}")
+
+    def _publish_health(self):
+        self._health_published = time.monotonic()
+        if self.health_path:
+            try:
+                write_health(self.health_path, self.health())
+            except OSError as e:
+                log.warning(f"⚠️  Could not write link health to {self.health_path}: {e}")
+
+
+def _sendall(sock, data):
+    # Bluetooth sockets have no sendall and may accept only part of a write
+    while data:
+        sent = sock.send(data)
+        data = data[sent:]
+
+
+def health_path_for(ring_path):
+    """Where the link health of senders consuming ring_path is published"""
+    return os.path.join(os.path.dirname(os.path.abspath(ring_path)), HEALTH_FILE)
+
+
+def write_health(path, health):
+    """Atomically replace the published health with health"""
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(health, f)
+    os.replace(temp_path, path)
+
+
+def record_health_metrics(health):
+    """Export a link's health, from this process or a sender's file, as metrics"""
+    link = health['name']
+    LINK_UP.set(1 if health['state'] == 'connected' else 0, link=link)
+    LINK_QUEUED.set(health['queued'], link=link)
+    LINK_MESSAGES.set(health['messages_sent'], link=link)
+    LINK_BYTES.set(health['bytes_sent'], link=link)
+    LINK_RECONNECTS.set(health['reconnects'], link=link)
+
+
+def read_health(path):
+    """Return the published link health, or None if no sender has published one"""
+    try:
+        with open(path) as f:
+            health = json.load(f)
+    except (OSError, ValueError):
+        return None
+    health['age'] = time.time() - health.get('updated', 0)
+    return health
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+What the ESP32 firmware answers to each command, and matching its replies
+The robot handles commands one at a time and answers in order, so a reply
+line belongs to the oldest command still waiting for that reply
+
+Commands go to the robot either as text lines or, with ``binary`` framing,
+as checksummed frames the firmware can delimit without a read timeout:
+
+    header   0xA0 | type (never the first byte of a text line)
+    length   payload length, TEXT frames only
+    payload  ANIMATION: the index as one byte; CONNECT, PING: nothing;
+             TEXT: the command, UTF-8
+    crc      CRC-8 (polynomial 0x07, initial value 0) over the bytes above
+
+A frame is never longer than the text line it replaces, except for TEXT
+frames. Replies from the robot are text lines either way.
+"""
+
+import collections
+import threading
+import time
+
+# Replies of esp32_eye_robot_bluetooth.ino's handle_bluetooth_command
+REPLIES = {'CONNECT': 'CONNECTED', 'PING': 'PONG'}
+UNKNOWN_REPLY = 'UNKNOWN'
+ACK_TIMEOUT = 30.0
+# Commands awaiting a reply; past this the oldest are given up as lost
+MAX_WAITING_REPLIES = 256
+FRAMINGS = ('text', 'binary')
+# Highest first; see priority_of
+PRIORITIES = ('control', 'normal', 'bulk')
+CONTROL_COMMANDS = ('CONNECT', 'PING')
+
+FRAME_HEADER = 0xA0
+FRAME_TEXT = 0x0
+FRAME_ANIMATION = 0x1
+FRAME_CONNECT = 0x2
+FRAME_PING = 0x3
+MAX_FRAME_TEXT = 255
+_FIXED_FRAMES = {'CONNECT': FRAME_CONNECT, 'PING': FRAME_PING}
+
+
+def expected_reply(command):
+    """The line the robot answers command with, or None for animations"""
+    command = command.strip()
+    if command.startswith('A'):
+        return None
+    return REPLIES.get(command, UNKNOWN_REPLY)
+
+
+def coalesce_key(command):
+    """Commands with the same key only matter as their latest value
+
+    Animations just set what the eyes show, so a pending one can be replaced
+    by a newer one; anything else gets None and must always be sent.
+    """
+    if command.strip().startswith('A'):
+        return 'animation'
+    return None
+
+
+def priority_of(command):
+    """How urgently a command should reach the robot, one of PRIORITIES
+
+    Link control (CONNECT, PING) must not wait behind a backlog, animations
+    are bulk traffic that can always wait, and anything else is normal.
+    """
+    command = command.strip()
+    if command in CONTROL_COMMANDS:
+        return 'control'
+    if command.startswith('A'):
+        return 'bulk'
+    return 'normal'
+
+
+def _crc8_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07 if crc & 0x80 else crc << 1) & 0xFF
+        table.append(crc)
+    return bytes(table)
+
+
+_CRC8_TABLE = _crc8_table()
+
+
+def crc8(data):
+    crc = 0
+    for byte in data:
+        crc = _CRC8_TABLE[crc ^ byte]
+    return crc
+
+
+def encode_frame(command):
+    """Encode one command as a binary frame"""
+    command = command.strip()
+    if command in _FIXED_FRAMES:
+        frame = bytes([FRAME_HEADER | _FIXED_FRAMES[command]])
+    elif command.startswith('A') and command[1:].isascii() and command[1:].isdigit() \
+            and int(command[1:]) <= 0xFF:
+        frame = bytes([FRAME_HEADER | FRAME_ANIMATION, int(command[1:])])
+    else:
+        payload = command.encode()
+        if len(payload) > MAX_FRAME_TEXT:
+            raise ValueError(f'Command is longer than {MAX_FRAME_TEXT} bytes')
+        frame = bytes([FRAME_HEADER | FRAME_TEXT, len(payload)]) + payload
+    return frame + bytes([crc8(frame)])
+
+
+def encode_commands(message, framing='text'):
+    """Encode newline-separated commands for the wire in the given framing"""
+    if framing == 'text':
+        return (message + '\n').encode()
+    if framing == 'binary':
+        return b''.join(encode_frame(command) for command in message.split('\n') if command.strip())
+    raise ValueError(f'Unknown framing: {framing}')
+
+
+def encoding_error(command, framing='text'):
+    """Why command cannot be sent in framing, or None if it can"""
+    try:
+        encode_commands(command, framing)
+    except ValueError as e:
+        return str(e)
+    return None
+
+
+class CommandDecoder:
+    """Splits a received byte stream into commands, as the firmware does
+
+    Accepts text lines and binary frames interleaved, telling them apart by
+    the header byte. A frame with a bad checksum or type is dropped and
+    counted in ``frame_errors``, and decoding resumes at the next frame
+    header or line.
+    """
+
+    def __init__(self):
+        self.frame_errors = 0
+        self._buffer = b''
+        self._skipping = False
+
+    def feed(self, data):
+        """Add received bytes and return the commands now complete"""
+        buffer = self._buffer + data
+        commands = []
+        while buffer:
+            if self._skipping:
+                buffer = self._skip_garbage(buffer)
+                continue
+            if buffer[0] & 0xF0 != FRAME_HEADER:
+                line, newline, rest = buffer.partition(b'\n')
+                if not newline:
+                    break
+                line = line.decode('utf-8', errors='replace').strip()
+                if line:
+                    commands.append(line)
+                buffer = rest
+                continue
+
+            frame_type = buffer[0] & 0x0F
+            if frame_type == FRAME_TEXT:
+                if len(buffer) < 2:
+                    break
+                size = 2 + buffer[1]
+            elif frame_type == FRAME_ANIMATION:
+                size = 2
+            elif frame_type in (FRAME_CONNECT, FRAME_PING):
+                size = 1
+            else:
+                self._bad_frame()
+                buffer = buffer[1:]
+                continue
+            if len(buffer) < size + 1:
+                break
+
+            frame = buffer[:size]
+            if crc8(frame) != buffer[size]:
+                self._bad_frame()
+                buffer = buffer[size + 1:]
+                continue
+            buffer = buffer[size + 1:]
+            commands.append(_decode_frame(frame_type, frame))
+
+        self._buffer = buffer
+        return commands
+
+    def _bad_frame(self):
+        self.frame_errors += 1
+        self._skipping = True
+
+    def _skip_garbage(self, buffer):
+        # After a bad frame, drop everything up to the next header or line end
+        for index, byte in enumerate(buffer):
+            if byte & 0xF0 == FRAME_HEADER:
+                self._skipping = False
+                return buffer[index:]
+            if byte == ord('\n'):
+                self._skipping = False
+                return buffer[index + 1:]
+        return b''
+
+
+def _decode_frame(frame_type, frame):
+    if frame_type == FRAME_TEXT:
+        return frame[2:].decode('utf-8', errors='replace').strip()
+    if frame_type == FRAME_ANIMATION:
+        return f'A{frame[1]}'
+    return 'CONNECT' if frame_type == FRAME_CONNECT else 'PING'
+
+
+class ReplyMatcher:
+    """Pairs the robot's reply lines with the queued commands that caused them
+
+    Call ``expect`` with the (sequence, command) records about to be written
+    (before the write, since the reply can beat ``send`` returning), then
+    ``delivered`` once the write succeeded or ``forget`` if it failed.
+    ``reply`` takes each line the robot sends. ``on_ack`` is called with an
+    ``ack`` event per command: 'acknowledged' with the reply, 'delivered'
+    for animations (which the firmware never answers), or 'lost' when the
+    link dropped or no reply came within ``timeout`` seconds. Timeouts are
+    checked on every call and by ``expire``, which the owner calls
+    periodically so a robot that went silent still has its commands
+    reported lost; at most ``limit`` commands wait for a reply.
+    """
+
+    def __init__(self, on_ack, timeout=ACK_TIMEOUT, limit=MAX_WAITING_REPLIES):
+        self.on_ack = on_ack
+        self.timeout = timeout
+        self.limit = limit
+        self._waiting = collections.deque()
+        self._lock = threading.Lock()
+
+    def expect(self, records):
+        now = time.time()
+        with self._lock:
+            for sequence, command in records:
+                reply = expected_reply(command)
+                if reply is not None:
+                    self._waiting.append((sequence, command, reply, now))
+            expired = self._expire(now)
+        self._lose(expired, now)
+
+    def forget(self, records):
+        sequences = {sequence for sequence, _ in records}
+        with self._lock:
+            self._waiting = collections.deque(entry for entry in self._waiting
+                                              if entry[0] not in sequences)
+
+    def delivered(self, records):
+        self.expire()
+        now = time.time()
+        for sequence, command in records:
+            if expected_reply(command) is None:
+                self._ack(sequence, command, 'delivered', None, now, now)
+
+    def reply(self, line):
+        """Match a reply line, returning True if it answered a queued command
+
+        The robot answers in order, so commands waiting ahead of the one
+        answered will never get their reply and are reported lost.
+        """
+        now = time.time()
+        with self._lock:
+            expired = self._expire(now)
+            match = None
+            for index, entry in enumerate(self._waiting):
+                if entry[2] == line:
+                    for _ in range(index):
+                        expired.append(self._waiting.popleft())
+                    match = self._waiting.popleft()
+                    break
+
+        self._lose(expired, now)
+        if match is None:
+            return False
+        sequence, command, _, sent_at = match
+        self._ack(sequence, command, 'acknowledged', line, sent_at, now)
+        return True
+
+    def expire(self):
+        """Report the commands whose reply is overdue as lost"""
+        now = time.time()
+        with self._lock:
+            expired = self._expire(now)
+        self._lose(expired, now)
+
+    def reset(self):
+        """The link dropped: nothing still waiting will be answered"""
+        now = time.time()
+        with self._lock:
+            lost, self._waiting = list(self._waiting), collections.deque()
+        self._lose(lost, now)
+
+    def _expire(self, now):
+        expired = []
+        while self._waiting and (len(self._waiting) > self.limit
+                                 or now - self._waiting[0][3] > self.timeout):
+            expired.append(self._waiting.popleft())
+        return expired
+
+    def _lose(self, entries, now):
+        for sequence, command, _, sent_at in entries:
+            self._ack(sequence, command, 'lost', None, sent_at, now)
+
+    def _ack(self, sequence, command, status, response, sent_at, acked_at):
+        self.on_ack(ack_event(sequence, command, status, response, sent_at, acked_at))
+
+
+def ack_event(sequence, command, status, response=None, sent_at=None, acked_at=None):
+    """Build the event acknowledging the queued command with that sequence number"""
+    acked_at = acked_at or time.time()
+    return {
+        'type': 'ack',
+        'sequence': sequence,
+        'command': command,
+        'status': status,
+        'response': response,
+        'sent_at': sent_at or acked_at,
+        'timestamp': acked_at
+    }
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Simulated ESP32 Eye Robot for testing the bridge without hardware
+Speaks the esp32_eye_robot_bluetooth.ino serial protocol over TCP or a pty,
+so a sender can be pointed at it with ESP32_TRANSPORT=tcp://127.0.0.1:9750
+"""
+
+import argparse
+import collections
+import os
+import select
+import socket
+import threading
+import time
+
+import esp32_protocol
+
+try:
+    import tty
+except ImportError:  # No ptys on Windows; --tcp still works
+    tty = None
+
+DEFAULT_PORT = 9750
+MAX_ANIMATION_INDEX = 8
+# Every command is shown on the OLED for a second before it runs
+FIRMWARE_COMMAND_DELAY = 1.0
+
+
+class SimulatedESP32:
+    """The robot's command handling, minus the display
+
+    ``handle_command`` mirrors handle_bluetooth_command in the firmware:
+    ``A<n>`` plays an animation (no reply), ``CONNECT`` answers
+    ``CONNECTED``, ``PING`` answers ``PONG`` and anything else ``UNKNOWN``.
+    Commands may arrive as text lines or binary frames (see esp32_protocol).
+    ``command_delay`` stands in for the time the firmware spends on each
+    command; it defaults to none so load tests measure the bridge.
+    """
+
+    def __init__(self, command_delay=0.0):
+        self.command_delay = command_delay
+        self.commands = collections.Counter()
+        self.animations = collections.Counter()
+        self.clients = 0
+        self.dropped_replies = 0
+        self.frame_errors = 0
+        self._lock = threading.Lock()
+
+    def handle_command(self, command):
+        """Process one received line and return the reply, or None"""
+        command = command.strip()
+        if self.command_delay:
+            time.sleep(self.command_delay)
+
+        with self._lock:
+            if command.startswith('A'):
+                self.commands['animation'] += 1
+                index = _to_int(command[1:])
+                if 0 <= index <= MAX_ANIMATION_INDEX:
+                    self.animations[index] += 1
+                return None
+            self.commands[command if command in ('CONNECT', 'PING') else 'unknown'] += 1
+
+        if command == 'CONNECT':
+            return 'CONNECTED'
+        if command == 'PING':
+            return 'PONG'
+        return 'UNKNOWN'
+
+    def serve_stream(self, read, write):
+        """Serve one connected client until read returns b''"""
+        with self._lock:
+            self.clients += 1
+        # The firmware greets every new Bluetooth client
+        write(b'CONNECTED\r\n')
+
+        decoder = esp32_protocol.CommandDecoder()
+        try:
+            while True:
+                data = read(4096)
+                if not data:
+                    return
+                for command in decoder.feed(data):
+                    reply = self.handle_command(command)
+                    if reply is not None:
+                        write(reply.encode() + b'\r\n')
+        finally:
+            with self._lock:
+                self.frame_errors += decoder.frame_errors
+
+    def stats(self):
+        with self._lock:
+            return {
+                'clients': self.clients,
+                'commands': dict(self.commands),
+                'animations': dict(self.animations),
+                'dropped_replies': self.dropped_replies,
+                'frame_errors': self.frame_errors
+            }
+
+
+def _to_int(text):
+    # Arduino's String.toInt(): leading digits, 0 if there are none
+    digits = ''
+    for char in text.strip():
+        if not char.isdigit() and not (char == '-' and not digits):
+            break
+        digits += char
+    try:
+        return int(digits)
+    except ValueError:
+        return 0
+
+
+def serve_tcp(robot, port, host='127.0.0.1'):
+    """Accept one client at a time, like the robot's single SPP connection"""
+    server = socket.create_server((host, port))
+    print(f"🤖 Simulated ESP32 listening on tcp://{host}:{port}")
+    try:
+        while True:
+            client, address = server.accept()
+            # Replies go out a line at a time; Nagle would hold each for the bridge's ACK
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            print(f"🔗 Client connected: {address[0]}:{address[1]}")
+            with client:
+                try:
+                    robot.serve_stream(client.recv, client.sendall)
+                except ConnectionError:
+                    pass
+            print(f"🔌 Client disconnected, stats: {robot.stats()}")
+    finally:
+        server.close()
+
+
+def serve_pty(robot):
+    """Serve on a new pseudo-terminal until interrupted"""
+    if tty is None:
+        raise OSError('ptys are not supported on this platform')
+
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    print(f"🤖 Simulated ESP32 on serial device {os.ttyname(slave)}")
+
+    # Writes must not block: a client that never reads the replies would
+    # otherwise stall the robot, so drop them instead, like a UART overrun
+    os.set_blocking(master, False)
+
+    def read(size):
+        while True:
+            select.select([master], [], [])
+            try:
+                return os.read(master, size)
+            except BlockingIOError:
+                continue
+            except OSError:  # EIO once no process has the slave open
+                return b''
+
+    def write(data):
+        try:
+            os.write(master, data)
+        except BlockingIOError:
+            robot.dropped_replies += 1
+
+    try:
+        robot.serve_stream(read, write)
+    finally:
+        os.close(master)
+        os.close(slave)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--tcp', type=int, nargs='?', const=DEFAULT_PORT, metavar='PORT',
+                        help=f'listen on a TCP port (default: {DEFAULT_PORT})')
+    parser.add_argument('--pty', action='store_true',
+                        help='serve on a new pseudo-terminal instead of TCP')
+    parser.add_argument('--command-delay', type=float, default=0.0,
+                        help='seconds spent on each command (the firmware takes '
+                             f'{FIRMWARE_COMMAND_DELAY}; default: %(default)s)')
+    args = parser.parse_args()
+
+    robot = SimulatedESP32(args.command_delay)
+    try:
+        if args.pty:
+            serve_pty(robot)
+        else:
+            serve_tcp(robot, args.tcp or DEFAULT_PORT)
+    except KeyboardInterrupt:
+        print(f"\n⏹️  Simulated ESP32 stopped, stats: {robot.stats()}")
+
+
+if __name__ == '__main__':
+    main()
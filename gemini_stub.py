@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Gemini generateContent API, for testing the answer
+cache without an API key: point a bridge at it with
+GEMINI_BASE_URL=http://127.0.0.1:9760/v1beta
+"""
+
+import argparse
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_PORT = 9760
+
+
+class StubModelHandler(BaseHTTPRequestHandler):
+    """Answers every prompt with a numbered echo, after the server's delay"""
+
+    counter = itertools.count(1)
+    lock = threading.Lock()
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        prompt = body['contents'][0]['parts'][0]['text']
+        with self.lock:
+            number = next(self.counter)
+        time.sleep(self.server.delay)
+
+        reply = json.dumps({'candidates': [{'content': {'parts': [
+            {'text': f'Answer {number}: {prompt}'}]}}]}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def log_message(self, format, *args):
+        print(f"🤖 {self.path.split('?', 1)[0]} {format % args}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+                        help='port to listen on (default: %(default)s)')
+    parser.add_argument('--delay', type=float, default=1.0,
+                        help='seconds each answer takes, like a model round trip '
+                             '(default: %(default)s)')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), StubModelHandler)
+    server.delay = args.delay
+    print(f"🤖 Stub model on http://127.0.0.1:{args.port}/v1beta")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n⏹️  Stub model stopped")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Per-command latency traces, from the HTTP request to the robot's reply
+Every command a bridge accepts gets a trace whose spans say where its time
+went, kept in a ring buffer for GET /debug/traces:
+
+    parse    request received -> handed to the scheduler (reading, JSON)
+    queue    waiting in the scheduler for its priority and the rate limit
+    deliver  the bridge's delivery: appending to the command ring, or the
+             link write (and any transport subprocess) for in-process links
+    handoff  ring -> sender: the sender noticing and picking the command up
+    robot    written -> acknowledged by the robot (or found lost)
+
+A trace is finished by the command's ``ack`` event, matched by its queue
+sequence number, or right after delivery for commands that get no ack.
+Traces slower than the slow threshold are also kept apart, so they are not
+pushed out of the buffer by the fast ones.
+
+Configured from the environment:
+    ESP32_TRACE_SAMPLE   fraction of requests traced (default 1)
+    ESP32_SLOW_TRACE_MS  what counts as slow (default 250)
+"""
+
+import collections
+import os
+import random
+import threading
+import time
+
+import bridge_log
+import metrics
+
+log = bridge_log.get_logger(__name__)
+
+RECENT_TRACES = 256
+SLOW_TRACES = 64
+PENDING_TRACES = 4096
+SLOW_THRESHOLD = 0.25
+# Commands still unacknowledged after this long are finished without an ack
+ACK_WAIT = 30.0
+# How often attached tracers look for such commands
+EXPIRE_INTERVAL = 1.0
+
+SPAN_DURATION = metrics.registry.histogram(
+    'bridge_trace_span_duration_seconds', 'Time commands spent in each stage', ('span',))
+SLOW_COMMANDS = metrics.registry.counter(
+    'bridge_slow_commands_total', 'Commands slower end to end than the slow threshold')
+
+
+def new_trace_id():
+    return os.urandom(8).hex()
+
+
+class Trace:
+    """The spans of one command on its way to the robot"""
+
+    __slots__ = ('trace_id', 'command', 'device', 'started', 'spans', 'sequence', 'status',
+                 'delivered_at')
+
+    def __init__(self, trace_id, command, started=None):
+        self.trace_id = trace_id
+        self.command = command
+        self.device = None
+        self.started = started or time.time()
+        self.spans = []
+        self.sequence = None
+        self.status = None
+        self.delivered_at = None
+
+    def span(self, name, start, end):
+        self.spans.append((name, start, max(start, end)))
+
+    def fork(self, device):
+        """A copy for one device of a broadcast"""
+        trace = Trace(f'{self.trace_id}-{device}', self.command, self.started)
+        trace.device = device
+        trace.spans = list(self.spans)
+        return trace
+
+    def ended(self):
+        return max((end for _, _, end in self.spans), default=self.started)
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'command': self.command,
+            'device': self.device,
+            'sequence': self.sequence,
+            'status': self.status,
+            'started': self.started,
+            'total_ms': round((self.ended() - self.started) * 1000, 3),
+            'spans': [{'name': name,
+                       'start_ms': round((start - self.started) * 1000, 3),
+                       'duration_ms': round((end - start) * 1000, 3)}
+                      for name, start, end in self.spans]
+        }
+
+
+class Tracer:
+    """Collects finished traces; see the module docstring"""
+
+    def __init__(self, sample_rate=1.0, slow_threshold=SLOW_THRESHOLD):
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.recent = collections.deque(maxlen=RECENT_TRACES)
+        self.slow = collections.deque(maxlen=SLOW_TRACES)
+        self._pending = collections.OrderedDict()
+        # Acks can beat the scheduler registering the command they answer
+        self._early_acks = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_environment(cls):
+        return cls(float(os.environ.get('ESP32_TRACE_SAMPLE') or 1.0),
+                   float(os.environ.get('ESP32_SLOW_TRACE_MS') or SLOW_THRESHOLD * 1000) / 1000)
+
+    def attach(self, hub):
+        """Finish traces from the ack events published on hub, or once they are overdue"""
+        hub.subscribe(self._on_event)
+        threading.Thread(target=self._expire_loop, name='trace-expiry', daemon=True).start()
+
+    def start(self, commands, trace_id=None, started=None):
+        """Traces for a request's commands, or None when it is not sampled"""
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return None
+        trace_id = trace_id or new_trace_id()
+        started = started or time.time()
+        now = time.time()
+        traces = []
+        for index, command in enumerate(commands):
+            trace = Trace(trace_id if len(commands) == 1 else f'{trace_id}.{index}', command,
+                          started)
+            trace.span('parse', started, now)
+            traces.append(trace)
+        return traces
+
+    def delivered(self, trace, result):
+        """Delivery of trace's command returned result; wait for its ack if it has one"""
+        trace.delivered_at = trace.ended()
+        sequence = result.get('sequence')
+        if result.get('status') != 'success' or sequence is None:
+            self.finish(trace, result.get('status', 'error'))
+            return
+
+        trace.sequence = sequence
+        with self._lock:
+            ack = self._early_acks.pop(sequence, None)
+            if ack is None:
+                self._pending[sequence] = trace
+                expired = self._expire()
+        if ack is not None:
+            self._complete(trace, ack)
+            return
+        self._finish_unacked(expired)
+
+    def expire(self):
+        """Finish the traces whose ack is overdue"""
+        with self._lock:
+            expired = self._expire()
+        self._finish_unacked(expired)
+
+    def finish(self, trace, status):
+        trace.status = status
+        total = trace.ended() - trace.started
+        for name, start, end in trace.spans:
+            SPAN_DURATION.observe(end - start, span=name)
+        self.recent.append(trace)
+        if total >= self.slow_threshold:
+            self.slow.append(trace)
+            SLOW_COMMANDS.inc()
+            log.info("🐢 Slow command %s: %.1f ms (%s)", trace.command, total * 1000,
+                     ', '.join(f'{name} {(end - start) * 1000:.1f}' for name, start, end in trace.spans),
+                     extra=bridge_log.fields(sampled=True, **trace.to_dict()))
+
+    def snapshot(self):
+        """The /debug/traces payload, newest first"""
+        return {
+            'slow_threshold_ms': round(self.slow_threshold * 1000, 3),
+            'sample_rate': self.sample_rate,
+            'pending': len(self._pending),
+            'recent': [trace.to_dict() for trace in reversed(list(self.recent))],
+            'slow': [trace.to_dict() for trace in reversed(list(self.slow))]
+        }
+
+    def _on_event(self, event):
+        if event is None or event.get('type') != 'ack':
+            return
+        with self._lock:
+            trace = self._pending.pop(event['sequence'], None)
+            if trace is None:
+                self._early_acks[event['sequence']] = event
+                while len(self._early_acks) > PENDING_TRACES:
+                    self._early_acks.popitem(last=False)
+                return
+        self._complete(trace, event)
+
+    def _complete(self, trace, ack):
+        # sent_at is when the command was written; an in-process link writes
+        # inside the deliver span, so there robot overlaps deliver
+        if ack['sent_at'] > trace.delivered_at:
+            trace.span('handoff', trace.delivered_at, ack['sent_at'])
+        trace.span('robot', ack['sent_at'], ack['timestamp'])
+        self.finish(trace, ack['status'])
+
+    def _expire_loop(self):
+        while True:
+            time.sleep(EXPIRE_INTERVAL)
+            self.expire()
+
+    def _finish_unacked(self, traces):
+        for trace in traces:
+            self.finish(trace, 'no_ack')
+
+    def _expire(self):
+        """Unacked traces past ACK_WAIT or over the limit (caller holds the lock)"""
+        expired = []
+        deadline = time.time() - ACK_WAIT
+        while self._pending:
+            sequence, trace = next(iter(self._pending.items()))
+            if len(self._pending) <= PENDING_TRACES and trace.delivered_at > deadline:
+                break
+            expired.append(self._pending.pop(sequence))
+        return expired
+
+
+tracer = Tracer.from_environment()
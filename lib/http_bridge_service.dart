@@ -11,6 +11,13 @@ class HttpBridgeService {
 
   // Bridge server configuration
   static const String _bridgeUrl = 'http://localhost:8080';
+
+  // Shared client so status polls and commands reuse one keep-alive connection
+  final http.Client _client = http.Client();
+
+  // Separate client for the /events stream, which holds its connection open
+  http.Client? _eventsClient;
+  StreamSubscription<String>? _eventsSubscription;
   
   // Connection status
   bool _isConnected = false;
@@ -35,7 +42,7 @@ class HttpBridgeService {
   /// Test connection to bridge server
   Future<void> _testBridgeConnection() async {
     try {
-      final response = await http.get(
+      final response = await _client.get(
         Uri.parse('$_bridgeUrl/get_status'),
         headers: {'Content-Type': 'application/json'},
       ).timeout(Duration(seconds: 5));
@@ -43,6 +50,7 @@ class HttpBridgeService {
       if (response.statusCode == 200) {
         _isConnected = true;
         _connectionStatusController.add('Connected to ESP32 via HTTP Bridge');
+        _listenForEvents();
       } else {
         _isConnected = false;
         _connectionStatusController.add('Bridge server not responding');
@@ -53,6 +61,59 @@ class HttpBridgeService {
     }
   }
 
+  /// Subscribe to the bridge's server-sent events for link state and ESP32 replies
+  Future<void> _listenForEvents() async {
+    await _stopListening();
+    final client = http.Client();
+    _eventsClient = client;
+
+    try {
+      final request = http.Request('GET', Uri.parse('$_bridgeUrl/events'));
+      request.headers['Accept'] = 'text/event-stream';
+      final response = await client.send(request);
+      if (response.statusCode != 200) {
+        client.close();
+        return;
+      }
+
+      String eventType = 'message';
+      _eventsSubscription = response.stream
+          .transform(utf8.decoder)
+          .transform(const LineSplitter())
+          .listen((line) {
+        if (line.startsWith('event:')) {
+          eventType = line.substring(6).trim();
+        } else if (line.startsWith('data:')) {
+          _handleEvent(eventType, json.decode(line.substring(5).trim()));
+          eventType = 'message';
+        }
+      }, onError: (e) {
+        _connectionStatusController.add('Bridge event stream failed: $e');
+      }, onDone: () {
+        if (_eventsClient == client) {
+          _connectionStatusController.add('Bridge event stream closed');
+        }
+      });
+    } catch (e) {
+      _connectionStatusController.add('Cannot subscribe to bridge events: $e');
+    }
+  }
+
+  void _handleEvent(String type, dynamic event) {
+    if (type == 'response') {
+      _messageController.add('ESP32 Response: ${event['response']}');
+    } else if (type == 'link') {
+      _connectionStatusController.add('ESP32 link ${event['state']}');
+    }
+  }
+
+  Future<void> _stopListening() async {
+    await _eventsSubscription?.cancel();
+    _eventsSubscription = null;
+    _eventsClient?.close();
+    _eventsClient = null;
+  }
+
   /// Send a command to ESP32 via bridge
   Future<bool> sendCommand(String command) async {
     if (!_isConnected) {
@@ -61,7 +122,7 @@ class HttpBridgeService {
     }
 
     try {
-      final response = await http.post(
+      final response = await _client.post(
         Uri.parse('$_bridgeUrl/send_command'),
         headers: {'Content-Type': 'application/json'},
         body: json.encode({'command': command}),
@@ -94,12 +155,15 @@ class HttpBridgeService {
 
   /// Disconnect from bridge
   Future<void> disconnect() async {
+    await _stopListening();
     _isConnected = false;
     _connectionStatusController.add('Disconnected from HTTP Bridge');
   }
 
   /// Clean up resources
   void dispose() {
+    _stopListening();
+    _client.close();
     _connectionStatusController.close();
     _messageController.close();
   }
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Long-lived shell that runs the Android forwarding commands
+Spawning am/input/service through subprocess.run forks the whole Python
+process for every message; feeding them to one supervised sh over a pipe
+leaves only the tool's own start-up per command
+"""
+
+import os
+import queue
+import shlex
+import signal
+import subprocess
+import threading
+import uuid
+
+import bridge_log
+
+log = bridge_log.get_logger(__name__)
+
+SHELL = 'sh'
+
+
+class ShellWorker:
+    """A persistent ``sh`` that runs one command line at a time
+
+    Each command is written to the shell's stdin followed by an ``echo`` of
+    a per-worker marker and the exit status, and ``run`` collects the
+    output up to that marker. If the shell dies or a command outlives its
+    timeout the shell is killed and a new one is started on the next run.
+    """
+
+    def __init__(self, shell=SHELL):
+        self.shell = shell
+        self.restarts = 0
+        self.commands_run = 0
+        self._marker = f'__esp32_done_{uuid.uuid4().hex}__'
+        self._process = None
+        self._lines = None
+        self._lock = threading.Lock()
+
+    def run(self, argv, timeout):
+        """Run argv in the shell and return its CompletedProcess
+
+        Raises CalledProcessError on a non-zero exit status and
+        TimeoutExpired if it has not finished within timeout seconds.
+        """
+        command = shlex.join(argv)
+        with self._lock:
+            lines = self._ensure_started()
+            try:
+                self._process.stdin.write(f'{command} </dev/null 2>&1; echo "{self._marker} $?"\n')
+                self._process.stdin.flush()
+            except OSError:
+                self._kill()
+                raise
+
+            output = []
+            while True:
+                try:
+                    line = lines.get(timeout=timeout)
+                except queue.Empty:
+                    # The command is still running; a fresh shell is the only clean way out
+                    self._kill()
+                    raise subprocess.TimeoutExpired(argv, timeout, ''.join(output))
+                if line is None:
+                    self._kill()
+                    raise OSError(f'{self.shell} exited while running {argv[0]}')
+                # Output without a trailing newline runs straight into the marker
+                output_part, marker, status = line.partition(self._marker)
+                output.append(output_part)
+                if marker:
+                    returncode = int(status)
+                    break
+
+            self.commands_run += 1
+
+        stdout = ''.join(output)
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, argv, stdout)
+        return subprocess.CompletedProcess(argv, returncode, stdout)
+
+    def close(self):
+        with self._lock:
+            self._kill()
+
+    def _ensure_started(self):
+        if self._process is not None and self._process.poll() is None:
+            return self._lines
+        if self._lines is not None:
+            self.restarts += 1
+            log.warning(f"🔄 Restarting helper shell (restart #{self.restarts})")
+        self._kill()
+
+        self._process = subprocess.Popen([self.shell], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                         stderr=subprocess.STDOUT, text=True, bufsize=1,
+                                         start_new_session=True)
+        self._lines = queue.Queue()
+        threading.Thread(target=_pump, args=(self._process.stdout, self._lines),
+                         name='shell-worker-reader', daemon=True).start()
+        return self._lines
+
+    def _kill(self):
+        process, self._process = self._process, None
+        if process is None:
+            return
+        try:
+            # Take down a hung command along with the shell that started it
+            os.killpg(process.pid, signal.SIGKILL)
+            process.wait()
+            process.stdin.close()
+        except OSError:
+            pass
+
+
+def _pump(stream, lines):
+    # Hand the shell's output to run() line by line; None marks end of output
+    for line in stream:
+        lines.put(line)
+    stream.close()
+    lines.put(None)
+
+
+_shared_worker = None
+_shared_worker_lock = threading.Lock()
+
+
+def run(argv, timeout):
+    """Run argv on the process-wide shared worker, like subprocess.run(check=True)"""
+    global _shared_worker
+    with _shared_worker_lock:
+        if _shared_worker is None:
+            _shared_worker = ShellWorker()
+    return _shared_worker.run(argv, timeout)
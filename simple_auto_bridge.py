@@ -1,103 +1,98 @@
 #!/usr/bin/env python3
 """
-Simple automatic bridge that writes messages to a file
-Serial Terminal can read this file and send to ESP32
+Simple automatic bridge that queues messages in the shared command ring
+The sender scripts read the queue and forward each message to ESP32
 """
 
-from http.server import HTTPServer, BaseHTTPRequestHandler
-import json
-import time
-import os
+import bridge_core
+import bridge_log
+import command_ring
+import esp32_link
+import metrics
+from bridge_core import BaseBridgeHandler
 
-class AutoBridgeHandler(BaseHTTPRequestHandler):
-    def do_GET(self):
-        if self.path == '/get_status':
-            response = {
-                'status': 'connected',
-                'message': 'ESP32 Auto Bridge Ready',
-                'timestamp': time.time()
-            }
-            
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.end_headers()
-            self.wfile.write(json.dumps(response).encode())
-        else:
-            self.send_response(404)
-            self.end_headers()
+log = bridge_log.get_logger('auto_bridge')
+
+RING_PENDING = metrics.registry.gauge(
+    'esp32_ring_pending_commands', 'Queued commands a sender has not forwarded yet', ('consumer',))
+
+class AutoBridgeHandler(BaseBridgeHandler):
+    status_message = 'ESP32 Auto Bridge Ready'
+
+    def get_status(self):
+        status = super().get_status()
+        
+        # Report the direct sender's Bluetooth link, if one is running
+        try:
+            ring = command_ring.open_default_ring()
+            status['link'] = esp32_link.read_health(esp32_link.health_path_for(ring.path))
+        except OSError:
+            status['link'] = None
+        return status
     
-    def do_POST(self):
-        if self.path == '/send_command':
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            data = json.loads(post_data.decode('utf-8'))
-            
-            command = data.get('command', '')
-            print(f"🚀 Received: {command}")
-            
-            # Write message to file for Serial Terminal to read
-            success = self.write_message_to_file(command)
-            
-            response = {
-                'status': 'success' if success else 'error',
-                'message': f'Message {"saved" if success else "failed to save"}',
-                'timestamp': time.time()
-            }
-            
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.end_headers()
-            self.wfile.write(json.dumps(response).encode())
-        else:
-            self.send_response(404)
-            self.end_headers()
+    def collect_metrics(self):
+        super().collect_metrics()
+        
+        # The queue and link live in the sender processes; read what they share
+        ring = command_ring.open_default_ring()
+        RING_PENDING.clear()
+        for consumer, pending in ring.consumer_lag().items():
+            RING_PENDING.set(pending, consumer=consumer)
+        health = esp32_link.read_health(esp32_link.health_path_for(ring.path))
+        if health:
+            esp32_link.record_health_metrics(health)
     
-    def do_OPTIONS(self):
-        self.send_response(200)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'POST, GET, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        self.end_headers()
+    def handle_command(self, command):
+        log.info("🚀 Received: %s", command, extra=bridge_log.fields(sampled=True, command=command))
+        
+        # Queue message for the sender scripts to pick up
+        return self.queue_commands([command])[0]
     
-    def write_message_to_file(self, message):
-        """Write message to a file that can be read by Serial Terminal"""
+    def handle_commands(self, commands):
+        log.info("🚀 Received batch of %d commands", len(commands),
+                 extra=bridge_log.fields(sampled=True, commands=len(commands)))
+        
+        # The whole batch is appended to the queue in one go
+        return self.queue_commands(commands)
+    
+    def queue_commands(self, commands):
+        """Append commands to the shared command queue, one result per command"""
         try:
-            # Try multiple possible paths
-            paths = [
-                '/sdcard/Download/esp32_message.txt',
-                '/sdcard/esp32_message.txt',
-                './esp32_message.txt',
-                'esp32_message.txt'
-            ]
-            
-            for path in paths:
-                try:
-                    with open(path, 'w') as f:
-                        f.write(message)
-                    print(f"✅ Message written to: {path}")
-                    return True
-                except:
-                    continue
-            
-            print("❌ Could not write to any file path")
-            return False
+            ring = command_ring.open_default_ring()
+            sequences = ring.append_many(commands)
+            log.info("✅ Queued %d message(s) in: %s", len(commands), ring.path,
+                     extra=bridge_log.fields(sampled=True, first_sequence=sequences[0], count=len(commands)))
+            return [{
+                'command': command,
+                'status': 'success',
+                'message': 'Message saved',
+                'sequence': sequence
+            } for command, sequence in zip(commands, sequences)]
             
-        except Exception as e:
-            print(f"❌ Error writing message: {e}")
-            return False
+        except (OSError, ValueError, command_ring.RingFull) as e:
+            log.error("❌ Error queueing message: %s", e, extra=bridge_log.fields(error=str(e)))
+            return [{
+                'command': command,
+                'status': 'error',
+                'message': f'Message failed to save: {e}'
+            } for command in commands]
 
-def run_server(port=8080):
-    server_address = ('', port)
-    httpd = HTTPServer(server_address, AutoBridgeHandler)
-    print("🚀 ESP32 Auto Bridge Server Starting...")
-    print(f"📱 Server running on: http://localhost:{port}")
-    print("🔗 Connect your Flutter app now!")
-    print("📁 Messages will be saved to: esp32_message.txt")
-    print("📤 Serial Terminal can read this file and send to ESP32")
-    print("⏹️  Press Ctrl+C to stop")
-    httpd.serve_forever()
+def run_server(port=8080, engine=bridge_core.DEFAULT_ENGINE, **options):
+    httpd = bridge_core.make_server(AutoBridgeHandler, port, engine, **options)
+    # Link state and robot replies from the sender scripts feed /events
+    try:
+        command_ring.follow_events('auto_bridge', bridge_core.events.publish)
+    except OSError as e:
+        log.warning(f"⚠️  Not following sender events: {e}")
+    log.info("🚀 ESP32 Auto Bridge Server Starting...")
+    log.info(f"📱 Server running on: http://localhost:{port}")
+    log.info(f"⚙️  Engine: {engine}")
+    log.info("🔗 Connect your Flutter app now!")
+    log.info("📁 Messages will be queued in: esp32_commands.ring")
+    log.info("📤 Run one of the *_sender.py scripts to forward them to ESP32")
+    log.info(f"📡 Live link state and ESP32 replies: http://localhost:{port}/events")
+    log.info("⏹️  Press Ctrl+C to stop")
+    bridge_core.serve(httpd)
 
 if __name__ == '__main__':
-    run_server()
+    run_server(**vars(bridge_core.parse_server_args(__doc__)))
@@ -0,0 +1,30 @@
+import admission
+
+
+def test_client_rate_limits_each_client_separately():
+    control = admission.AdmissionControl(client_rate=1, client_burst=2)
+    assert control.admit_client('10.0.0.1') == 0
+    assert control.admit_client('10.0.0.1') == 0
+    assert control.admit_client('10.0.0.1') >= 1
+    assert control.admit_client('10.0.0.2') == 0
+    assert control.stats()['rejected'] == {'client_rate': 1}
+
+
+def test_zero_client_rate_is_unlimited():
+    control = admission.AdmissionControl(client_rate=0)
+    assert all(control.admit_client('10.0.0.1') == 0 for _ in range(1000))
+
+
+def test_pending_budget_is_released():
+    control = admission.AdmissionControl(max_pending=3)
+    assert control.reserve(2) == 0
+    assert control.reserve(2) == admission.RETRY_AFTER
+    control.release(2)
+    assert control.reserve(3) == 0
+    assert control.stats()['pending'] == 3
+    assert control.stats()['rejected'] == {'pending': 1}
+
+
+def test_zero_max_pending_is_unlimited():
+    control = admission.AdmissionControl(max_pending=0)
+    assert control.reserve(10 ** 6) == 0
@@ -0,0 +1,108 @@
+import threading
+import time
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import answer_cache
+import gemini_stub
+
+
+class FakeModel:
+    """Answers each prompt with a numbered echo, or fails while failing is set"""
+
+    def __init__(self):
+        self.prompts = []
+        self.failing = False
+
+    def __call__(self, prompt):
+        if self.failing:
+            raise answer_cache.UpstreamError('model unavailable')
+        self.prompts.append(prompt)
+        return f'ANSWER {len(self.prompts)}'
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_help_is_answered_without_the_model():
+    model = FakeModel()
+    cache = answer_cache.AnswerCache(model)
+    assert cache.answer('HELP?') == (answer_cache.STATIC_ANSWERS['HELP'], 'static', 0.0)
+    assert model.prompts == []
+
+
+def test_queries_sharing_a_keyword_hit_one_entry():
+    model = FakeModel()
+    cache = answer_cache.AnswerCache(model)
+    assert cache.answer('WEATHER?')[:2] == ('ANSWER 1', 'miss')
+    assert cache.answer('weather today?')[:2] == ('ANSWER 1', 'hit')
+    assert len(model.prompts) == 1
+    assert cache.stats()['results'] == {'miss': 1, 'hit': 1}
+
+
+def test_stale_answer_is_served_while_it_is_refreshed(monkeypatch):
+    monkeypatch.setattr(answer_cache, 'DEFAULT_TTL', 0.05)
+    model = FakeModel()
+    cache = answer_cache.AnswerCache(model)
+    cache.answer('FAVOURITE COLOUR?')
+    time.sleep(0.1)
+
+    assert cache.answer('FAVOURITE COLOUR?')[:2] == ('ANSWER 1', 'stale')
+    assert wait_for(lambda: len(model.prompts) == 2 and not cache.stats()['fetching'])
+    assert cache.answer('FAVOURITE COLOUR?')[:2] == ('ANSWER 2', 'hit')
+
+
+def test_stale_answer_outlives_a_failing_model(monkeypatch):
+    monkeypatch.setattr(answer_cache, 'DEFAULT_TTL', 0.05)
+    model = FakeModel()
+    cache = answer_cache.AnswerCache(model)
+    cache.answer('FAVOURITE COLOUR?')
+    model.failing = True
+    time.sleep(0.1)
+
+    assert cache.answer('FAVOURITE COLOUR?')[:2] == ('ANSWER 1', 'stale')
+    assert wait_for(lambda: not cache.stats()['fetching'])
+    assert cache.answer('FAVOURITE COLOUR?')[:2] == ('ANSWER 1', 'stale')
+
+
+def test_least_recently_used_answer_is_evicted():
+    model = FakeModel()
+    cache = answer_cache.AnswerCache(model, max_entries=2)
+    cache.answer('WEATHER?')
+    cache.answer('JOKE?')
+    cache.answer('WEATHER?')
+    cache.answer('QUOTE?')
+
+    assert cache.stats()['entries'] == 2
+    assert cache.answer('WEATHER?')[1] == 'hit'
+    assert cache.answer('JOKE?')[1] == 'miss'
+
+
+def test_failed_fetch_is_counted_as_an_error():
+    model = FakeModel()
+    model.failing = True
+    cache = answer_cache.AnswerCache(model)
+    with pytest.raises(answer_cache.UpstreamError):
+        cache.answer('JOKE?')
+    assert cache.stats()['results'] == {'error': 1}
+
+
+def test_client_asks_the_stub_model():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), gemini_stub.StubModelHandler)
+    server.delay = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        client = answer_cache.GeminiClient(f'http://127.0.0.1:{server.server_address[1]}/v1beta')
+        cache = answer_cache.AnswerCache(client.generate)
+        text, how, _ = cache.answer('JOKE?')
+        assert how == 'miss'
+        assert text.startswith('ANSWER') and len(text) <= 20
+        assert cache.answer('JOKE?') == (text, 'hit', pytest.approx(0, abs=1))
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,158 @@
+import http.client
+import json
+import socket
+import threading
+
+import pytest
+
+import bridge_core
+
+
+class EchoHandler(bridge_core.BaseBridgeHandler):
+    def handle_command(self, command):
+        return {'status': 'success', 'message': f'Sent {command}'}
+
+
+@pytest.fixture(params=['threaded', 'asyncio'])
+def bridge(request):
+    server = bridge_core.make_server(EchoHandler, 0, request.param, host='127.0.0.1',
+                                     rate_limit=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+def post(port, path, body, content_type='application/json'):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    try:
+        connection.request('POST', path, body, {'Content-Type': content_type})
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        connection.close()
+
+
+@pytest.mark.parametrize('body, content_type', [
+    ('["A1", "PING"]', 'application/json'),
+    ('{"commands": ["A1", "PING"]}', 'application/json'),
+    ('"A1"\n{"command": "PING"}\n', 'application/x-ndjson'),
+])
+def test_send_commands_body_shapes(bridge, body, content_type):
+    status, response = post(bridge, '/send_commands', body, content_type)
+    assert status == 200
+    assert response['status'] == 'success'
+    assert [result['command'] for result in response['results']] == ['A1', 'PING']
+
+
+def test_send_commands_rejects_invalid_batch(bridge):
+    status, response = post(bridge, '/send_commands', '["A1", "two\\nlines"]')
+    assert status == 400
+    assert response['status'] == 'error'
+
+
+def test_idle_keep_alive_connections_hold_no_worker():
+    server = bridge_core.make_server(EchoHandler, 0, 'threaded', workers=2, host='127.0.0.1',
+                                     keep_alive_timeout=30, rate_limit=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+    try:
+        idle = []
+        for _ in range(4):
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', '/get_status')
+            connection.getresponse().read()
+            idle.append(connection)
+
+        status, response = post(port, '/send_command', '{"command": "PING"}')
+        assert status == 200
+        idle[0].request('GET', '/get_status')
+        assert idle[0].getresponse().status == 200
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def open_event_stream(port):
+    stream = socket.create_connection(('127.0.0.1', port), timeout=5)
+    stream.sendall(b'GET /events HTTP/1.1\r\n\r\n')
+    return stream, stream.recv(4096).split(b'\r\n')[0]
+
+
+@pytest.mark.parametrize('engine', ['threaded', 'asyncio'])
+def test_event_streams_are_capped_and_hold_no_worker(engine):
+    workers = 2
+    server = bridge_core.make_server(EchoHandler, 0, engine, workers=workers, host='127.0.0.1',
+                                     max_event_streams=workers + 2)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+    opened = [open_event_stream(port) for _ in range(workers + 3)]
+    try:
+        statuses = [status_line for _, status_line in opened]
+        assert statuses.count(b'HTTP/1.1 200 OK') == workers + 2
+        assert statuses[-1] == b'HTTP/1.1 503 Service Unavailable'
+
+        status, response = post(port, '/send_command', '{"command": "PING"}')
+        assert status == 200
+    finally:
+        for stream, _ in opened:
+            stream.close()
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.mark.parametrize('body', [
+    '{"command": 5}', '{"command": null}', '{}', '{"command": ""}', '{"command": "  "}',
+    '{"command": "A1\\nPING"}',
+])
+def test_send_command_rejects_invalid_command(bridge, body):
+    status, response = post(bridge, '/send_command', body)
+    assert status == 400
+    assert response['status'] == 'error'
+
+
+def test_oversized_body_is_refused_with_connection_close(bridge):
+    with socket.create_connection(('127.0.0.1', bridge), timeout=5) as sock:
+        sock.sendall(b'POST /send_command HTTP/1.1\r\nHost: bridge\r\n'
+                     b'Content-Length: %d\r\n\r\n' % (bridge_core.MAX_BODY_BYTES + 1))
+        response = b''
+        while chunk := sock.recv(4096):
+            response += chunk
+    head = response.split(b'\r\n\r\n', 1)[0].split(b'\r\n')
+    assert head[0].startswith(b'HTTP/1.1 413')
+    assert b'Connection: close' in head
+
+
+def test_batch_over_the_pending_budget_is_not_retried():
+    server = bridge_core.make_server(EchoHandler, 0, 'threaded', host='127.0.0.1', max_pending=2)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+    try:
+        status, response = post(port, '/send_commands', '["A1", "A2", "PING"]')
+        assert status == 413
+        assert response['status'] == 'error'
+        assert server.admission.stats()['rejected'] == {'batch_size': 1}
+        assert post(port, '/send_commands', '["A1", "PING"]')[0] == 200
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.mark.parametrize('engine', ['threaded', 'asyncio'])
+def test_event_streams_count_against_the_client_rate(engine):
+    server = bridge_core.make_server(EchoHandler, 0, engine, host='127.0.0.1',
+                                     client_rate=0.01, client_burst=1)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+    streams = []
+    try:
+        streams.append(open_event_stream(port))
+        streams.append(open_event_stream(port))
+        assert [status_line for _, status_line in streams] == [
+            b'HTTP/1.1 200 OK', b'HTTP/1.1 429 Too Many Requests']
+    finally:
+        for stream, _ in streams:
+            stream.close()
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,109 @@
+import http.client
+import json
+import threading
+
+import pytest
+
+import bridge_daemon
+import transports
+
+
+class RecordingTransport(transports.Transport):
+    """Keeps every write; the robot behind it never answers"""
+
+    name = 'recording'
+
+    def __init__(self):
+        super().__init__()
+        self.written = b''
+
+    def send(self, data):
+        self.written += data
+        return len(data)
+
+
+@pytest.fixture
+def daemon():
+    """Start a daemon driving robots named as given; yields (port, transports)"""
+    servers, forwarders = [], []
+
+    def start(*names):
+        robots = {name: RecordingTransport() for name in names}
+        forwarders.extend(bridge_daemon.Forwarder(transport, name=name).start()
+                          for name, transport in robots.items())
+        server = bridge_daemon.make_daemon_server(
+            {forwarder.name: forwarder for forwarder in forwarders[-len(names):]}, 0,
+            'threaded', host='127.0.0.1')
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server.server_address[1], robots
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+    for forwarder in forwarders:
+        forwarder.close()
+
+
+def post(port, body):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    try:
+        connection.request('POST', '/send_command', json.dumps(body),
+                           {'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        connection.close()
+
+
+def test_only_robot_can_be_named(daemon):
+    port, robots = daemon('ESP32')
+    status, response = post(port, {'command': 'PING', 'device': 'ESP32'})
+    assert status == 200
+    assert response['status'] == 'success'
+    assert robots['ESP32'].written == b'PING\n'
+
+
+@pytest.mark.parametrize('devices', [
+    [('left', 'rfcomm'), ('right', 'rfcomm')],
+    [('left', 'tcp://127.0.0.1:9750'), ('left', 'tcp://127.0.0.1:9751')],
+])
+def test_conflicting_devices_are_refused(devices):
+    with pytest.raises(ValueError):
+        bridge_daemon.check_devices(devices)
+
+
+def test_robots_with_their_own_addresses_are_accepted():
+    bridge_daemon.check_devices([('left', 'rfcomm'), ('right', 'rfcomm://AA:BB:CC:DD:EE:FF')])
+
+
+def test_commands_go_to_the_default_robot(daemon):
+    port, robots = daemon('left', 'right')
+    status, response = post(port, {'command': 'PING'})
+    assert status == 200 and response['status'] == 'success'
+    assert robots['left'].written == b'PING\n'
+    assert robots['right'].written == b''
+
+
+def test_commands_go_to_the_named_robot(daemon):
+    port, robots = daemon('left', 'right')
+    status, response = post(port, {'command': 'A3', 'device': 'right'})
+    assert status == 200 and response['status'] == 'success'
+    assert robots['right'].written == b'A3\n'
+    assert robots['left'].written == b''
+
+
+def test_broadcast_reaches_every_robot(daemon):
+    port, robots = daemon('left', 'right')
+    status, response = post(port, {'command': 'A3', 'device': 'all'})
+    assert status == 200 and response['status'] == 'success'
+    assert set(response['devices']) == {'left', 'right'}
+    assert all(robot.written == b'A3\n' for robot in robots.values())
+
+
+def test_unknown_robot_is_refused(daemon):
+    port, robots = daemon('left', 'right')
+    status, response = post(port, {'command': 'PING', 'device': 'middle'})
+    assert status == 400
+    assert not any(robot.written for robot in robots.values())
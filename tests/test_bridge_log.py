@@ -0,0 +1,55 @@
+import io
+import json
+
+import pytest
+
+import bridge_log
+
+log = bridge_log.get_logger('test')
+
+
+@pytest.fixture
+def capture():
+    """Log to a buffer with the given options; call the result to read the lines"""
+    stream = io.StringIO()
+
+    def configure(**options):
+        bridge_log.configure(stream=stream, **options)
+
+        def lines():
+            bridge_log._handler.queue.join()  # Until the writer took every record
+            return stream.getvalue().splitlines()
+        return lines
+
+    yield configure
+    bridge_log.configure()
+
+
+def test_sampled_messages_are_thinned_evenly(capture):
+    lines = capture(sample_rate=0.25)
+    for index in range(8):
+        log.info("sampled %d", index, extra=bridge_log.fields(sampled=True))
+    assert lines() == ['sampled 3', 'sampled 7']
+
+
+def test_warnings_and_unsampled_messages_are_always_kept(capture):
+    lines = capture(sample_rate=0)
+    log.info("sampled", extra=bridge_log.fields(sampled=True))
+    log.info("link connected")
+    log.warning("write failed", extra=bridge_log.fields(sampled=True))
+    assert lines() == ['link connected', 'write failed']
+
+
+def test_json_lines_carry_the_fields(capture):
+    lines = capture(log_format='json', level='DEBUG')
+    log.debug("Sent %s", 'PING', extra=bridge_log.fields(sequence=7, device='left'))
+    entry, = map(json.loads, lines())
+    assert (entry['msg'], entry['level'], entry['logger']) == ('Sent PING', 'DEBUG', 'esp32.test')
+    assert (entry['sequence'], entry['device']) == (7, 'left')
+
+
+def test_messages_below_the_level_are_dropped(capture):
+    lines = capture(level='WARNING')
+    log.info("quiet")
+    log.error("loud")
+    assert lines() == ['loud']
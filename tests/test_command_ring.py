@@ -0,0 +1,56 @@
+import pytest
+
+import command_ring
+
+
+@pytest.fixture
+def ring(tmp_path):
+    ring = command_ring.CommandRing(str(tmp_path / 'commands.ring'), capacity=64)
+    yield ring
+    ring.close()
+
+
+def test_records_survive_wrapping_around(tmp_path):
+    ring = command_ring.CommandRing(str(tmp_path / 'commands.ring'), capacity=50)
+    try:
+        consumer = ring.consumer('robot')
+        for index in range(20):
+            sequence = ring.append(f'A{index:03d}')
+            assert consumer.read() == [(sequence, f'A{index:03d}')]
+            consumer.commit()
+        assert ring.head()[1] > 2 * ring.capacity
+        assert consumer.dropped == 0
+    finally:
+        ring.close()
+
+
+def test_append_refuses_to_overrun_a_live_consumer(ring):
+    consumer = ring.consumer('robot')
+    ring.append_many(['CMD0', 'CMD1', 'CMD2', 'CMD3'])
+    with pytest.raises(command_ring.RingFull):
+        ring.append('CMD4')
+
+    assert [command for _, command in consumer.read(max_records=1)] == ['CMD0']
+    consumer.commit()
+    ring.append('CMD4')
+    assert [command for _, command in consumer.read()] == ['CMD1', 'CMD2', 'CMD3', 'CMD4']
+
+
+def test_uncommitted_reads_are_replayed(ring):
+    consumer = ring.consumer('robot')
+    ring.append_many(['PING', 'A1'])
+    assert len(consumer.read()) == 2
+    consumer.rewind()
+    assert [command for _, command in consumer.read()] == ['PING', 'A1']
+
+
+def test_stale_consumer_is_overrun_and_skips_ahead(ring, monkeypatch):
+    consumer = ring.consumer('robot')
+    monkeypatch.setattr(command_ring, 'CONSUMER_STALE_AFTER', 0)
+    ring.append_many(['CMD0', 'CMD1', 'CMD2', 'CMD3'])
+    ring.append('CMD4')
+
+    assert consumer.read() == []
+    assert consumer.dropped == 5
+    sequence = ring.append('PING')
+    assert consumer.read() == [(sequence, 'PING')]
@@ -0,0 +1,117 @@
+import threading
+import time
+
+import command_scheduler
+
+
+class GatedDelivery:
+    """Records delivered batches; the first one waits until released"""
+
+    def __init__(self):
+        self.batches = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, commands):
+        self.batches.append(commands)
+        self.started.set()
+        self.release.wait(5)
+        return [{'command': command, 'status': 'success'} for command in commands]
+
+
+def submit_in_background(scheduler, commands, **options):
+    results = {}
+    thread = threading.Thread(
+        target=lambda: results.update(results=scheduler.submit(None, commands, **options)))
+    thread.start()
+    return thread, results
+
+
+def wait_until_queued(scheduler, count):
+    deadline = time.monotonic() + 5
+    while scheduler.stats()['queued'] < count and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+
+def test_batch_keeps_its_animation_sequence():
+    scheduler = command_scheduler.CommandScheduler(rate=0, deliver=GatedDelivery())
+    scheduler.deliver.release.set()
+    results = scheduler.submit(None, ['A1', 'A2', 'A3', 'A4'])
+    assert [result['command'] for result in results] == ['A1', 'A2', 'A3', 'A4']
+    assert not any(result.get('coalesced') for result in results)
+    assert scheduler.stats()['coalesced'] == 0
+
+
+def test_later_submit_supersedes_waiting_animations():
+    delivery = GatedDelivery()
+    scheduler = command_scheduler.CommandScheduler(rate=0, deliver=delivery)
+    blocker, _ = submit_in_background(scheduler, ['PING'])
+    delivery.started.wait(5)
+    first, first_results = submit_in_background(scheduler, ['A1', 'A2'])
+    wait_until_queued(scheduler, 2)
+
+    second, second_results = submit_in_background(scheduler, ['A3'])
+    wait_until_queued(scheduler, 1)
+    delivery.release.set()
+    for thread in (blocker, first, second):
+        thread.join(5)
+
+    assert all(result['coalesced'] for result in first_results['results'])
+    assert second_results['results'][0]['status'] == 'success'
+    assert ['A3'] in delivery.batches
+    assert scheduler.stats()['coalesced'] == 2
+
+
+def test_higher_priorities_are_delivered_first():
+    delivery = GatedDelivery()
+    scheduler = command_scheduler.CommandScheduler(rate=0, deliver=delivery)
+    blocker, _ = submit_in_background(scheduler, ['CONNECT'])
+    delivery.started.wait(5)
+    waiting = [submit_in_background(scheduler, [command])[0]
+               for command in ('A1', 'HELLO', 'PING')]
+    wait_until_queued(scheduler, 3)
+    delivery.release.set()
+    for thread in [blocker, *waiting]:
+        thread.join(5)
+
+    assert delivery.batches[1] == ['PING', 'HELLO', 'A1']
+
+
+def test_full_priority_queue_rejects_commands():
+    delivery = GatedDelivery()
+    scheduler = command_scheduler.CommandScheduler(rate=0, queue_limits={'normal': 1},
+                                                   deliver=delivery)
+    blocker, _ = submit_in_background(scheduler, ['PING'])
+    delivery.started.wait(5)
+    thread, results = submit_in_background(scheduler, ['HELLO', 'WEATHER?'])
+    wait_until_queued(scheduler, 1)
+    delivery.release.set()
+    for waiting in (blocker, thread):
+        waiting.join(5)
+
+    hello, weather = results['results']
+    assert hello['status'] == 'success'
+    assert weather['status'] == 'error' and weather['rejected']
+    assert scheduler.stats()['rejected'] == 1
+
+
+def test_missing_delivery_results_are_answered():
+    scheduler = command_scheduler.CommandScheduler(rate=0, deliver=lambda commands: [])
+    results = scheduler.submit(None, ['PING', 'HELLO'])
+    assert [result['status'] for result in results] == ['error', 'error']
+
+
+def test_stuck_delivery_times_out():
+    delivery = GatedDelivery()
+    scheduler = command_scheduler.CommandScheduler(rate=0, deliver=delivery, result_timeout=0.1)
+    blocker, blocked = submit_in_background(scheduler, ['PING'])
+    delivery.started.wait(5)
+    waiting = scheduler.submit(None, ['HELLO'])
+    blocker.join(5)
+
+    assert blocked['results'][0]['timed_out']
+    assert waiting[0]['timed_out']
+    assert scheduler.stats()['queued'] == 0
+    delivery.release.set()
+    scheduler.submit(None, ['PING'])
+    assert delivery.batches == [['PING'], ['PING']]
@@ -0,0 +1,76 @@
+import http.client
+import json
+import threading
+
+import pytest
+
+import bridge_core
+import command_trace
+
+
+class EchoHandler(bridge_core.BaseBridgeHandler):
+    def handle_command(self, command):
+        return {'status': 'success', 'message': f'Sent {command}'}
+
+
+@pytest.fixture
+def tracing_bridge():
+    """Start a bridge recording to the given path; yields its port"""
+    servers = []
+
+    def start(path):
+        server = bridge_core.make_server(EchoHandler, 0, 'threaded', host='127.0.0.1',
+                                         trace=str(path))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+        server.trace.close()
+
+
+def post(port, path, body):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    try:
+        connection.request('POST', path, json.dumps(body), {'Content-Type': 'application/json'})
+        return connection.getresponse().status
+    finally:
+        connection.close()
+
+
+def recorded(records):
+    return [{key: value for key, value in record.items() if key != 'ns'} for record in records]
+
+
+def test_replayed_trace_records_the_same_requests(tracing_bridge, tmp_path):
+    original = tracing_bridge(tmp_path / 'original.trace')
+    port = original.server_address[1]
+    assert post(port, '/send_command', {'command': 'PING'}) == 200
+    assert post(port, '/send_commands', {'commands': ['A1', 'A2'], 'priority': 'bulk'}) == 200
+    assert post(port, '/send_command', {'command': 'two\nlines'}) == 400
+    original.trace.close()
+
+    records = list(command_trace.read_trace(tmp_path / 'original.trace'))
+    assert recorded(records) == [
+        {'route': '/send_command', 'commands': ['PING']},
+        {'route': '/send_commands', 'commands': ['A1', 'A2'], 'priority': 'bulk'},
+    ]
+    assert records[0]['ns'] <= records[1]['ns']
+
+    replica = tracing_bridge(tmp_path / 'replica.trace')
+    summary = command_trace.replay(
+        records, f'http://127.0.0.1:{replica.server_address[1]}', speed=0).summary()
+    replica.trace.close()
+
+    assert (summary['requests'], summary['commands'], summary['dropped']) == (2, 3, 0)
+    replayed = command_trace.read_trace(tmp_path / 'replica.trace')
+    assert sorted(map(json.dumps, recorded(replayed))) == sorted(map(json.dumps, recorded(records)))
+
+
+def test_truncated_last_line_is_skipped(tmp_path):
+    path = tmp_path / 'cut.trace'
+    path.write_text('{"ns":1,"route":"/send_command","commands":["PING"]}\n{"ns":2,"rou')
+    assert [record['ns'] for record in command_trace.read_trace(path)] == [1]
@@ -0,0 +1,16 @@
+import command_ring
+import direct_esp32_sender
+
+
+def test_rewound_unencodable_command_is_rejected_once(monkeypatch):
+    published = []
+    monkeypatch.setattr(command_ring, 'publish_event', published.append)
+    rejected = set()
+    records = [(1, 'PING'), (2, 'X' * 300)]
+
+    for _ in range(2):  # Read, send failed, rewound and read again
+        sendable = [record for record in records
+                    if not direct_esp32_sender.reject_unencodable(record, 'binary', rejected)]
+        assert sendable == [(1, 'PING')]
+
+    assert [(event['sequence'], event['status']) for event in published] == [(2, 'rejected')]
@@ -0,0 +1,75 @@
+import json
+import time
+
+import esp32_discovery
+
+
+class FakeScanner:
+    """Stands in for a Bluetooth inquiry, finding the devices in ``found``"""
+
+    def __init__(self, *found):
+        self.found = list(found)
+        self.scans = 0
+
+    def __call__(self, device_name):
+        self.scans += 1
+        return self.found
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def write_cache(path, **seen_ago):
+    now = time.time()
+    path.write_text(json.dumps({address: {'name': 'ESP32_Eye_Robot', 'seen': now - ago}
+                                for address, ago in seen_ago.items()}))
+
+
+def test_miss_scans_in_the_background_and_caches_the_result(tmp_path):
+    cache = tmp_path / 'devices.json'
+    scanner = FakeScanner(('AA:AA', 'ESP32_Eye_Robot'))
+    locator = esp32_discovery.DeviceLocator(str(cache), discover=scanner)
+    assert locator.address() is None
+    assert wait_for(lambda: locator.address() == 'AA:AA')
+
+    restarted = esp32_discovery.DeviceLocator(str(cache), discover=scanner)
+    assert restarted.address() == 'AA:AA'
+    assert scanner.scans == 1
+
+
+def test_entries_older_than_the_ttl_are_ignored(tmp_path):
+    cache = tmp_path / 'devices.json'
+    write_cache(cache, **{'AA:AA': 100, 'BB:BB': 10})
+    scanner = FakeScanner()
+    assert esp32_discovery.DeviceLocator(str(cache), ttl=50, discover=scanner).address() == 'BB:BB'
+    assert esp32_discovery.DeviceLocator(str(cache), ttl=5, discover=scanner).address() is None
+    assert wait_for(lambda: scanner.scans == 1)
+
+
+def test_failed_connect_rescans_for_a_new_address(tmp_path, monkeypatch):
+    cache = tmp_path / 'devices.json'
+    write_cache(cache, **{'AA:AA': 10})
+    scanner = FakeScanner(('BB:BB', 'ESP32_Eye_Robot'))
+    locator = esp32_discovery.DeviceLocator(str(cache), discover=scanner)
+
+    monkeypatch.setattr(esp32_discovery, 'REFRESH_INTERVAL', 60.0)
+    locator.connect_failed('AA:AA')
+    assert wait_for(lambda: locator.address() == 'BB:BB')
+    # Only one rescan per REFRESH_INTERVAL, however often connects fail
+    locator.connect_failed('BB:BB')
+    time.sleep(0.05)
+    assert scanner.scans == 1
+
+
+def test_successful_connect_keeps_an_address_first(tmp_path):
+    cache = tmp_path / 'devices.json'
+    write_cache(cache, **{'AA:AA': 20, 'BB:BB': 10})
+    locator = esp32_discovery.DeviceLocator(str(cache), discover=FakeScanner())
+    assert locator.address() == 'BB:BB'
+    locator.connect_succeeded('AA:AA')
+    assert locator.address() == 'AA:AA'
+    assert json.loads(cache.read_text())['AA:AA']['seen'] > time.time() - 5
@@ -0,0 +1,112 @@
+import time
+
+import esp32_link
+import esp32_protocol
+
+
+class FakeSocket:
+    """Accepts every write; the robot behind it never answers"""
+
+    readable = False
+
+    def __init__(self):
+        self.written = b''
+
+    def send(self, data):
+        self.written += data
+        return len(data)
+
+    def close(self):
+        pass
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_silent_robot_has_its_commands_reported_lost():
+    acks = []
+    matcher = esp32_protocol.ReplyMatcher(acks.append, timeout=0.1)
+    link = esp32_link.ESP32Link(FakeSocket, on_tick=matcher.expire).start()
+    try:
+        matcher.expect([(1, 'PING')])
+        assert link.send('PING')
+        assert wait_for(lambda: acks)
+        assert (acks[0]['sequence'], acks[0]['status']) == (1, 'lost')
+    finally:
+        link.close()
+
+
+class FlakyConnect:
+    """Fails the first ``failures`` connects, then hands out FakeSockets"""
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.attempts = 0
+        self.sockets = []
+
+    def __call__(self):
+        self.attempts += 1
+        if self.attempts <= self.failures:
+            raise OSError('ESP32 is out of range')
+        self.sockets.append(FakeSocket())
+        return self.sockets[-1]
+
+
+class BrokenSocket(FakeSocket):
+    def send(self, data):
+        raise OSError('connection reset')
+
+
+def test_connect_backs_off_between_attempts(monkeypatch):
+    monkeypatch.setattr(esp32_link, 'MIN_BACKOFF', 0.2)
+    connect = FlakyConnect(failures=1)
+    link = esp32_link.ESP32Link(connect).start()
+    try:
+        assert wait_for(lambda: connect.attempts == 1 and link.last_error)
+        # Still backing off: fails at once without another connect attempt
+        assert not link.send('PING')
+        assert connect.attempts == 1
+
+        time.sleep(0.25)
+        assert link.send('PING')
+        assert connect.attempts == 2
+        assert link.state == 'connected'
+        assert connect.sockets[0].written == b'PING\n'
+    finally:
+        link.close()
+
+
+def test_failed_write_drops_the_socket_and_reconnects(monkeypatch):
+    monkeypatch.setattr(esp32_link, 'MIN_BACKOFF', 0.01)
+    sockets = [BrokenSocket(), FakeSocket()]
+    events = []
+    link = esp32_link.ESP32Link(lambda: sockets.pop(0), on_event=events.append).start()
+    try:
+        assert not link.send('PING')
+        assert link.last_error == 'connection reset'
+        assert link.send('PING')
+        assert link.reconnects == 1
+        assert [event['state'] for event in events if event['type'] == 'link'] == [
+            'connected', 'disconnected', 'connected']
+    finally:
+        link.close()
+
+
+def test_health_file_follows_the_link(tmp_path):
+    path = esp32_link.health_path_for(str(tmp_path / 'esp32_commands.ring'))
+    assert path == str(tmp_path / esp32_link.HEALTH_FILE)
+    assert esp32_link.read_health(path) is None
+
+    link = esp32_link.ESP32Link(FakeSocket, name='robot', health_path=path).start()
+    try:
+        assert wait_for(lambda: (esp32_link.read_health(path) or {}).get('state') == 'connected')
+        assert link.send('A1')
+    finally:
+        link.close()
+    health = esp32_link.read_health(path)
+    assert (health['name'], health['state']) == ('robot', 'closed')
+    assert health['messages_sent'] == 1
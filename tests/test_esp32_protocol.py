@@ -0,0 +1,70 @@
+import time
+
+import pytest
+
+import esp32_protocol
+
+
+@pytest.mark.parametrize('command', ['X' * 256, 'A' + 'B' * 300])
+def test_overlong_command_cannot_be_framed(command):
+    assert esp32_protocol.encoding_error(command, 'binary') is not None
+    assert esp32_protocol.encoding_error(command, 'text') is None
+
+
+def test_non_ascii_digits_are_sent_as_text():
+    frame = esp32_protocol.encode_frame('A²')
+    assert frame[0] == esp32_protocol.FRAME_HEADER | esp32_protocol.FRAME_TEXT
+    assert esp32_protocol.CommandDecoder().feed(frame) == ['A²']
+
+
+def test_unanswered_commands_are_lost_without_further_replies():
+    acks = []
+    matcher = esp32_protocol.ReplyMatcher(acks.append, timeout=0)
+    matcher.expect([(1, 'PING')])
+    time.sleep(0.01)
+    matcher.delivered([(2, 'A1')])
+    assert [(ack['sequence'], ack['status']) for ack in acks] == [(1, 'lost'), (2, 'delivered')]
+
+
+def test_waiting_replies_are_capped():
+    acks = []
+    matcher = esp32_protocol.ReplyMatcher(acks.append, limit=2)
+    matcher.expect([(sequence, 'PING') for sequence in range(5)])
+    assert [ack['sequence'] for ack in acks] == [0, 1, 2]
+    assert all(ack['status'] == 'lost' for ack in acks)
+    assert matcher.reply('PONG')
+    assert acks[-1]['sequence'] == 3 and acks[-1]['status'] == 'acknowledged'
+
+
+def test_binary_commands_round_trip():
+    commands = ['CONNECT', 'A5', 'HELLO WORLD', 'PING']
+    data = esp32_protocol.encode_commands('\n'.join(commands), 'binary')
+    assert esp32_protocol.CommandDecoder().feed(data) == commands
+
+    decoder = esp32_protocol.CommandDecoder()
+    received = []
+    for index in range(len(data)):
+        received += decoder.feed(data[index:index + 1])
+    assert received == commands
+
+
+def test_decoding_resumes_after_a_bad_checksum():
+    corrupt = bytearray(esp32_protocol.encode_frame('HELLO'))
+    corrupt[-1] ^= 0xFF
+    data = (esp32_protocol.encode_frame('A1') + bytes(corrupt) + b'noise\n'
+            + b'STATUS\n' + esp32_protocol.encode_frame('PING'))
+
+    decoder = esp32_protocol.CommandDecoder()
+    assert decoder.feed(data) == ['A1', 'STATUS', 'PING']
+    assert decoder.frame_errors == 1
+
+
+def test_dropped_reply_does_not_hold_up_later_ones():
+    acks = []
+    matcher = esp32_protocol.ReplyMatcher(acks.append)
+    matcher.expect([(1, 'PING'), (2, 'CONNECT'), (3, 'PING')])
+    assert matcher.reply('CONNECTED')
+    assert matcher.reply('PONG')
+    assert not matcher.reply('PONG')
+    assert [(ack['sequence'], ack['status']) for ack in acks] == [
+        (1, 'lost'), (2, 'acknowledged'), (3, 'acknowledged')]
@@ -0,0 +1,90 @@
+import http.client
+import json
+import threading
+import time
+
+import bridge_core
+import esp32_protocol
+import latency_trace
+
+
+class EchoHandler(bridge_core.BaseBridgeHandler):
+    def handle_command(self, command):
+        return {'status': 'success', 'message': f'Sent {command}'}
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_unacknowledged_trace_is_finished_without_further_calls(monkeypatch):
+    monkeypatch.setattr(latency_trace, 'ACK_WAIT', 0.05)
+    monkeypatch.setattr(latency_trace, 'EXPIRE_INTERVAL', 0.01)
+    tracer = latency_trace.Tracer()
+    tracer.attach(bridge_core.EventHub())
+    trace, = tracer.start(['PING'])
+    tracer.delivered(trace, {'status': 'success', 'sequence': 7})
+
+    assert wait_for(lambda: tracer.recent)
+    assert tracer.recent[0].status == 'no_ack'
+    assert tracer.snapshot()['pending'] == 0
+
+
+def test_acknowledged_trace_has_every_span():
+    hub = bridge_core.EventHub()
+    tracer = latency_trace.Tracer()
+    tracer.attach(hub)
+    trace, = tracer.start(['PING'], 'abc123')
+    trace.span('queue', time.time(), time.time())
+    trace.span('deliver', time.time(), time.time())
+    tracer.delivered(trace, {'status': 'success', 'sequence': 9})
+    sent_at = time.time()
+    hub.publish(esp32_protocol.ack_event(9, 'PING', 'acknowledged', 'PONG', sent_at,
+                                         sent_at + 0.01))
+
+    finished = tracer.snapshot()['recent'][0]
+    assert (finished['trace_id'], finished['sequence'], finished['status']) == (
+        'abc123', 9, 'acknowledged')
+    assert [span['name'] for span in finished['spans']] == [
+        'parse', 'queue', 'deliver', 'handoff', 'robot']
+
+
+def test_ack_arriving_before_delivery_finishes_the_trace():
+    hub = bridge_core.EventHub()
+    tracer = latency_trace.Tracer()
+    tracer.attach(hub)
+    trace, = tracer.start(['PING'])
+    hub.publish(esp32_protocol.ack_event(11, 'PING', 'acknowledged', 'PONG'))
+    tracer.delivered(trace, {'status': 'success', 'sequence': 11})
+    assert trace.status == 'acknowledged'
+
+
+def test_slow_traces_are_kept_apart():
+    tracer = latency_trace.Tracer(slow_threshold=0)
+    trace, = tracer.start(['A1'])
+    tracer.finish(trace, 'delivered')
+    assert tracer.snapshot()['slow'][0]['trace_id'] == trace.trace_id
+
+
+def test_debug_traces_shows_a_request():
+    server = bridge_core.make_server(EchoHandler, 0, 'threaded', host='127.0.0.1')
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+    try:
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+        connection.request('POST', '/send_command', '{"command": "PING"}',
+                           {'Content-Type': 'application/json', 'X-Trace-Id': 'feedbeef'})
+        assert json.loads(connection.getresponse().read())['trace_id'] == 'feedbeef'
+        connection.request('GET', '/debug/traces')
+        snapshot = json.loads(connection.getresponse().read())
+        connection.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    trace = next(trace for trace in snapshot['recent'] if trace['trace_id'] == 'feedbeef')
+    assert trace['command'] == 'PING' and trace['status'] == 'success'
+    assert [span['name'] for span in trace['spans']] == ['parse', 'queue', 'deliver']
@@ -0,0 +1,74 @@
+import http.client
+import threading
+
+import pytest
+
+import bridge_core
+import metrics
+
+
+class EchoHandler(bridge_core.BaseBridgeHandler):
+    def handle_command(self, command):
+        return {'status': 'success', 'message': f'Sent {command}'}
+
+
+def test_counters_and_gauges_render_with_labels():
+    registry = metrics.Registry()
+    sent = registry.counter('robot_sent_total', 'Commands sent', ('link',))
+    sent.inc(link='rfcomm')
+    sent.inc(2, link='say "hi"\n')
+    registry.gauge('robot_up', 'Whether the link is up').set(1)
+
+    assert registry.render().decode().splitlines() == [
+        '# HELP robot_sent_total Commands sent',
+        '# TYPE robot_sent_total counter',
+        'robot_sent_total{link="rfcomm"} 1',
+        'robot_sent_total{link="say \\"hi\\"\\n"} 2',
+        '# HELP robot_up Whether the link is up',
+        '# TYPE robot_up gauge',
+        'robot_up 1',
+    ]
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = metrics.Registry()
+    latency = registry.histogram('robot_latency_seconds', 'Latency', buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 5.0):
+        latency.observe(value)
+
+    assert registry.render().decode().splitlines()[2:] == [
+        'robot_latency_seconds_bucket{le="0.1"} 1',
+        'robot_latency_seconds_bucket{le="1.0"} 3',
+        'robot_latency_seconds_bucket{le="+Inf"} 4',
+        'robot_latency_seconds_sum 6.05',
+        'robot_latency_seconds_count 4',
+    ]
+
+
+def test_declaring_a_metric_twice_shares_it():
+    registry = metrics.Registry()
+    assert registry.counter('robot_total', 'Total') is registry.counter('robot_total', 'Total')
+    with pytest.raises(ValueError):
+        registry.gauge('robot_total', 'Total')
+
+
+def test_bridge_serves_its_metrics():
+    server = bridge_core.make_server(EchoHandler, 0, 'threaded', host='127.0.0.1')
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        connection = http.client.HTTPConnection('127.0.0.1', server.server_address[1], timeout=10)
+        connection.request('POST', '/send_command', '{"command": "PING"}')
+        connection.getresponse().read()
+        connection.request('GET', '/metrics')
+        response = connection.getresponse()
+        body = response.read().decode()
+        connection.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert response.status == 200
+    assert response.getheader('Content-Type') == metrics.CONTENT_TYPE
+    assert 'bridge_http_requests_total{method="POST",route="/send_command",status="200"}' in body
+    assert '# TYPE bridge_http_request_duration_seconds histogram' in body
+    assert 'bridge_scheduler_queued_commands{priority="control"} 0' in body
@@ -0,0 +1,44 @@
+import subprocess
+import time
+
+import pytest
+
+import shell_worker
+
+
+@pytest.fixture
+def worker():
+    worker = shell_worker.ShellWorker()
+    yield worker
+    worker.close()
+
+
+def test_commands_share_one_shell(worker):
+    assert worker.run(['echo', 'hello world'], 5).stdout == 'hello world\n'
+    assert worker.run(['printf', 'no newline'], 5).stdout == 'no newline'
+    assert (worker.commands_run, worker.restarts) == (2, 0)
+
+
+def test_failing_command_raises_with_its_status(worker):
+    with pytest.raises(subprocess.CalledProcessError) as failed:
+        worker.run(['sh', '-c', 'echo oops; exit 3'], 5)
+    assert (failed.value.returncode, failed.value.output) == (3, 'oops\n')
+    assert worker.run(['echo', 'still here'], 5).stdout == 'still here\n'
+    assert worker.restarts == 0
+
+
+def test_hung_command_is_killed_and_the_shell_restarted(worker):
+    started = time.monotonic()
+    with pytest.raises(subprocess.TimeoutExpired):
+        worker.run(['sleep', '30'], 0.2)
+    assert time.monotonic() - started < 5
+
+    assert worker.run(['echo', 'recovered'], 5).stdout == 'recovered\n'
+    assert worker.restarts == 1
+
+
+def test_shell_exiting_is_reported_and_replaced(worker):
+    with pytest.raises(OSError):
+        worker.run(['exit', '1'], 5)
+    assert worker.run(['echo', 'back'], 5).stdout == 'back\n'
+    assert worker.restarts == 1
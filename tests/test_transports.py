@@ -0,0 +1,70 @@
+import time
+
+import pytest
+
+import transports
+
+
+class FlakyTransport(transports.Transport):
+    """Counts write attempts, failing each one while failing is set"""
+
+    def __init__(self, name, failing=False):
+        super().__init__()
+        self.name = name
+        self.failing = failing
+        self.attempts = 0
+
+    def send(self, data):
+        self.attempts += 1
+        if self.failing:
+            raise OSError(f'{self.name} is down')
+        return len(data)
+
+
+def circuit(fallback, transport):
+    return fallback.stats()['methods'][transport.name]['circuit']
+
+
+def test_last_working_method_is_tried_first():
+    first, second = FlakyTransport('first', failing=True), FlakyTransport('second')
+    fallback = transports.FallbackTransport([first, second])
+    assert fallback.send(b'PING\n') == 5
+    assert fallback.send(b'PING\n') == 5
+    assert (first.attempts, second.attempts) == (1, 2)
+    assert fallback.stats()['preferred'] == 'second'
+
+
+def test_circuit_opens_after_repeated_failures(monkeypatch):
+    monkeypatch.setattr(transports, 'CIRCUIT_COOLDOWN', 60.0)
+    down = FlakyTransport('down', failing=True)
+    fallback = transports.FallbackTransport([down])
+    for _ in range(transports.CIRCUIT_FAILURES):
+        with pytest.raises(OSError, match='failed'):
+            fallback.send(b'PING\n')
+    assert circuit(fallback, down) == 'open'
+
+    with pytest.raises(OSError, match='cooling down'):
+        fallback.send(b'PING\n')
+    assert down.attempts == transports.CIRCUIT_FAILURES
+
+
+@pytest.mark.parametrize('recovered', [True, False])
+def test_circuit_half_opens_for_one_trial_write(monkeypatch, recovered):
+    monkeypatch.setattr(transports, 'CIRCUIT_COOLDOWN', 0.05)
+    flaky = FlakyTransport('flaky', failing=True)
+    fallback = transports.FallbackTransport([flaky])
+    for _ in range(transports.CIRCUIT_FAILURES):
+        with pytest.raises(OSError):
+            fallback.send(b'PING\n')
+    time.sleep(0.1)
+    assert circuit(fallback, flaky) == 'closed'
+
+    flaky.failing = not recovered
+    if recovered:
+        fallback.send(b'PING\n')
+        assert circuit(fallback, flaky) == 'closed'
+    else:
+        with pytest.raises(OSError, match='failed'):
+            fallback.send(b'PING\n')
+        assert circuit(fallback, flaky) == 'open'
+    assert flaky.attempts == transports.CIRCUIT_FAILURES + 1
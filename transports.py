@@ -0,0 +1,464 @@
+#!/usr/bin/env python3
+"""
+Transports that carry newline-delimited commands to the ESP32
+Every forwarding path (Bluetooth, TCP, serial devices, the command ring and
+the Android shell commands) behind one interface, selectable by a spec
+string so senders and bridges can be pointed at the simulated ESP32
+"""
+
+import collections
+import os
+import select
+import socket
+import subprocess
+import threading
+import time
+
+import bridge_log
+import metrics
+import shell_worker
+
+try:
+    import termios
+    import tty
+except ImportError:  # Not available on Windows; serial devices are used as-is
+    termios = None
+
+log = bridge_log.get_logger(__name__)
+
+SUBPROCESS_TIMEOUT = 5
+# Long enough for a FallbackTransport to try every Android method in turn
+FALLBACK_SEND_TIMEOUT = 4 * SUBPROCESS_TIMEOUT
+RESPONSE_BACKLOG = 256
+RFCOMM_CHANNEL = 1
+CIRCUIT_FAILURES = 3
+CIRCUIT_COOLDOWN = 60.0
+
+FORWARD_ATTEMPTS = metrics.registry.counter(
+    'esp32_forward_attempts_total', 'Writes tried per forwarding method', ('method', 'result'))
+FORWARD_DURATION = metrics.registry.histogram(
+    'esp32_forward_duration_seconds', 'Time a forwarding method took per write', ('method',))
+
+
+class Transport:
+    """A way of getting commands to the robot
+
+    ``connect`` opens whatever the transport needs and returns the
+    transport, so it can be handed to ESP32Link as its connect callable.
+    ``send`` writes newline-terminated bytes and returns how many were
+    taken, raising on failure. Transports that can hear the robot are
+    ``readable``: they collect its reply lines in ``responses`` and
+    ``read_responses`` waits for new ones.
+    """
+
+    name = 'transport'
+    readable = False
+
+    def __init__(self):
+        self.responses = collections.deque(maxlen=RESPONSE_BACKLOG)
+
+    def connect(self):
+        return self
+
+    def send(self, data):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def read_responses(self, timeout):
+        """Wait up to timeout seconds for reply lines and return those received"""
+        if not self.readable:
+            time.sleep(timeout)
+        # Popped one by one: another thread may be appending meanwhile
+        responses = []
+        while self.responses:
+            responses.append(self.responses.popleft())
+        return responses
+
+    def __repr__(self):
+        return f'<{type(self).__name__} {self.name}>'
+
+
+class _StreamTransport(Transport):
+    """Transport over a connected stream socket
+
+    Replies are drained after every write, as well as by ``read_responses``:
+    a robot that answers PING or UNKNOWN into a socket nobody reads would
+    eventually stall our writes. Replies drained by a write wake a waiting
+    ``read_responses`` through a socket pair, so they are not held until
+    its timeout.
+    """
+
+    readable = True
+
+    def __init__(self):
+        super().__init__()
+        self._sock = None
+        self._partial = b''
+        self._read_lock = threading.Lock()
+        self._wakeup_reader, self._wakeup_writer = socket.socketpair()
+        self._wakeup_reader.setblocking(False)
+        self._wakeup_writer.setblocking(False)
+
+    def connect(self):
+        self.close()
+        self._partial = b''
+        self._sock = self._open()
+        return self
+
+    def send(self, data):
+        if self._sock is None:
+            raise OSError(f'{self.name} is not connected')
+        sent = self._sock.send(data)
+        self._drain()
+        return sent
+
+    def close(self):
+        sock, self._sock = self._sock, None
+        if sock is not None:
+            sock.close()
+
+    def read_responses(self, timeout):
+        sock = self._sock
+        if sock is None:
+            raise OSError(f'{self.name} is not connected')
+        readable, _, _ = select.select([sock, self._wakeup_reader], [], [], timeout)
+        if self._wakeup_reader in readable:
+            self._wakeup_reader.recv(4096)
+        self._drain()
+        return super().read_responses(0)
+
+    def _open(self):
+        raise NotImplementedError
+
+    def _recv_nowait(self, sock):
+        """Return received bytes, None if nothing is waiting, b'' at end of stream"""
+        try:
+            return sock.recv(4096, socket.MSG_DONTWAIT)
+        except (BlockingIOError, InterruptedError):
+            return None
+
+    def _drain(self):
+        with self._read_lock:
+            sock = self._sock
+            while sock is not None:
+                data = self._recv_nowait(sock)
+                if data is None:
+                    return
+                if not data:
+                    raise ConnectionError(f'{self.name} was closed by the robot')
+                lines = (self._partial + data).split(b'\n')
+                self._partial = lines.pop()
+                received = False
+                for line in lines:
+                    line = line.strip()
+                    if line:
+                        self.responses.append(line.decode('utf-8', errors='replace'))
+                        received = True
+                if received:
+                    self._wake_reader()
+
+    def _wake_reader(self):
+        try:
+            self._wakeup_writer.send(b'\0')
+        except BlockingIOError:
+            pass  # Already more wake-ups pending than the reader needs
+
+
+class RfcommTransport(_StreamTransport):
+    """Bluetooth serial port profile connection to the robot"""
+
+    def __init__(self, address, channel=RFCOMM_CHANNEL):
+        super().__init__()
+        self.address = address
+        self.channel = channel
+        self.name = f'rfcomm://{address}'
+
+    def _open(self):
+        import bluetooth  # PyBluez is only needed for real hardware
+
+        sock = bluetooth.BluetoothSocket(bluetooth.RFCOMM)
+        try:
+            sock.connect((self.address, self.channel))
+        except Exception:
+            sock.close()
+            raise
+        return sock
+
+    def _recv_nowait(self, sock):
+        # PyBluez sockets take no recv flags; poll in non-blocking mode instead
+        sock.setblocking(False)
+        try:
+            return sock.recv(4096)
+        except Exception:
+            return None
+        finally:
+            sock.setblocking(True)
+
+
+class TcpTransport(_StreamTransport):
+    """TCP connection, e.g. to esp32_simulator.py or a serial-over-TCP bridge"""
+
+    def __init__(self, host, port):
+        super().__init__()
+        self.address = (host, port)
+        self.name = f'tcp://{host}:{port}'
+
+    def _open(self):
+        sock = socket.create_connection(self.address, timeout=SUBPROCESS_TIMEOUT)
+        sock.settimeout(None)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+
+class FileTransport(Transport):
+    """Appends commands to a file or writes them to a serial device
+
+    Works for plain files as well as /dev/rfcommN, USB serial ports and the
+    pty printed by ``esp32_simulator.py --pty``; terminals are switched to
+    raw mode so the line discipline does not echo or rewrite commands.
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.name = f'file://{path}'
+        self._fd = None
+
+    def connect(self):
+        self.close()
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT | os.O_NOCTTY, 0o644)
+        if termios is not None and os.isatty(self._fd):
+            tty.setraw(self._fd)
+        return self
+
+    def send(self, data):
+        if self._fd is None:
+            raise OSError(f'{self.name} is not open')
+        return os.write(self._fd, data)
+
+    def close(self):
+        fd, self._fd = self._fd, None
+        if fd is not None:
+            os.close(fd)
+
+
+class RingTransport(Transport):
+    """Queues commands in the shared command ring for the sender scripts"""
+
+    name = 'command ring'
+
+    def __init__(self, ring=None):
+        super().__init__()
+        self._ring = ring
+
+    def connect(self):
+        if self._ring is None:
+            import command_ring
+
+            self._ring = command_ring.open_default_ring()
+        return self
+
+    def send(self, data):
+        self.connect()
+        self._ring.append_many(_decode_lines(data))
+        return len(data)
+
+
+class SubprocessTransport(Transport):
+    """Hands each write to a command line, e.g. Android's ``am`` or ``input``
+
+    ``argv`` is a list whose ``{message}`` entries are replaced by the
+    message (without its trailing newline). Commands run on the shared
+    long-lived shell from shell_worker, or through subprocess.run where
+    there is no ``sh``.
+    """
+
+    def __init__(self, name, argv):
+        super().__init__()
+        self.name = name
+        self.argv = argv
+
+    def send(self, data):
+        message = data.decode('utf-8').rstrip('\n')
+        argv = [arg.replace('{message}', message) for arg in self.argv]
+        try:
+            shell_worker.run(argv, SUBPROCESS_TIMEOUT)
+        except FileNotFoundError:  # No sh to keep running (Windows)
+            subprocess.run(argv, check=True, timeout=SUBPROCESS_TIMEOUT)
+        return len(data)
+
+
+def broadcast_transport():
+    """Broadcast to the Serial Terminal app's SEND_MESSAGE receiver"""
+    return SubprocessTransport('broadcast', [
+        'am', 'broadcast', '-a', 'com.serialterminal.SEND_MESSAGE', '--es', 'message', '{message}'
+    ])
+
+
+def input_text_transport():
+    """Type the message into the focused app"""
+    return SubprocessTransport('input command', ['input', 'text', '{message}'])
+
+
+def service_call_transport():
+    """Inject the message through the input service"""
+    return SubprocessTransport('service call', ['service', 'call', 'input', '1', 's16', '{message}'])
+
+
+class _MethodStats:
+    """Outcome counters and circuit-breaker state of one FallbackTransport member"""
+
+    __slots__ = ('successes', 'failures', 'consecutive_failures', 'total_latency',
+                 'open_until', 'last_error')
+
+    def __init__(self):
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.total_latency = 0.0
+        self.open_until = 0.0
+        self.last_error = None
+
+    def snapshot(self, now):
+        attempts = self.successes + self.failures
+        return {
+            'successes': self.successes,
+            'failures': self.failures,
+            'avg_latency_ms': round(self.total_latency / attempts * 1000, 1) if attempts else None,
+            'circuit': 'open' if self.open_until > now else 'closed',
+            'last_error': self.last_error
+        }
+
+
+class FallbackTransport(Transport):
+    """Tries transports until one accepts the write, learning which to try first
+
+    The member that last succeeded is tried first. A member that fails
+    CIRCUIT_FAILURES times in a row is skipped for CIRCUIT_COOLDOWN seconds,
+    after which it gets one trial write again. Members are connected on first
+    use and kept open; one that fails is closed and reconnected the next
+    time it is tried. ``stats`` reports outcomes and latency per member.
+    """
+
+    def __init__(self, transports):
+        super().__init__()
+        self.transports = transports
+        self.name = ','.join(transport.name for transport in transports)
+        self.preferred = None
+        self._connected = set()
+        self._stats = {transport: _MethodStats() for transport in transports}
+        self._lock = threading.Lock()
+
+    def connect(self):
+        # Members connect lazily in send, so one being down doesn't stop the rest
+        return self
+
+    def send(self, data):
+        errors = []
+        for transport in self._attempt_order():
+            started = time.monotonic()
+            try:
+                if transport not in self._connected:
+                    transport.connect()
+                    self._connected.add(transport)
+                sent = transport.send(data)
+            except Exception as e:
+                log.warning("❌ %s failed: %s", transport.name, e,
+                            extra=bridge_log.fields(method=transport.name, error=str(e)))
+                errors.append(f'{transport.name}: {e}')
+                self._connected.discard(transport)
+                transport.close()
+                self._record(transport, started, e)
+                continue
+            self._record(transport, started, None)
+            log.info("✅ Message sent via %s", transport.name,
+                     extra=bridge_log.fields(sampled=True, method=transport.name))
+            self.responses.extend(transport.responses)
+            transport.responses.clear()
+            return sent
+        if not errors:
+            raise OSError('All forwarding methods are cooling down after failures')
+        raise OSError('All forwarding methods failed: ' + '; '.join(errors))
+
+    def close(self):
+        self._connected.clear()
+        for transport in self.transports:
+            transport.close()
+
+    def stats(self):
+        """Per-member outcome counters, latency and circuit state"""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                'preferred': self.preferred.name if self.preferred else None,
+                'methods': {transport.name: self._stats[transport].snapshot(now)
+                            for transport in self.transports}
+            }
+
+    def _attempt_order(self):
+        now = time.monotonic()
+        with self._lock:
+            order = [transport for transport in self.transports
+                     if self._stats[transport].open_until <= now]
+        if self.preferred in order:
+            order.remove(self.preferred)
+            order.insert(0, self.preferred)
+        return order
+
+    def _record(self, transport, started, error):
+        elapsed = time.monotonic() - started
+        FORWARD_ATTEMPTS.inc(method=transport.name, result='success' if error is None else 'failure')
+        FORWARD_DURATION.observe(elapsed, method=transport.name)
+        with self._lock:
+            stats = self._stats[transport]
+            stats.total_latency += elapsed
+            if error is None:
+                stats.successes += 1
+                stats.consecutive_failures = 0
+                self.preferred = transport
+                return
+
+            stats.failures += 1
+            stats.consecutive_failures += 1
+            stats.last_error = str(error)
+            if stats.consecutive_failures >= CIRCUIT_FAILURES:
+                stats.open_until = time.monotonic() + CIRCUIT_COOLDOWN
+                log.warning(f"⏸️  Skipping {transport.name} for {CIRCUIT_COOLDOWN:.0f}s after "
+                            f"{stats.consecutive_failures} failures")
+            if self.preferred is transport:
+                self.preferred = None
+
+
+def make_transport(spec):
+    """Build a transport from a spec string
+
+    ``rfcomm://AA:BB:CC:DD:EE:FF``, ``tcp://host:port``, ``file:///path``
+    (also ``serial:///dev/pts/N``), ``ring``, ``broadcast``, ``input`` or
+    ``service``; a comma-separated list builds a FallbackTransport.
+    """
+    if ',' in spec:
+        return FallbackTransport([make_transport(part.strip()) for part in spec.split(',')])
+
+    scheme, _, rest = spec.partition('://')
+    if scheme == 'rfcomm' and rest:
+        return RfcommTransport(rest)
+    if scheme == 'tcp' and rest:
+        host, _, port = rest.rpartition(':')
+        return TcpTransport(host or '127.0.0.1', int(port))
+    if scheme in ('file', 'serial') and rest:
+        return FileTransport(rest)
+    if spec == 'ring':
+        return RingTransport()
+    if spec == 'broadcast':
+        return broadcast_transport()
+    if spec == 'input':
+        return input_text_transport()
+    if spec == 'service':
+        return service_call_transport()
+    raise ValueError(f'Unknown transport: {spec}')
+
+
+def _decode_lines(data):
+    return data.decode('utf-8').rstrip('\n').split('\n')